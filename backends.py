@@ -0,0 +1,102 @@
+#!/usr/bin/env/python3
+
+#
+# standard python modules
+#
+import os
+import re
+
+#
+# my own modules
+#
+import jobserver
+from process import nonnull,nonzero_keyword
+
+##
+## Build backends
+## command, option for the number of jobs, and how to name a target;
+## `tool` is the program that has to join the jobserver.
+##
+backends = {
+    "make"  : { "command":"make --no-print-directory V=1 VERBOSE=1",
+                "jobs":"-j {jcount}", "target":"{target}", "tool":"make", },
+    "ninja" : { "command":"ninja -v",
+                "jobs":"-j {jcount}", "target":"{target}", "tool":"ninja", },
+    "cmake" : { "command":"cmake --build . --verbose",
+                "jobs":"--parallel {jcount}", "target":"--target {target}", "tool":None, },
+}
+
+##
+## Description: the generator a cmake build directory was configured with
+## Result: "ninja" or "make"
+##
+def cmake_generator( builddir ):
+    try:
+        with open( f"{builddir}/CMakeCache.txt","r" ) as cache:
+            for line in cache:
+                if generator := re.match( r'^CMAKE_GENERATOR:INTERNAL=(.*)$',line ):
+                    return "ninja" if "Ninja" in generator.group(1) else "make"
+    except FileNotFoundError: pass
+    if os.path.exists( f"{builddir}/build.ninja" ):
+        return "ninja"
+    return "make"
+
+##
+## Description: backend for a cmake build directory
+## `buildbackend` can be make, ninja, or cmake for `cmake --build`;
+## by default the configured generator decides.
+## Result: pair backend,tool that does the actual work
+##
+def cmake_backend( builddir,**kwargs ):
+    generator = cmake_generator( builddir )
+    backend = kwargs.get( "buildbackend","" ).lower()
+    if not nonnull( backend ) or backend=="auto":
+        backend = generator
+    if backend not in backends:
+        raise Exception( f"Unknown build backend: {backend}; use one of {list(backends)}" )
+    if backend!="cmake" and backend!=generator:
+        raise Exception( f"Build backend {backend} can not build a tree configured for {generator}" )
+    return backend,backends[backend]["tool"] or generator
+
+##
+## Description: command line to build a target, default target if empty
+##
+def build_command( backend,target="",tool=None,**kwargs ):
+    spec = backends[backend]
+    prefix,shared = jobserver.jobserver_prefix( tool or spec["tool"],**kwargs )
+    cmdline = f"{prefix}{spec['command']}"
+    if not shared:
+        # the jobserver decides the number of jobs
+        cmdline += " "+spec["jobs"].format( jcount=kwargs.get("jcount","6") )
+    if nonnull( target ):
+        cmdline += " "+spec["target"].format( target=target )
+    return cmdline
+
+##
+## Description: the `configinbuilddir` setting: yes, no, or by default auto
+##
+def configinbuilddir_setting( **kwargs ):
+    setting = nonzero_keyword( "configinbuilddir",**kwargs ) or "auto"
+    if setting.lower() in [ "no","off","0","false", ]:
+        return "no"
+    return "auto" if setting.lower()=="auto" else "yes"
+
+##
+## Description: configure this autotools package outside the source tree?
+## By default, with `configinbuilddir` auto, if the automake makefiles
+## support it and the source tree has not been configured itself,
+## for instance by autogen; always with yes, never with no.
+## Ask only after autogen or autoreconf have finished.
+##
+def autotools_out_of_tree( srcdir,**kwargs ):
+    if ( inbuilddir := configinbuilddir_setting( **kwargs ) )!="auto":
+        return inbuilddir=="yes"
+    if nonzero_keyword( "configuresubdir",**kwargs ) or nonzero_keyword( "makesubdir",**kwargs ):
+        return False
+    if os.path.exists( f"{srcdir}/config.status" ):
+        return False
+    try:
+        with open( f"{srcdir}/Makefile.in","r" ) as makefile:
+            return re.search( r'^VPATH\s*=\s*@srcdir@',makefile.read(),re.MULTILINE ) is not None
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+##
+## Benchmark of the log pipeline:
+## a child process prints lines like a verbose build,
+## which are read and written to two logfiles, with the terminal output thrown away.
+## Compares a line-by-line loop with process.process_terminate.
+##
+## usage: python3 benchmarks/bench_logging.py [ nlines [ compression ] ]
+##
+
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert( 0,os.path.join( os.path.dirname( os.path.abspath(__file__) ),".." ) )
+import process
+
+def build_output( nlines,logdir ):
+    with open( f"{logdir}/output.txt","w" ) as output:
+        for i in range( nlines ):
+            output.write( f"  /usr/bin/c++ -O2 -I/opt/include -c /src/file{i}.cxx -o CMakeFiles/lib.dir/file{i}.o  \n" )
+
+def child( nlines ):
+    shell = process.process_initiate()
+    shell.stdin.write( f"cat output.txt\n" )
+    return shell
+
+def line_loop( nlines,logdir,compression ):
+    # the per-line loop of earlier versions
+    terminal = open( os.devnull,"w" )
+    logs = [ open( f"{logdir}/loop{i}.log","w" ) for i in range(2) ]
+    shell = child( nlines ); shell.stdin.close()
+    while line := shell.stdout.readline():
+        line = re.sub( r'^[ \t]*','', re.sub( r'[ \t\n]*$','', line ) )
+        if line!="":
+            print( line,file=terminal )
+            for log in logs: print( line,file=log )
+    shell.wait()
+    for log in logs: log.close()
+
+def pipeline( nlines,logdir,compression ):
+    terminal = open( os.devnull,"w" )
+    logs = [ process.LogWriter( f"{logdir}/pipeline{i}.log",compression ) for i in range(2) ]
+    shell = child( nlines )
+    process.process_terminate\
+        ( shell,terminal=terminal,logfiles={ log.name:log for log in logs } )
+    for log in logs: log.close()
+
+if __name__=="__main__":
+    nlines      = int( sys.argv[1] ) if len(sys.argv)>1 else 1000000
+    compression = sys.argv[2] if len(sys.argv)>2 else ""
+    with tempfile.TemporaryDirectory() as logdir:
+        build_output( nlines,logdir )
+        os.chdir( logdir )
+        for name,function in [ [ "line loop",line_loop ], [ "pipeline ",pipeline ], ]:
+            start = time.perf_counter()
+            function( nlines,logdir,compression )
+            elapsed = time.perf_counter()-start
+            print( f"{name}: {nlines/elapsed:12.0f} lines/sec" )
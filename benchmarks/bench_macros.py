@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+##
+## Benchmark of macro expansion in configuration files:
+## a synthetic environment of 1000 TACC_* macros
+## and a configuration that refers to some of them.
+## Compares the old replace-every-macro loop with config.expand_configuration.
+##
+## usage: python3 benchmarks/bench_macros.py [ nmacros [ nsettings ] ]
+##
+
+import os
+import sys
+import time
+
+sys.path.insert( 0,os.path.join( os.path.dirname( os.path.abspath(__file__) ),".." ) )
+import config
+
+def synthetic( nmacros,nsettings ):
+    macros = {}
+    for m in range( nmacros//4 ):
+        for ext in [ "DIR", "INC", "LIB", "BIN", ]:
+            macros[ f"TACC_MOD{m}_{ext}" ] = f"/opt/apps/mod{m}/{ext.lower()}"
+    macros["PACKAGEVERSION"] = "1.2.3"
+    settings = {}
+    for s in range( nsettings ):
+        m = ( s*37 ) % ( nmacros//4 )
+        settings[ f"setting{s}" ] = \
+            f"-D MOD{m}_ROOT=${{TACC_MOD{m}_DIR}} -I${{TACC_MOD{m}_INC}} -v ${{PACKAGEVERSION}}"
+    return macros,settings
+
+def replace_loop( settings,macros ):
+    expanded = {}
+    for key,val in settings.items():
+        for m in macros:
+            val = val.replace( '${'+m+'}',macros[m] )
+        expanded[key] = val
+    return expanded
+
+def engine( settings,macros ):
+    expanded = dict( settings )
+    config.expand_configuration( expanded,macros )
+    return expanded
+
+def timing( function,*args,repeat=5 ):
+    best = None
+    for r in range(repeat):
+        start = time.perf_counter()
+        result = function( *args )
+        elapsed = time.perf_counter()-start
+        best = elapsed if best is None else min( best,elapsed )
+    return best,result
+
+if __name__=="__main__":
+    nmacros   = int( sys.argv[1] ) if len(sys.argv)>1 else 1000
+    nsettings = int( sys.argv[2] ) if len(sys.argv)>2 else 200
+    macros,settings = synthetic( nmacros,nsettings )
+    old,old_result = timing( replace_loop,settings,macros )
+    new,new_result = timing( engine,settings,macros )
+    assert old_result==new_result
+    print( f"{len(macros)} macros, {len(settings)} settings" )
+    print( f"replace loop: {old*1000:8.2f} ms" )
+    print( f"expansion   : {new*1000:8.2f} ms  ({old/new:.0f}x)" )
@@ -0,0 +1,195 @@
+#!/usr/bin/env/python3
+
+##
+## Configure-check caches per environment code and mode
+## autoconf cache variables and the cmake compiler identification
+## are kept in {cache_root}/configure/{envcode}-{mode},
+## and thrown away when the compilers change.
+## Autoconf results also depend on the loaded modules and the flags,
+## so there is one autoconf cache file for each combination of these.
+##
+
+#
+# standard python modules
+#
+import fcntl
+import filecmp
+import glob
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+
+#
+# my own modules
+#
+import fingerprint
+import modules
+import names
+from process import echo_string,trace_string,nonzero_keyword
+
+# settings and environment variables that go into compile and link tests
+flag_settings  = [ "cflags", "cxxflags", "fflags", ]
+flag_variables = [ "CFLAGS", "CXXFLAGS", "FFLAGS", "CPPFLAGS", "LDFLAGS", "LIBS", ]
+
+def cache_dir( **kwargs ):
+    # seq, omp and core share an environment code, but not their compilers
+    return f"{names.cache_root()}/configure/{names.environment_code( **kwargs )}-{kwargs.get( 'mode','' )}"
+
+def cache_lock( root ):
+    lock = open( f"{root}/.lock","a" )
+    fcntl.flock( lock,fcntl.LOCK_EX )
+    return lock
+
+def copy_atomic( source,target ):
+    shutil.copyfile( source,f"{target}.{os.getpid()}" )
+    os.replace( f"{target}.{os.getpid()}",target )
+
+##
+## Description: cache directory for this environment code, emptied if the compilers changed
+## Result: directory name, or None if the cache is not used
+##
+def check_cache( **kwargs ):
+    if not nonzero_keyword( "configurecache",**kwargs ):
+        return None
+    root = cache_dir( **kwargs )
+    os.makedirs( root,exist_ok=True )
+    h = hashlib.sha256()
+    fingerprint.compilers_fingerprint( h,**kwargs )
+    compilers = h.hexdigest()
+    with cache_lock( root ):
+        try:
+            with open( f"{root}/compilers","r" ) as stamp:
+                current = stamp.read().strip()==compilers
+        except FileNotFoundError:
+            current = False
+        if not current:
+            trace_string( f"Compilers changed: clearing configure cache {root}",**kwargs )
+            for entry in os.listdir( root ):
+                if entry==".lock": continue
+                if os.path.isdir( f"{root}/{entry}" ):
+                    shutil.rmtree( f"{root}/{entry}" )
+                else: os.unlink( f"{root}/{entry}" )
+            with open( f"{root}/compilers","w" ) as stamp:
+                stamp.write( f"{compilers}\n" )
+    return root
+
+##
+## Autoconf
+## every configure gets a private copy of the shared cache file,
+## its new results are merged back afterwards.
+## The `ac_cv_env_` variables record the environment of one configure, and are not shared.
+##
+cache_variable = re.compile( r'([A-Za-z_][A-Za-z0-9_]*)[=+]' )
+
+def autoconf_entries( filename ):
+    entries = {}
+    try:
+        with open( filename,"r" ) as cache:
+            for line in cache:
+                if line.startswith( "#" ) or not ( variable := cache_variable.search( line ) ):
+                    continue
+                if not variable.group(1).startswith( "ac_cv_env_" ):
+                    entries[ variable.group(1) ] = line
+    except FileNotFoundError: pass
+    return entries
+
+def write_autoconf_entries( entries,filename ):
+    with open( f"{filename}.{os.getpid()}","w" ) as cache:
+        cache.write( "".join( entries[k] for k in sorted(entries) ) )
+    os.replace( f"{filename}.{os.getpid()}",filename )
+
+##
+## Description: the shared autoconf cache for the loaded modules and the flags
+##
+def autoconf_cache_file( root,**kwargs ):
+    h = hashlib.sha256()
+    for module,version in modules.loaded_modules( **{ **kwargs,"terminal":None } ):
+        h.update( f"{module}/{version}\n".encode() )
+    for key in flag_settings:
+        h.update( f"{key}={kwargs.get( key,'' )}\n".encode() )
+    for variable in flag_variables:
+        h.update( f"{variable}={os.getenv( variable,'' )}\n".encode() )
+    return f"{root}/config-{h.hexdigest()[:16]}.cache"
+
+##
+## Description: seed a private cache file in the builddir
+## Result: configure option, empty if the cache is not used
+##
+def autoconf_cache_option( builddir,**kwargs ):
+    if ( root := check_cache( **kwargs ) ) is None:
+        return ""
+    entries = autoconf_entries( autoconf_cache_file( root,**kwargs ) )
+    write_autoconf_entries( entries,f"{builddir}/config.cache" )
+    echo_string( f"Configure cache with {len(entries)} results from {root}",**kwargs )
+    return f"--cache-file={builddir}/config.cache"
+
+def autoconf_cache_store( srcdir,builddir,**kwargs ):
+    if ( root := check_cache( **kwargs ) ) is None:
+        return
+    if not fingerprint.configure_done( srcdir,builddir ):
+        return
+    shared = autoconf_cache_file( root,**kwargs )
+    with cache_lock( root ):
+        entries = autoconf_entries( shared )
+        entries.update( autoconf_entries( f"{builddir}/config.cache" ) )
+        write_autoconf_entries( entries,shared )
+
+##
+## CMake
+## the platform and compiler files from CMakeFiles/<version> are copied into a new builddir,
+## and an initial cache tells cmake that they are valid,
+## so that compiler identification and ABI detection are skipped.
+## Languages that are not in the cache are detected as usual.
+##
+def cmake_version( **kwargs ):
+    cmake = kwargs.get( "cmakename","cmake" ).split()[0]
+    try:
+        output = subprocess.run( [ cmake,"--version" ],capture_output=True,text=True ).stdout
+    except OSError:
+        return None
+    if version := re.search( r'version ([0-9][0-9.]*)',output ):
+        return version.group(1)
+    return None
+
+def cmake_cache_seed( builddir,**kwargs ):
+    # Result: option for an initial cache, empty if the cache is not used
+    if ( root := check_cache( **kwargs ) ) is None:
+        return ""
+    if re.search( r'_COMPILER=|CMAKE_TOOLCHAIN_FILE',kwargs.get( "cmakeflags","" ) ):
+        return ""
+    if ( version := cmake_version( **kwargs ) ) is None \
+       or not os.path.exists( f"{root}/cmake/{version}/CMakeSystem.cmake" ):
+        return ""
+    platform = f"{builddir}/CMakeFiles/{version}"
+    os.makedirs( platform,exist_ok=True )
+    files = glob.glob( f"{root}/cmake/{version}/CMake*.cmake" )
+    for file in files:
+        shutil.copyfile( file,f"{platform}/{os.path.basename(file)}" )
+    initial = f"{root}/cmake/initial-{version}.cmake"
+    if not os.path.exists( initial ):
+        with open( f"{initial}.{os.getpid()}","w" ) as cache:
+            cache.write( "set( CMAKE_PLATFORM_INFO_INITIALIZED 1 CACHE INTERNAL \"\" )\n" )
+        os.replace( f"{initial}.{os.getpid()}",initial )
+    echo_string( f"Compiler identification from {root}: "
+                 +" ".join( os.path.basename(f) for f in files ),**kwargs )
+    return f"-C {initial}"
+
+def cmake_cache_store( builddir,**kwargs ):
+    if ( root := check_cache( **kwargs ) ) is None:
+        return
+    if not os.path.exists( f"{builddir}/CMakeCache.txt" ) \
+       or ( version := cmake_version( **kwargs ) ) is None:
+        return
+    os.makedirs( f"{root}/cmake/{version}",exist_ok=True )
+    with cache_lock( root ):
+        for file in [ "CMakeSystem.cmake" ] \
+            + [ os.path.basename(f) for f in
+                glob.glob( f"{builddir}/CMakeFiles/{version}/CMake*Compiler.cmake" ) ]:
+            source = f"{builddir}/CMakeFiles/{version}/{file}"
+            target = f"{root}/cmake/{version}/{file}"
+            # the latest configure has the latest identification
+            if os.path.exists( source ) and \
+               not ( os.path.exists( target ) and filecmp.cmp( source,target,shallow=False ) ):
+                copy_atomic( source,target )
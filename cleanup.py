@@ -0,0 +1,154 @@
+#!/usr/bin/env/python3
+
+##
+## Background removal of directories
+## a directory is renamed to a trash name next to it, which is instantaneous,
+## and then removed by a pool of threads, one subtree per task.
+## At exit mpm waits for the removal to finish, and removes what is left itself
+## when no threads can be started any more; trash left by a process
+## that died is removed at the start of the next run.
+##
+
+#
+# standard python modules
+#
+import atexit
+import os
+import re
+import shutil
+import socket
+import sys
+import threading
+import time
+
+#
+# my own modules
+#
+from process import echo_string,trace_string
+
+trash_prefix = ".mrpackmod-trash"
+delete_workers = 8
+# trash of other hosts is only removed when it is this old
+foreign_age = 24*3600
+
+removals = []
+trash_count = [ 0 ]
+
+def trash_name( path ):
+    parent = os.path.dirname( os.path.abspath( path ) )
+    trash_count[0] += 1
+    return f"{parent}/{trash_prefix}-{socket.gethostname()}-{os.getpid()}-{trash_count[0]}"
+
+##
+## Description: remove a tree with a thread pool;
+## the top two levels are split into separate tasks
+##
+def remove_tree( trash ):
+    subtrees = []
+    try:
+        for entry in os.scandir( trash ):
+            if entry.is_dir( follow_symlinks=False ):
+                try:
+                    subtrees.extend( e.path for e in os.scandir( entry.path ) )
+                except OSError: subtrees.append( entry.path )
+            else: subtrees.append( entry.path )
+    except FileNotFoundError:
+        return
+    def remove():
+        # plain threads: an executor refuses work once the interpreter shuts down
+        while True:
+            try:
+                path = subtrees.pop()
+            except IndexError:
+                return
+            if os.path.isdir( path ) and not os.path.islink( path ):
+                shutil.rmtree( path,ignore_errors=True )
+            else:
+                try:
+                    os.unlink( path )
+                except OSError: pass
+    workers = [ threading.Thread( target=remove,daemon=True ) for _ in range(delete_workers) ]
+    started = []
+    for w in workers:
+        try:
+            w.start()
+        except RuntimeError:
+            # no new threads during interpreter shutdown
+            break
+        started.append( w )
+    remove()
+    for w in started: w.join()
+    shutil.rmtree( trash,ignore_errors=True )
+
+def remove_in_background( trash,**kwargs ):
+    thread = threading.Thread( target=remove_tree,args=(trash,),daemon=True )
+    try:
+        thread.start()
+    except RuntimeError:
+        remove_tree( trash )
+        return
+    # the logfiles may be closed at exit, so only the terminal is kept
+    removals.append( ( trash,thread,{ "terminal":kwargs.get( "terminal",sys.stdout ) } ) )
+    trace_string( f"Removing {trash} in the background",**kwargs )
+
+##
+## Description: move a directory out of the way and remove it in the background
+##
+def discard_tree( path,**kwargs ):
+    if not os.path.lexists( path ):
+        return
+    trash = trash_name( path )
+    try:
+        os.rename( path,trash )
+    except OSError:
+        shutil.rmtree( path )
+        return
+    remove_in_background( trash,**kwargs )
+
+def trash_is_stale( name,path ):
+    if not ( fields := re.match( f"^{re.escape(trash_prefix)}-(.*)-([0-9]+)-([0-9]+)$",name ) ):
+        return False
+    host,pid = fields.group(1),int( fields.group(2) )
+    if host!=socket.gethostname():
+        try:
+            return time.time()-os.lstat( path ).st_ctime>foreign_age
+        except OSError:
+            return False
+    if pid==os.getpid():
+        return False
+    try:
+        os.kill( pid,0 )
+        return False
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+
+##
+## Description: remove trash in this directory left by processes that died
+##
+def reap_trash( directory,**kwargs ):
+    try:
+        entries = [ e for e in os.scandir( directory ) if e.name.startswith( trash_prefix ) ]
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if trash_is_stale( entry.name,entry.path ):
+            # claim it, so that concurrent runs do not both remove it
+            trash = trash_name( entry.path )
+            try:
+                os.rename( entry.path,trash )
+            except OSError: continue
+            echo_string( f"Removing leftover {entry.path}",**kwargs )
+            remove_in_background( trash,**kwargs )
+
+def wait_for_removals():
+    for trash,thread,terminal in removals:
+        if thread.is_alive():
+            echo_string( f"Waiting for removal of {trash}",**terminal )
+            thread.join()
+        # a thread that could not finish its work leaves it to the hook
+        remove_tree( trash )
+    removals.clear()
+
+atexit.register( wait_for_removals )
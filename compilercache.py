@@ -0,0 +1,200 @@
+#!/usr/bin/env/python3
+
+##
+## Compiler cache: ccache or sccache
+## each environment code gets its own cache directory with a size cap.
+## The cache settings are passed to the configure shells and build steps
+## in their `environment` keyword; the environment of mpm itself is not changed.
+## Every build counts its own hits and misses: ccache logs them in the builddir,
+## and sccache gets a server of its own for each builddir, on a port that the build
+## claims with a lock file, so that concurrent builds do not share a server.
+##
+
+#
+# standard python modules
+#
+import fcntl
+import json
+import os
+import shutil
+import socket
+import subprocess
+import zlib
+
+#
+# my own modules
+#
+import names
+from process import echo_string,nonnull
+
+# languages the caches can handle
+cached_compilers = [ "CC","CXX", ]
+cmake_languages  = [ "C","CXX", ]
+# statistics of ccache's log that are hits and misses
+ccache_hits   = [ "direct_cache_hit","preprocessed_cache_hit", ]
+ccache_misses = [ "cache_miss", ]
+ccache_log    = ".mrpackmod-ccache.log"
+
+# ports for the sccache servers
+sccache_ports = ( 10000,30000 )
+
+compiler_caches = {}
+
+##
+## Description: a port for the sccache server of this build: starting from one
+## that follows from the builddir, the first that no other build has claimed and that is free.
+## The claim is a lock on a file, held until the server is stopped, or this process ends.
+## Result: pair port,file descriptor of the claim
+##
+def claim_port( builddir ):
+    claims = f"{names.cache_root()}/compiler/ports"
+    os.makedirs( claims,exist_ok=True )
+    low,high = sccache_ports
+    first = zlib.crc32( builddir.encode() )%(high-low)
+    for i in range( high-low ):
+        port = low+( first+i )%(high-low)
+        claim = os.open( f"{claims}/{port}",os.O_RDWR|os.O_CREAT,0o600 )
+        try:
+            fcntl.flock( claim,fcntl.LOCK_EX|fcntl.LOCK_NB )
+        except BlockingIOError:
+            os.close( claim ); continue
+        # a server left by a build that died, or some other program
+        with socket.socket( socket.AF_INET,socket.SOCK_STREAM ) as probe:
+            try:
+                probe.bind( ( "127.0.0.1",port ) )
+            except OSError:
+                os.close( claim ); continue
+        return port,claim
+    raise Exception( f"No free port for sccache in {low}-{high}" )
+
+##
+## Description: find the cache program and its environment for this build
+## Result: dict with program, kind, directory, and environment; None if not used
+##
+def compiler_cache( **kwargs ):
+    if not nonnull( setting := kwargs.get( "compilercache","" ) ):
+        return None
+    envcode = names.environment_code( **kwargs )
+    builddir = names.builddir_name( **kwargs )
+    if ( envcode,builddir ) in compiler_caches:
+        return compiler_caches[ ( envcode,builddir ) ]
+    program = shutil.which( setting )
+    kind = os.path.basename( setting ).lower()
+    if program is None or kind not in [ "ccache","sccache", ]:
+        echo_string( f"WARNING compiler cache not available: {setting}",**kwargs )
+        compiler_caches[ ( envcode,builddir ) ] = None
+        return None
+    root = kwargs.get( "compilercachedir","" )
+    if not nonnull( root ):
+        root = f"{names.cache_root()}/compiler"
+    directory = f"{root}/{envcode}"
+    os.makedirs( directory,exist_ok=True )
+    size = kwargs.get( "compilercachesize","" ) or "20G"
+    if kind=="ccache":
+        environment = { "CCACHE_DIR":directory, "CCACHE_MAXSIZE":size,
+                        "CCACHE_STATSLOG":f"{builddir}/{ccache_log}", }
+        srcdir = names.srcdir_name( **kwargs )
+        # relative paths, so that other versions of this package can hit
+        if ( base := os.path.commonpath( [ srcdir,builddir ] ) )!="/":
+            environment["CCACHE_BASEDIR"] = base
+        claim = None
+    else:
+        # one server per build, so that its statistics are of this build only
+        port,claim = claim_port( builddir )
+        environment = { "SCCACHE_DIR":directory, "SCCACHE_CACHE_SIZE":size,
+                        "SCCACHE_SERVER_PORT":str(port), }
+    cache = { "program":program, "kind":kind, "dir":directory, "environment":environment,
+              "claim":claim, }
+    echo_string( f"Compiler cache: {kind} in {directory}, at most {size}",**kwargs )
+    compiler_caches[ ( envcode,builddir ) ] = cache
+    return cache
+
+##
+## Description: environment variables for the processes that compile
+##
+def cache_environment( **kwargs ):
+    if ( cache := compiler_cache( **kwargs ) ) is None:
+        return {}
+    return cache["environment"]
+
+##
+## Description: compiler setting with the cache in front, for configure scripts
+##
+def wrapped_compiler( key,program,**kwargs ):
+    if key in cached_compilers and ( cache := compiler_cache( **kwargs ) ) is not None:
+        return f"\"{cache['program']} {program}\""
+    return program
+
+##
+## Description: cmake options that run the compilers through the cache
+##
+def cmake_launchers( **kwargs ):
+    if ( cache := compiler_cache( **kwargs ) ) is None:
+        return ""
+    return " ".join( f"-D CMAKE_{lang}_COMPILER_LAUNCHER={cache['program']}" for lang in cmake_languages )
+
+##
+## Description: hit and miss counters of this build
+## Result: pair hits,misses; None if the program can not tell
+##
+def cache_statistics( cache ):
+    environment = { **os.environ,**cache["environment"] }
+    try:
+        if cache["kind"]=="ccache":
+            hits = misses = 0
+            with open( cache["environment"]["CCACHE_STATSLOG"],"r" ) as log:
+                for line in log:
+                    if ( statistic := line.strip() ) in ccache_hits:
+                        hits += 1
+                    elif statistic in ccache_misses:
+                        misses += 1
+            return hits,misses
+        output = subprocess.run( [ cache["program"],"--show-stats","--stats-format","json" ],
+                                 capture_output=True,text=True,check=True,env=environment ).stdout
+        stats = json.loads( output )["stats"]
+        return ( sum( stats["cache_hits"]["counts"].values() ),
+                 sum( stats["cache_misses"]["counts"].values() ) )
+    except FileNotFoundError:
+        return 0,0
+    except ( OSError,subprocess.CalledProcessError,ValueError,KeyError ):
+        return None
+
+##
+## Description: start counting for this build
+##
+def statistics_start( **kwargs ):
+    if ( cache := compiler_cache( **kwargs ) ) is None:
+        return None
+    try:
+        if cache["kind"]=="ccache":
+            os.remove( cache["environment"]["CCACHE_STATSLOG"] )
+        else:
+            subprocess.run( [ cache["program"],"--zero-stats" ],capture_output=True,
+                            env={ **os.environ,**cache["environment"] } )
+    except OSError: pass
+    return cache_statistics( cache )
+
+##
+## Description: report the hits and misses since `statistics_start`;
+## the sccache server of this build is stopped
+##
+def statistics_report( before,**kwargs ):
+    if before is None or ( cache := compiler_cache( **kwargs ) ) is None:
+        return
+    after = cache_statistics( cache )
+    if cache["kind"]=="sccache":
+        try:
+            subprocess.run( [ cache["program"],"--stop-server" ],capture_output=True,
+                            env={ **os.environ,**cache["environment"] } )
+        except OSError: pass
+        # the port is free for other builds; a later step of this build claims one again
+        os.close( cache["claim"] )
+        compiler_caches.pop( ( names.environment_code( **kwargs ),names.builddir_name( **kwargs ) ),None )
+    if after is None:
+        return
+    hits,misses = after[0]-before[0],after[1]-before[1]
+    if hits+misses==0:
+        echo_string( f"Compiler cache: no cacheable compilations",**kwargs )
+    else:
+        echo_string( f"Compiler cache: {hits} hits, {misses} misses, hit rate {100*hits/(hits+misses):.0f}%",
+                     **kwargs )
@@ -1,6 +1,9 @@
 ##
 ## standard python modules
 ##
+import glob
+import hashlib
+import json
 import re
 import os
 
@@ -8,36 +11,108 @@ import os
 # my modules
 #
 import modules
+import names
 from process import echo_string,nonnull,nonzero_env,abort_on_zero_keyword
 
-def setting_from_env_or_rc( name,env,default,rc_files ):
-    val = ""
-    for file in rc_files:
-        with open( file,"r" ) as rc:
-            for line in rc.readlines():
-                line = line.strip()
-                if re.match( r"\s*#",line ): continue
-                if re.match( name,line ):
-                    val = re.search( fr"^\s*{name}\s*=\s*([A-Za-z0-9_]+)\s*$",line ).groups()[0]
-                    #print( f"found setting for {name}: {val}" )
-                    return val
+##
+## Description: parse an rc file once
+## Result: dict of setting name to value, first occurrence wins
+##
+def parse_rc_file( file ):
+    settings = {}
+    with open( file,"r" ) as rc:
+        for line in rc:
+            if setting := re.match( r"^\s*([A-Za-z0-9_]+)\s*=\s*(\S.*?)\s*$",line ):
+                settings.setdefault( *setting.groups() )
+    return settings
+
+def rc_settings( rc_files ):
+    settings = {}
+    for file in reversed( rc_files ):
+        settings.update( parse_rc_file( file ) )
+    return settings
+
+def setting_from_env_or_rc( name,env,default,rc ):
+    if name in rc:
+        return rc[name]
     return os.getenv( env,default )
 
-def config_from_rc_files( config_dict,macros ):
+# configuration key, rc setting, environment variable, default
+rc_table = [
+    [ 'system',"SYSTEM","TACC_SYSTEM","UNKNOWN_SYSTEM", ],
+    # paths
+    [ 'homedir',"HOMEDIR", "HOMEDIR", "NO_HOMEDIR_GIVEN", ],
+    [ 'srcpath',"SRCPATH", "SRCPATH", "", ],
+    [ 'packageroot',"PACKAGEROOT", "PACKAGEROOT","NO_PACKAGEROOT_GIVEN", ],
+    [ 'installroot',"INSTALLROOT", "INSTALLROOT","NO_INSTALLROOT_GIVEN", ],
+    [ 'installpath',"INSTALLPATH", "INSTALLPATH","", ],
+    [ 'builddirroot',"BUILDDIRROOT", "BUILDDIRROOT","", ],
+    [ 'moduleroot',"MODULEROOT", "MODULEROOT","NO_MODULEROOT_GIVEN", ],
+    [ 'moduledir',"MODULEDIR", "MODULEDIR","", ],
+    # compiler
+    [ 'compiler',"COMPILER", "TACC_FAMILY_COMPILER","UNKNOWN_COMPILER", ],
+    [ 'compilerversion',"COMPILERVERSION", "TACC_FAMILY_COMPILER_VERSION","UNKNOWN_COMPILER_VERSION", ],
+    [ 'mpi',"MPI", "TACC_FAMILY_MPI","UNKNOWN_MPI", ],
+    [ 'mpiversion',"MPIVERSION", "TACC_FAMILY_MPI_VERSION","UNKNOWN_MPI_VERSION", ],
+    # optional stuff
+    [ 'installext',"INSTALLEXT", "INSTALLEXT", "", ],
+    [ 'moduleversionextra',"MODULEVERSIONEXTRA", "MODULEVERSIONEXTRA", "", ],
+    # shared source store
+    [ 'sourcecache',"SOURCECACHE", "SOURCECACHE", "", ],
+    [ 'sourcecachesize',"SOURCECACHESIZE", "SOURCECACHESIZE", "", ],
+    # limit in seconds on each build step
+    [ 'steptimeout',"STEPTIMEOUT", "STEPTIMEOUT", "", ],
+    # node-wide make jobserver
+    [ 'jobserver',"JOBSERVER", "JOBSERVER", "", ],
+    [ 'jobserverslots',"JOBSERVERSLOTS", "JOBSERVERSLOTS", "", ],
+    # make, ninja, cmake, or by default the configured generator
+    [ 'buildbackend',"BUILDBACKEND", "BUILDBACKEND", "", ],
+    # configure results shared per environment code
+    [ 'configurecache',"CONFIGURECACHE", "CONFIGURECACHE", "", ],
+    # ccache or sccache
+    [ 'compilercache',"COMPILERCACHE", "COMPILERCACHE", "", ],
+    [ 'compilercachedir',"COMPILERCACHEDIR", "COMPILERCACHEDIR", "", ],
+    [ 'compilercachesize',"COMPILERCACHESIZE", "COMPILERCACHESIZE", "", ],
+    [ 'installindex',"INSTALLINDEX", "INSTALLINDEX", "", ],
+    [ 'spidercache',"SPIDERCACHE", "SPIDERCACHE", "", ],
+    [ 'searchindex',"SEARCHINDEX", "SEARCHINDEX", "", ],
+]
+
+# settings of the stack action, which has no configuration of its own
+stack_table = [
+    [ 'stackactions',"STACKACTIONS", "STACKACTIONS", "install", ],
+    [ 'stackjcount',"STACKJCOUNT", "STACKJCOUNT", "", ],
+]
+
+##
+## Description: stack settings from the rc files of the stack root,
+## its parent, and the home directory, or else the environment
+##
+def read_stack_settings( stackroot ):
+    rc_name = ".mrpackmodrc"
+    rc_files = [ rc for rc in [ f"{stackroot}/{rc_name}", f"{stackroot}/../{rc_name}",
+                                f"{os.path.expanduser('~')}/{rc_name}"
+                               ] if os.path.exists(rc) ]
+    rc = rc_settings( rc_files )
+    return { key:setting_from_env_or_rc( name,env,default,rc )
+             for key,name,env,default in stack_table }
+
+def system_rc_file( config_dict ):
     system   = abort_on_zero_keyword( "system",**config_dict )
     compiler = abort_on_zero_keyword( "compiler",**config_dict )
     rc_dir = f"{os.getcwd()}/.."
     if not os.path.isdir(rc_dir):
         raise Exception( f"Non-existing dir for rc files: {rc_dir}" )
-    rc0 = f".mrpackmod_{system}_{compiler}rc"
-    rc1 = f".mrpackmod_{compiler}rc"
-    rc2 = f".mrpackmod_{system}rc"
-    if os.path.exists( f"{rc_dir}/{rc0}" ):
-        add_settings_from_config( f"{rc_dir}/{rc0}",config_dict,macros )
-    elif os.path.exists( f"{rc_dir}/{rc1}" ):
-        add_settings_from_config( f"{rc_dir}/{rc1}",config_dict,macros )
-    elif os.path.exists( f"{rc_dir}/{rc2}" ):
-        add_settings_from_config( f"{rc_dir}/{rc2}",config_dict,macros )
+    for rc in [ f".mrpackmod_{system}_{compiler}rc",
+                f".mrpackmod_{compiler}rc",
+                f".mrpackmod_{system}rc", ]:
+        if os.path.exists( f"{rc_dir}/{rc}" ):
+            return f"{rc_dir}/{rc}"
+    return None
+
+def config_from_rc_files( config_dict,macros,literals=None,expandable=None ):
+    if rc := system_rc_file( config_dict ):
+        add_settings_from_config( rc,config_dict,macros,literals,expandable )
 
 def environment_macros( **kwargs ):
     macros = {}
@@ -50,102 +125,181 @@ def environment_macros( **kwargs ):
                 macros[macro] = val
     return macros
 
-def add_settings_from_config( configfile,configuration_dict,macros ):
-    tracing = configuration_dict.get("tracing",False)
+##
+## Description: parse a configuration file into its entries,
+## with continuation lines joined
+## Result: list of triples kind,key,value where kind is "let" or "set"
+##
+parsed_configurations = {}
+
+def parse_config_file( configfile ):
+    st = os.stat( configfile )
+    if ( cached := parsed_configurations.get( configfile ) ) and cached[0]==st.st_mtime_ns:
+        return cached[1]
+    entries = []
     with open(configfile,"r") as configuration_file:
-        if tracing:
-            echo_string( f"Read configuration: {configfile}" )
         saving = False
         for line in configuration_file.readlines():
             line = line.strip()
             if re.match( r'^#',     line ): continue
             if re.match( r'^[ \t]*$',line ): continue
             if letdef := re.search( r'^let\s*([A-Za-z0-9_]*)\s*=\s*(.*)$',line ):
-                key,val = letdef.groups()
-                # macro with literal key
-                envval = os.getenv( key )
-                if nonnull( envval ):
-                    macros[key] = envval
-                else: macros[key] = val
+                kind = "let"; key,val = letdef.groups()
             elif keyval := re.search( r'^\s*([A-Za-z0-9_]*)\s*=\s*(.*)$',line ):
-                key,val = keyval.groups()
-                envval = os.getenv( key )
+                kind = "set"; key,val = keyval.groups()
             elif saving:
                 # we inherit key from the previous iteration
                 # we also inherit val & extend it with the current line
-                if tracing:
-                    echo_string( f" .. building up key={key} with: {line}" )
                 val += line
             else:
                 raise Exception( f"Can not parse: <<{line}>>")
-            key = key.lower(); val = val.strip('\n').strip(' ')
+            val = val.strip('\n').strip(' ')
             if re.search( r'\\$',val ):
                 # if the, possibly compounded, line is still to be continued:
                 val = val.strip( r'\\' )
                 saving = True
                 continue
             else: saving = False # time to ship out
-            for m in macros:
-                searchstring = '${'+m+'}'
-                val = val.replace( searchstring,macros[m] )
+            entries.append( ( kind,key,val ) )
+    parsed_configurations[configfile] = ( st.st_mtime_ns,entries )
+    return entries
+
+def add_settings_from_config( configfile,configuration_dict,macros,literals=None,expandable=None ):
+    # values are stored unexpanded; see expand_configuration.
+    # Values from the environment go into `literals` and are not expanded;
+    # the keys of values from the file are added to `expandable`
+    literals   = {} if literals is None else literals
+    expandable = set() if expandable is None else expandable
+    tracing = configuration_dict.get("tracing",False)
+    if tracing:
+        echo_string( f"Read configuration: {configfile}" )
+    for kind,key,val in parse_config_file( configfile ):
+        envval = os.getenv( key )
+        if kind=="let":
+            # macro with literal key
             if nonnull( envval ):
-                configuration_dict[key] = envval
-                if tracing:
-                    echo_string( f"Setting: {key} = {envval} from environment" )
+                literals[key] = envval; macros.pop( key,None )
             else:
-                configuration_dict[key] = val
-                if tracing:
-                    echo_string( f"Setting: {key} = {val} from config" )
+                macros[key] = val; literals.pop( key,None )
+        key = key.lower()
+        if nonnull( envval ):
+            configuration_dict[key] = envval
+            expandable.discard( key )
+            if tracing:
+                echo_string( f"Setting: {key} = {envval} from environment" )
+        else:
+            configuration_dict[key] = val
+            expandable.add( key )
+            if tracing:
+                echo_string( f"Setting: {key} = {val} from config" )
+
+##
+## Macro expansion
+## each value is expanded in one regex pass; macros are resolved lazily,
+## so they can refer to other macros, including ones defined later.
+## A name that is not a macro is left alone, for the shell to expand.
+##
+macro_reference = re.compile( r'\$\{([A-Za-z0-9_]+)\}' )
+
+def resolve_macro( name,macros,resolved,active ):
+    # Result: value of the macro, None if it is not a macro
+    if name in resolved:
+        return resolved[name]
+    if name in active:
+        raise Exception( f"Circular macro definition: {' -> '.join( list(active)+[name] )}" )
+    if name not in macros:
+        return None
+    value = expand_macros( macros[name],macros,resolved,( *active,name ) )
+    resolved[name] = value
+    return value
+
+def expand_macros( value,macros,resolved,active=() ):
+    if "${" not in value:
+        return value
+    def substitute( reference ):
+        value = resolve_macro( reference.group(1),macros,resolved,active )
+        return reference.group(0) if value is None else value
+    return macro_reference.sub( substitute,value )
+
+##
+## Description: expand the macros in the configuration values;
+## `literals` are macros whose values are used as they are,
+## and only the keys in `expandable` are expanded, if it is given
+##
+def expand_configuration( configuration_dict,macros,literals=None,expandable=None ):
+    resolved = dict( literals or {} )
+    for key,val in configuration_dict.items():
+        if isinstance( val,str ) and ( expandable is None or key in expandable ):
+            configuration_dict[key] = expand_macros( val,macros,resolved,( key.upper(), ) )
+
+##
+## Resolved configuration cache
+## keyed on the contents of all rc files, the configuration,
+## and every environment variable that can influence them.
+##
+def config_cache_key( configfile,rc_files ):
+    h = hashlib.sha256()
+    files = [ __file__, configfile ] + rc_files \
+        + sorted( glob.glob( f"{os.getcwd()}/../.mrpackmod_*rc" ) )
+    envs = [ "LOADEDMODULES", "MODULEPATH", "_LMFILES_", ] \
+        + [ env for _,_,env,_ in rc_table ]
+    for file in files:
+        st = os.stat( file )
+        h.update( f"{os.path.abspath(file)}:{st.st_mtime_ns}:{st.st_size}\n".encode() )
+        with open( file,"rb" ) as f:
+            h.update( f.read() )
+        if file!=__file__ and file not in rc_files:
+            envs += [ key for _,key,_ in parse_config_file( file ) ]
+    h.update( os.getcwd().encode() )
+    for env in sorted( set( envs ) ):
+        h.update( f"{env}={os.getenv( env )}\n".encode() )
+    return h.hexdigest()
+
+def config_cache_file( key ):
+    return f"{names.cache_root()}/config/{key}.json"
+
+def read_config_cache( key ):
+    try:
+        with open( config_cache_file( key ),"r" ) as cache:
+            return json.load( cache )
+    except ( OSError,json.JSONDecodeError ):
+        return None
+
+def write_config_cache( key,configuration_dict ):
+    cachefile = config_cache_file( key )
+    try:
+        os.makedirs( os.path.dirname( cachefile ),exist_ok=True )
+        with open( f"{cachefile}.{os.getpid()}","w" ) as cache:
+            json.dump( configuration_dict,cache )
+        os.replace( f"{cachefile}.{os.getpid()}",cachefile )
+    except OSError: pass
 
 def read_config(configfile,tracing=False):
     rc_name = ".mrpackmodrc"
     rc_files = [ rc for rc in [ rc_name, f"../{rc_name}",
-                                f"{os.path.expanduser('~')}/{rc_name}" 
+                                f"{os.path.expanduser('~')}/{rc_name}"
                                ] if os.path.exists(rc) ]
     #print( f"found rc files: {rc_files}" )
-    configuration_dict = {
-        'scriptdir':os.getcwd(),
-        'system':setting_from_env_or_rc(
-            "SYSTEM","TACC_SYSTEM","UNKNOWN_SYSTEM",rc_files),
-        # paths
-        'homedir':setting_from_env_or_rc(
-            "HOMEDIR", "HOMEDIR", "NO_HOMEDIR_GIVEN",rc_files ),
-        'srcpath':setting_from_env_or_rc(
-            "SRCPATH", "SRCPATH", "",rc_files ),
-        'packageroot':setting_from_env_or_rc(
-            "PACKAGEROOT", "PACKAGEROOT","NO_PACKAGEROOT_GIVEN",rc_files ),
-        'installroot':setting_from_env_or_rc(
-            "INSTALLROOT", "INSTALLROOT","NO_INSTALLROOT_GIVEN",rc_files ),
-        'installpath':setting_from_env_or_rc(
-            "INSTALLPATH", "INSTALLPATH","",rc_files ),
-        'builddirroot':setting_from_env_or_rc(
-            "BUILDDIRROOT", "BUILDDIRROOT","",rc_files ),
-        'moduleroot':setting_from_env_or_rc(
-            "MODULEROOT", "MODULEROOT","NO_MODULEROOT_GIVEN",rc_files ),
-        'moduledir':setting_from_env_or_rc(
-            "MODULEDIR", "MODULEDIR","",rc_files ),
-        # compiler
-        'compiler':setting_from_env_or_rc(
-            "COMPILER", "TACC_FAMILY_COMPILER","UNKNOWN_COMPILER",rc_files ),
-        'compilerversion':setting_from_env_or_rc(
-            "COMPILERVERSION", "TACC_FAMILY_COMPILER_VERSION","UNKNOWN_COMPILER_VERSION",rc_files ),
-        'mpi':setting_from_env_or_rc(
-            "MPI", "TACC_FAMILY_MPI","UNKNOWN_MPI",rc_files ),
-        'mpiversion':setting_from_env_or_rc(
-            "MPIVERSION", "TACC_FAMILY_MPI_VERSION","UNKNOWN_MPI_VERSION",rc_files ),
-        # default value:
-        'buildsystem':"cmake", 'modules':"",
-        # optional stuff
-        'installext':setting_from_env_or_rc\
-                        ( "INSTALLEXT", "INSTALLEXT", "",rc_files ),
-        'moduleversionextra':setting_from_env_or_rc\
-                        ( "MODULEVERSIONEXTRA", "MODULEVERSIONEXTRA", "",rc_files ),
-    }
-    macros = environment_macros( **configuration_dict )
-    config_from_rc_files( configuration_dict,macros )
     if not os.path.exists(configfile):
         raise Exception( f"No config file <<{configfile}>> in dir {os.getcwd()}" )
-    add_settings_from_config( configfile,configuration_dict,macros )
+    rc = rc_settings( rc_files )
+    cachekey = config_cache_key( configfile,rc_files )
+    if ( configuration_dict := read_config_cache( cachekey ) ) is not None:
+        if tracing:
+            print( f"Configuration from cache {config_cache_file( cachekey )}" )
+            print(configuration_dict)
+        return configuration_dict
+    configuration_dict = { 'scriptdir':os.getcwd(), }
+    for key,name,env,default in rc_table:
+        configuration_dict[key] = setting_from_env_or_rc( name,env,default,rc )
+    # default value:
+    configuration_dict.update( { 'buildsystem':"cmake", 'modules':"", } )
+    literals = environment_macros( **configuration_dict )
+    macros = {}; expandable = set()
+    config_from_rc_files( configuration_dict,macros,literals,expandable )
+    add_settings_from_config( configfile,configuration_dict,macros,literals,expandable )
+    expand_configuration( configuration_dict,macros,literals,expandable )
+    write_config_cache( cachekey,configuration_dict )
     if tracing:
         print(configuration_dict)
     return configuration_dict
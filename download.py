@@ -3,14 +3,30 @@
 #
 # standard python modules
 #
+import concurrent.futures
+import fcntl
+import hashlib
+import json
 import os
 import re
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
 
 #
 # my own modules
 #
+import cleanup
+import fingerprint
 import process
-from process import echo_string,abort_on_zero_keyword
+import search
+from process import echo_string,abort_on_zero_keyword,nonnull,nonzero_keyword
 import names
 
 def cd_download_path( **kwargs ):
@@ -22,6 +38,237 @@ def cd_download_path( **kwargs ):
         homedir = names.create_homedir( **kwargs )
         os.chdir(homedir)
 
+##
+## Native downloader
+## data is streamed in large chunks to a `.part` file, which is resumed
+## if a previous download was interrupted, and renamed when complete.
+## A DOWNLOADSHA256 setting is verified as the data comes in.
+## With DOWNLOADPARALLEL>1 large files are fetched as parallel range requests.
+##
+chunk_size = 8<<20
+parallel_minimum = 64<<20
+
+def file_sha256( filename,h=None ):
+    h = h or hashlib.sha256()
+    with open( filename,"rb" ) as f:
+        while chunk := f.read( chunk_size ):
+            h.update( chunk )
+    return h
+
+def url_request( url,**kwargs ):
+    return urllib.request.Request( url,headers={ "User-Agent":"MrPackMod", **kwargs } )
+
+##
+## Description: size of a remote file, if the server supports range requests
+##
+def ranged_size( url ):
+    if not re.match( r'https?://',url ):
+        return None
+    try:
+        with urllib.request.urlopen( url_request( url,Range="bytes=0-0" ) ) as response:
+            if response.status==206 and \
+               ( total := re.search( r'/([0-9]+)$',response.headers.get("Content-Range","") ) ):
+                return int( total.groups()[0] )
+    except urllib.error.URLError:
+        pass
+    return None
+
+def stream_download( url,partfile,h,**kwargs ):
+    if os.path.exists( f"{partfile}.ranges" ):
+        # left over from a parallel download: not contiguous
+        os.remove( f"{partfile}.ranges" ); os.remove( partfile )
+    offset = os.path.getsize( partfile ) if os.path.exists( partfile ) else 0
+    if offset>0:
+        echo_string( f"Resuming download at {offset} bytes",**kwargs )
+        file_sha256( partfile,h )
+    if url.startswith( "file://" ):
+        source = open( urllib.parse.unquote( urllib.parse.urlparse(url).path ),"rb" )
+        source.seek( offset )
+    else:
+        headers = { "Range":f"bytes={offset}-" } if offset>0 else {}
+        try:
+            source = urllib.request.urlopen( url_request( url,**headers ) )
+        except urllib.error.HTTPError as e:
+            if e.code!=416: raise
+            total = re.search( r'/([0-9]+)$',e.headers.get("Content-Range","") or "" )
+            if total and int( total.groups()[0] )==offset:
+                # nothing beyond the offset: the part file is complete
+                return h
+            echo_string( "Part file does not match the remote file, starting from zero",**kwargs )
+            os.remove( partfile )
+            return stream_download( url,partfile,hashlib.sha256(),**kwargs )
+        if offset>0 and source.status!=206:
+            echo_string( "Server does not resume, starting from zero",**kwargs )
+            offset = 0; h = hashlib.sha256()
+    with source, open( partfile,"ab" if offset>0 else "wb" ) as part:
+        while chunk := source.read( chunk_size ):
+            part.write( chunk )
+            h.update( chunk )
+    return h
+
+##
+## Description: ranges completed by an interrupted download into this part file;
+## if there are none, the part file is reset to the full size
+##
+def resumed_ranges( partfile,size,nranges ):
+    progressfile = f"{partfile}.ranges"
+    done = []
+    if os.path.exists( partfile ) and os.path.exists( progressfile ):
+        try:
+            with open( progressfile,"r" ) as p:
+                progress = json.load( p )
+        except ( OSError,json.JSONDecodeError ):
+            progress = {}
+        if progress.get("size")==size and progress.get("ranges")==nranges \
+           and os.path.getsize( partfile )==size:
+            done = [ i for i in progress.get("done",[]) if i in range(nranges) ]
+    if not done:
+        with open( partfile,"wb" ) as part:
+            part.truncate( size )
+    return done
+
+def range_download( url,partfile,size,nranges,**kwargs ):
+    # completed ranges are remembered next to the part file
+    progressfile = f"{partfile}.ranges"
+    ranges = [ ( i*size//nranges,(i+1)*size//nranges-1 ) for i in range(nranges) ]
+    done = resumed_ranges( partfile,size,nranges )
+    lock = threading.Lock()
+    def fetch( i ):
+        first,last = ranges[i]
+        request = url_request( url,Range=f"bytes={first}-{last}" )
+        with urllib.request.urlopen( request ) as response, open( partfile,"r+b" ) as part:
+            if response.status!=206:
+                raise Exception( f"Server ignored range request for {url}" )
+            part.seek( first )
+            while chunk := response.read( chunk_size ):
+                part.write( chunk )
+        with lock:
+            done.append( i )
+            with open( progressfile,"w" ) as p:
+                json.dump( { "size":size, "ranges":nranges, "done":done, },p )
+    todo = [ i for i in range(nranges) if i not in done ]
+    echo_string( f"Downloading {size} bytes in {len(todo)} of {nranges} parallel ranges",**kwargs )
+    with concurrent.futures.ThreadPoolExecutor( max_workers=nranges ) as pool:
+        for future in [ pool.submit( fetch,i ) for i in todo ]:
+            future.result()
+    os.remove( progressfile )
+    return file_sha256( partfile )
+
+def download_file( url,filename,**kwargs ):
+    checksum = kwargs.get( "downloadsha256","" ).strip().lower()
+    nranges  = int( kwargs.get( "downloadparallel","1" ) or "1" )
+    if nonnull( checksum ) and os.path.isfile( filename ) \
+       and file_sha256( filename ).hexdigest()==checksum:
+        echo_string( f"Already downloaded with correct checksum: {filename}",**kwargs )
+        return
+    partfile = f"{filename}.part"
+    start = time.time()
+    if nranges>1 and ( size := ranged_size( url ) ) and size>=parallel_minimum:
+        h = range_download( url,partfile,size,nranges,**kwargs )
+    else:
+        h = stream_download( url,partfile,hashlib.sha256(),**kwargs )
+    if nonnull( checksum ) and h.hexdigest()!=checksum:
+        os.remove( partfile )
+        raise Exception( f"Checksum mismatch for {url}: got {h.hexdigest()} expected {checksum}" )
+    os.replace( partfile,filename )
+    size = os.path.getsize( filename )
+    echo_string( f"Downloaded {size} bytes in {time.time()-start:.1f}s sha256={h.hexdigest()}",
+                 **kwargs )
+
+##
+## Shared source cache
+## tarballs are stored under SOURCECACHE, keyed by checksum if one is given,
+## otherwise by URL, and hardlinked (or reflinked, or copied) into the download dir.
+## Entries are touched when used; SOURCECACHESIZE caps the store, oldest first out.
+##
+def size_in_bytes( size ):
+    if number := re.match( r'^\s*([0-9.]+)\s*([KMGT]?)i?B?\s*$',size.upper() ):
+        value,unit = number.groups()
+        return int( float(value) * 1024**( " KMGT".index(unit or " ") ) )
+    raise Exception( f"Can not parse size: {size}" )
+
+def source_cache_entry( url,**kwargs ):
+    root     = kwargs.get( "sourcecache" )
+    checksum = kwargs.get( "downloadsha256","" ).strip().lower()
+    if nonnull( checksum ):
+        key = f"sha256-{checksum}"
+    else: key = f"url-{hashlib.sha256( url.encode() ).hexdigest()}"
+    return f"{root}/{key[-2:]}/{key}/{re.sub( r'.*/','',url )}"
+
+# cache entries can be shared by a group
+cache_mode = 0o664
+
+def link_or_copy( source,target,copy=False ):
+    if os.path.exists( target ):
+        os.remove( target )
+    if not copy:
+        try:
+            os.link( source,target ); return
+        except OSError:
+            # other file system or protected hardlinks
+            pass
+    subprocess.run( [ "cp","--reflink=auto",source,target ],check=True )
+
+##
+## Description: lock on the source store: shared while an entry is read or written,
+## exclusive while entries are evicted
+##
+def source_cache_lock( root,exclusive=True ):
+    os.makedirs( root,exist_ok=True )
+    lock = open( f"{root}/.lock","a" )
+    fcntl.flock( lock,fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH )
+    return lock
+
+def fetch_from_source_cache( url,filename,**kwargs ):
+    entry = source_cache_entry( url,**kwargs )
+    with source_cache_lock( kwargs.get( "sourcecache" ),exclusive=False ):
+        if not os.path.isfile( entry ):
+            return False
+        checksum = kwargs.get( "downloadsha256","" ).strip().lower()
+        if nonnull( checksum ) and file_sha256( entry ).hexdigest()!=checksum:
+            echo_string( f"Source cache entry has the wrong checksum, removing: {entry}",**kwargs )
+            try:
+                os.remove( entry )
+            except FileNotFoundError: pass
+            return False
+        echo_string( f"Source cache hit: {entry}",**kwargs )
+        link_or_copy( entry,filename )
+        os.utime( entry )
+    return True
+
+def store_in_source_cache( url,filename,**kwargs ):
+    root  = kwargs.get( "sourcecache" )
+    entry = source_cache_entry( url,**kwargs )
+    entrydir = os.path.dirname( entry )
+    with source_cache_lock( root,exclusive=False ):
+        os.makedirs( entrydir,exist_ok=True )
+        temporary = f"{entry}.{os.getpid()}.tmp"
+        # a hardlink shares the mode with the download, which is not ours to change
+        shared = os.stat( filename ).st_mode & cache_mode==cache_mode
+        link_or_copy( filename,temporary,copy=not shared )
+        if not shared:
+            os.chmod( temporary,cache_mode )
+        os.replace( temporary,entry )
+    echo_string( f"Stored in source cache: {entry}",**kwargs )
+    if nonnull( cap := kwargs.get( "sourcecachesize","" ) ):
+        evict_source_cache( root,size_in_bytes(cap),**kwargs )
+
+def evict_source_cache( root,cap,**kwargs ):
+    with source_cache_lock( root ):
+        entries = []
+        for shard in os.scandir( root ):
+            if not shard.is_dir(): continue
+            for entrydir in os.scandir( shard.path ):
+                for f in os.scandir( entrydir.path ):
+                    st = f.stat()
+                    entries.append( ( st.st_mtime,st.st_size,entrydir.path ) )
+        total = sum( size for _,size,_ in entries )
+        for _,size,entrydir in sorted( entries ):
+            if total<=cap: break
+            echo_string( f"Evicting from source cache: {entrydir}",**kwargs )
+            shutil.rmtree( entrydir,ignore_errors=True )
+            total -= size
+
 def download_from_url( **kwargs, ):
     url = abort_on_zero_keyword( "downloadurl",**kwargs )
     downloadlog  = kwargs.pop( "logfile",open( f"{os.getcwd()}/download.log","w" ) )
@@ -30,9 +277,120 @@ def download_from_url( **kwargs, ):
         raise Exception("No URL given to download")
     echo_string( f"In download dir: {os.getcwd()} downloading {url}",logfile=downloadlog )
     tgz = re.sub( r'.*/','',url )
-    process.process_execute( f"rm -f {tgz}" )
-    cmdline=f"wget {url}"
-    process.process_execute( cmdline,logfile=downloadlog,terminal=None )
+    if cached := nonnull( kwargs.get( "sourcecache","" ) ):
+        os.makedirs( kwargs["sourcecache"],exist_ok=True )
+        if fetch_from_source_cache( url,tgz,**kwargs ):
+            return
+    download_file( url,tgz,**kwargs )
+    if cached:
+        store_in_source_cache( url,tgz,**kwargs )
+
+##
+## Streaming unpack
+## the archive is read once: the top directory is found from the first member
+## and every member is extracted straight under the final source directory.
+## Decompression happens in a separate, preferably multithreaded, program when available.
+##
+decompressors = {
+    "gz"  : [ [ "pigz","-dc", ],     [ "gzip","-dc", ], ],
+    "xz"  : [ [ "xz","-T0","-dc", ], ],
+    "bz2" : [ [ "lbzip2","-dc", ],   [ "pbzip2","-dc", ], [ "bzip2","-dc", ], ],
+    "zst" : [ [ "zstd","-T0","-dc", ], ],
+}
+
+def archive_type( file ):
+    for pattern,kind in [ [ r'\.(tar\.gz|tgz)$',"gz" ], [ r'\.(tar\.xz|txz)$',"xz" ],
+                          [ r'\.(tar\.bz2|tbz2?)$',"bz2" ], [ r'\.(tar\.zst|tzst)$',"zst" ],
+                          [ r'\.tar$',"tar" ], [ r'\.zip$',"zip" ], ]:
+        if re.search( pattern,file ):
+            return kind
+    raise Exception( f"Cannot unpack {file}" )
+
+##
+## Description: open a decompressed stream of the archive
+## Result: triple stream, tarfile mode, child process or None
+##
+def tar_stream( file,kind ):
+    if kind=="tar":
+        return open( file,"rb" ),"r|",None
+    for command in decompressors[kind]:
+        if shutil.which( command[0] ):
+            child = subprocess.Popen\
+                ( command+[ file ],stdout=subprocess.PIPE,bufsize=chunk_size )
+            return child.stdout,"r|",child
+    if kind=="zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception( f"Need zstd program or zstandard module to unpack {file}" )
+        return zstandard.ZstdDecompressor().stream_reader( open( file,"rb" ) ),"r|",None
+    return open( file,"rb" ),f"r|{kind}",None
+
+def member_target( name,top,srcdir,isdir=False ):
+    # Result: pair new top, name under srcdir;
+    # the top is the leading directory of the first member, or "" if that is a plain file
+    name = re.sub( r'^(\./)+','',name ).rstrip("/")
+    if name.startswith("/") or ".." in name.split("/"):
+        raise Exception( f"Refusing to unpack {name} outside {srcdir}" )
+    first,_,rest = name.partition("/")
+    if top is None:
+        top = first if rest!="" or isdir else ""
+    if first==top:
+        return top,srcdir if rest=="" else f"{srcdir}/{rest}"
+    else: return top,f"{srcdir}/{name}"
+
+def default_target( name,isdir,archive ):
+    # the leading directory of the first member, or else the archive name without extensions
+    name = re.sub( r'^(\./)+','',name )
+    if "/" in name.rstrip("/") or isdir:
+        return name.split("/")[0]
+    return re.sub( r'(\.(tar|tgz|tbz2?|txz|zip|gz|bz2|xz|zst))+$','',os.path.basename( archive ) )
+
+def extract_tar( archive,kind,destination,**kwargs ):
+    stream,mode,child = tar_stream( archive,kind )
+    top = None; target = destination
+    extract_filter = { "filter":"tar" } if hasattr( tarfile,"tar_filter" ) else {}
+    directories = []
+    with stream, tarfile.open( fileobj=stream,mode=mode,bufsize=chunk_size ) as tar:
+        for member in tar:
+            if target is None:
+                target = default_target( member.name,member.isdir(),archive )
+            top,member.name = member_target( member.name,top,target,member.isdir() )
+            if member.islnk():
+                _,member.linkname = member_target( member.linkname,top,target )
+            elif member.issym() and not extract_filter:
+                # no extraction filter before python 3.12
+                link = os.path.normpath( f"{os.path.dirname(member.name)}/{member.linkname}" )
+                if os.path.isabs( member.linkname ) or not ( link+"/" ).startswith( os.path.normpath( target )+"/" ):
+                    raise Exception( f"Refusing symlink {member.name} to outside {target}" )
+            if member.isdir():
+                # as in extractall, directory modes and times are set at the end,
+                # so that read-only directories can still be filled
+                tar.extract( member,path=".",set_attrs=False,**extract_filter )
+                directories.append( member )
+            else: tar.extract( member,path=".",**extract_filter )
+    for directory in sorted( directories,key=lambda d:d.name,reverse=True ):
+        os.chmod( directory.name,directory.mode & 0o755 )
+        os.utime( directory.name,( directory.mtime,directory.mtime ) )
+    if child is not None and child.wait()!=0:
+        raise Exception( f"Decompression of {archive} failed with status {child.returncode}" )
+    return top,target
+
+def extract_zip( archive,destination,**kwargs ):
+    with zipfile.ZipFile( archive ) as zipped:
+        top = None; target = destination
+        for info in zipped.infolist():
+            if target is None:
+                target = default_target( info.filename,info.is_dir(),archive )
+            top,name = member_target( info.filename,top,target,info.is_dir() )
+            if info.is_dir():
+                os.makedirs( name,exist_ok=True ); continue
+            os.makedirs( os.path.dirname(name) or ".",exist_ok=True )
+            with zipped.open( info ) as source, open( name,"wb" ) as dest:
+                shutil.copyfileobj( source,dest,chunk_size )
+            if mode := ( info.external_attr>>16 ) & 0o777:
+                os.chmod( name,mode )
+    return top,target
 
 def unpack_from_url( **kwargs ):
     url          = kwargs.get( "downloadurl" )
@@ -46,29 +404,17 @@ def unpack_from_url( **kwargs ):
         raise Exception( f"Unpack {url} gives empty file name" )
     if not os.path.isfile( f"./{file}" ):
         raise Exception( f"No such file {file} in directory {os.getcwd()}" )
-    ext = re.sub( r'.*\.','',file )
-    echo_string( f"Unpacking file: {file} ext: {ext}",logfile=downloadlog )
-    if ext in [ "gz","tgz", ]:
-        unpackdir = process.process_execute( f"tar ftz {file} | head -n 1" )
-        unpackdir = re.sub( r'/$','',unpackdir )
-        echo_string( f"Packed file contains directory: {unpackdir}")
-        process.process_execute( f"rm -rf {unpackdir}" )
-        process.process_execute( f"tar fxz {file}" )
-    elif ext in [ "xz", "txz", ] :
-        process.process_execute( f"xz --decompress {file}" )
-        file = re.sub( r'\.xz','',file )
-        if not re.match( r'^.*\.tar$',file ):
-            raise Exception( f"Was expecting .tar suffix in {file}" )
-        unpackdir = process.process_execute( f"tar ft {file} | head -n 1" )
-        ## ( f"zcat {file} | head -n 1 | sed -e 's?/.*??' " )
-        unpackdir = re.sub( r'/$','',unpackdir )
-        echo_string( f"Packed file contains directory: {unpackdir}")
-        process.process_execute( f"rm -rf {unpackdir}" )
-        process.process_execute( f"tar fx {unpackdir}.tar" )
-    else: raise Exception(f"Cannot unpack {file}")
-    if srcdir:
-        if unpackdir.lstrip("./") != srcdir:
-            echo_string( f"Moving unpacked dir to srcdir: {srcdir}" )
-            process.process_execute( f"mv {unpackdir} {srcdir}" )
-        else:
-            echo_string( f"Unpacked dir is at final name: {srcdir}" )
+    kind = archive_type( file )
+    echo_string( f"Unpacking file: {file} type: {kind}",logfile=downloadlog )
+    if srcdir and os.path.exists( srcdir ):
+        echo_string( f"Removing previous srcdir: {srcdir}" )
+        cleanup.discard_tree( srcdir,**kwargs )
+    start = time.time()
+    if kind=="zip":
+        unpackdir,srcdir = extract_zip( file,srcdir,**kwargs )
+    else:
+        unpackdir,srcdir = extract_tar( file,kind,srcdir,**kwargs )
+    echo_string( f"Packed file contains directory: {unpackdir}, unpacked to {srcdir} in {time.time()-start:.1f}s" )
+    fingerprint.write_source_stamp( srcdir )
+    if nonzero_keyword( "searchindex",**kwargs ):
+        search.build_search_index( os.path.abspath( srcdir ),**kwargs )
@@ -0,0 +1,235 @@
+#!/usr/bin/env/python3
+
+#
+# standard python modules
+#
+import datetime
+import hashlib
+import json
+import os
+import re
+import shutil
+
+#
+# my own modules
+#
+import modules
+import names
+from process import echo_string,trace_string,nonnull
+
+# configuration keys that do not influence the installation
+volatile_keys = [ "logfiles", "jcount", "tracing", "terminal", "dependencies", "force",
+                  "scriptdir", "configfile", "mpmscript", "process", "logfile",
+                  "sourcecache", "sourcecachesize", "steptimeout",
+                  "jobserver", "jobserverslots", "buildbackend", "incrementalconfigure",
+                  "configurecache", "compilercachedir", "compilercachesize", "installindex",
+                  "spidercache", "searchindex", ]
+
+stamp_name = ".mrpackmod.json"
+source_stamp_name = ".mrpackmod_source"
+configure_stamp_name = ".mrpackmod_configure"
+# files and directories that a build in the source tree creates
+build_products = re.compile\
+    ( r'^(.*\.(o|lo|la|a|so|mod|d|pyc)|Makefile|config\.(status|log|h|cache)|libtool|stamp-h[0-9]*'
+      r'|CMakeCache\.txt|cmake_install\.cmake|build\.ninja|\.ninja_.*|'+re.escape( configure_stamp_name )
+      +r'|'+re.escape( source_stamp_name )+r')$' )
+build_directories = [ ".git", ".deps", ".libs", "CMakeFiles", ]
+# source files whose change requires a new configure
+configure_inputs = re.compile\
+    ( r'^(CMakeLists\.txt|.*\.cmake|configure|configure\.(ac|in)|Makefile\.(am|in)|.*\.m4)$' )
+
+def hash_file( h,filename ):
+    with open( filename,"rb" ) as f:
+        while chunk := f.read( 1<<20 ):
+            h.update( chunk )
+
+##
+## Description: cheap signature of a directory tree: names, sizes, mtimes
+##
+def hash_tree( h,top ):
+    for root,dirs,files in os.walk( top ):
+        dirs.sort()
+        for f in sorted(files):
+            path = f"{root}/{f}"
+            try:
+                st = os.lstat( path )
+            except FileNotFoundError: continue
+            h.update( f"{os.path.relpath(path,top)}:{st.st_size}:{st.st_mtime_ns}\n".encode() )
+
+##
+## Description: names, sizes, mtimes of the selected files in a source tree,
+## leaving out the builddir, git, and trash
+##
+def hash_sources( h,srcdir,builddir,select ):
+    builddir = os.path.realpath( builddir )
+    for root,dirs,files in os.walk( srcdir ):
+        dirs[:] = sorted( d for d in dirs if d not in build_directories
+                          and not d.startswith( ".mrpackmod-trash" )
+                          and os.path.realpath( f"{root}/{d}" )!=builddir )
+        for f in sorted( files ):
+            if select( f ):
+                try:
+                    st = os.lstat( f"{root}/{f}" )
+                except FileNotFoundError: continue
+                h.update( f"{os.path.relpath(root,srcdir)}/{f}:{st.st_size}:{st.st_mtime_ns}\n".encode() )
+
+def configuration_fingerprint( h,**kwargs ):
+    settings = { k:v for k,v in kwargs.items()
+                 if k not in volatile_keys and isinstance( v,str ) }
+    h.update( json.dumps( settings,sort_keys=True ).encode() )
+
+##
+## Description: signature of the source tree as unpacked,
+## recorded before anything is built in it
+##
+def write_source_stamp( srcdir ):
+    h = hashlib.sha256()
+    hash_tree( h,srcdir )
+    with open( f"{srcdir}/{source_stamp_name}","w" ) as stamp:
+        stamp.write( f"{h.hexdigest()}\n" )
+
+##
+## Description: the tarball, and the source tree as it was unpacked;
+## a tree that mpm did not unpack is hashed without builddir and build products,
+## so that building in the source tree does not change its fingerprint
+##
+def source_fingerprint( h,**kwargs ):
+    if nonnull( url := kwargs.get("downloadurl","") ):
+        downloadpath = kwargs.get( "downloadpath","" )
+        if not nonnull( downloadpath ):
+            downloadpath = names.create_homedir( **kwargs )
+        tarball = f"{downloadpath}/{re.sub( r'.*/','',url )}"
+        if os.path.isfile( tarball ):
+            hash_file( h,tarball )
+    srcdir = names.srcdir_name( **kwargs )
+    try:
+        with open( f"{srcdir}/{source_stamp_name}","r" ) as stamp:
+            h.update( stamp.read().encode() )
+            return
+    except FileNotFoundError: pass
+    if os.path.isdir( srcdir ):
+        hash_sources( h,srcdir,names.builddir_name( **kwargs ),lambda f:not build_products.match( f ) )
+
+def compilers_fingerprint( h,**kwargs ):
+    for key,val in names.compilers_names( **kwargs ).items():
+        if path := shutil.which( val ):
+            path = os.path.realpath( path )
+            st = os.stat( path )
+            h.update( f"{key}={path}:{st.st_size}:{st.st_mtime_ns}\n".encode() )
+        else: h.update( f"{key}={val}:missing\n".encode() )
+
+##
+## Description: fingerprint of everything that goes into an installation
+##
+def build_fingerprint( **kwargs ):
+    h = hashlib.sha256()
+    configuration_fingerprint( h,**kwargs )
+    source_fingerprint( h,**kwargs )
+    h.update( names.environment_code( **kwargs ).encode() )
+    for module,version in modules.loaded_modules( **{ **kwargs,"terminal":None } ):
+        h.update( f"{module}/{version}\n".encode() )
+    compilers_fingerprint( h,**kwargs )
+    return h.hexdigest()
+
+def read_stamp( **kwargs ):
+    prefixdir = names.prefixdir_name( **kwargs )
+    try:
+        with open( f"{prefixdir}/{stamp_name}","r" ) as stamp:
+            return json.load( stamp )
+    except ( FileNotFoundError,json.JSONDecodeError ):
+        return {}
+
+##
+## Description: the string settings, from which the installation can be described again;
+## settings that do not affect the installation are left out
+##
+def stored_configuration( **kwargs ):
+    return { k:v for k,v in kwargs.items() if k not in volatile_keys and isinstance( v,str ) }
+
+##
+## Description: disk usage of a tree, measured once when it is installed
+##
+def tree_size( top ):
+    size = 0
+    for root,dirs,files in os.walk( top ):
+        for f in files:
+            try:
+                size += os.lstat( f"{root}/{f}" ).st_blocks*512
+            except OSError: pass
+    return size
+
+def write_stamp( fingerprint,**kwargs ):
+    prefixdir = names.prefixdir_name( **kwargs )
+    package,version = names.package_names( **kwargs )
+    stamp = { "fingerprint":fingerprint,
+              "package":package, "version":version,
+              "envcode":names.environment_code( **kwargs ),
+              "date":datetime.datetime.now().isoformat( timespec="seconds" ),
+              "size":tree_size( prefixdir ),
+              "configuration":stored_configuration( **kwargs ), }
+    os.makedirs( prefixdir,exist_ok=True )
+    with open( f"{prefixdir}/{stamp_name}.tmp","w" ) as f:
+        json.dump( stamp,f,indent=1 )
+    os.replace( f"{prefixdir}/{stamp_name}.tmp",f"{prefixdir}/{stamp_name}" )
+    trace_string( f"Recorded build fingerprint {fingerprint}",**kwargs )
+
+##
+## Description: test whether the last install into this prefix had this fingerprint
+##
+def install_is_current( fingerprint,**kwargs ):
+    stamp = read_stamp( **kwargs )
+    if stamp.get( "fingerprint" )==fingerprint:
+        echo_string( f"Installation is up to date with fingerprint {fingerprint[:12]}",**kwargs )
+        return True
+    return False
+
+##
+## Description: fingerprint of everything that goes into a configure:
+## settings, prefix, module environment, compilers,
+## and names and timestamps of the cmake and autotools inputs
+##
+def configure_fingerprint( srcdir,builddir,**kwargs ):
+    h = hashlib.sha256()
+    configuration_fingerprint( h,**kwargs )
+    h.update( f"{names.prefixdir_name( **kwargs )}\n".encode() )
+    h.update( f"{names.environment_code( **kwargs )}\n".encode() )
+    for module,version in modules.loaded_modules( **{ **kwargs,"terminal":None } ):
+        h.update( f"{module}/{version}\n".encode() )
+    compilers_fingerprint( h,**kwargs )
+    hash_sources( h,srcdir,builddir,configure_inputs.match )
+    return h.hexdigest()
+
+##
+## Description: test whether a configure finished: its cache and the build files it generates
+##
+def configure_done( srcdir,builddir ):
+    return any( os.path.exists( f"{directory}/{cache}" ) and
+                any( os.path.exists( f"{directory}/{generated}" ) for generated in [ "Makefile", "build.ninja", ] )
+                for directory,cache in [ [ builddir,"CMakeCache.txt" ],
+                                         [ builddir,"config.status" ],
+                                         [ srcdir,"config.status" ], ] )
+
+##
+## Description: test whether the builddir holds a configure with the current inputs
+##
+def configure_is_current( srcdir,builddir,**kwargs ):
+    if not configure_done( srcdir,builddir ):
+        return False
+    try:
+        with open( f"{builddir}/{configure_stamp_name}","r" ) as stamp:
+            recorded = stamp.read().strip()
+    except FileNotFoundError:
+        return False
+    if recorded!=configure_fingerprint( srcdir,builddir,**kwargs ):
+        trace_string( f"Configure inputs changed since {recorded[:12]}",**kwargs )
+        return False
+    echo_string( f"Configuration in {builddir} is up to date",**kwargs )
+    return True
+
+def write_configure_stamp( srcdir,builddir,**kwargs ):
+    if not configure_done( srcdir,builddir ):
+        return
+    fingerprint = configure_fingerprint( srcdir,builddir,**kwargs )
+    with open( f"{builddir}/{configure_stamp_name}","w" ) as stamp:
+        stamp.write( f"{fingerprint}\n" )
+    trace_string( f"Recorded configure fingerprint {fingerprint}",**kwargs )
@@ -9,17 +9,40 @@ import re
 #
 # my own modules
 #
+import installindex
+import metrics
 import names
-import process
-from process import echo_string,abort_on_zero_keyword
+from process import echo_string,abort_on_zero_keyword,nonnull
 
+def print_installations( entries,**kwargs ):
+    for e in entries:
+        echo_string( f"{e['package']:<16} {e['version'] or '':<12} {e['envcode'] or '':<32} "
+                     f"{metrics.human_size( e['size'] or 0 ):>6} {e['installed'] or '':<20} {e['prefix']}",**kwargs )
+        if nonnull( e['modulefile'] or "" ):
+            echo_string( f"{'':<16} module: {e['modulefile']}",**kwargs )
 
+##
+## Description: installations of this package, from the installation index
+##
 def list_installations( **kwargs ):
     installroot = abort_on_zero_keyword( "installroot",**kwargs )
     package     = abort_on_zero_keyword( "package",**kwargs ).lower()
+    if ( entries := installindex.query_installations( f"package={package}",**kwargs ) ) is not None:
+        echo_string( f"Found {len(entries)} installations of {package} in the index",**kwargs )
+        print_installations( entries,**kwargs )
+        return
     dirs = [ d for d in os.listdir(installroot)
              if os.path.isdir( f"{installroot}/{d}" )
              and re.match( f"installation-{package}",d )
              ]
     echo_string( f"Found installations in installroot {installroot}\n{dirs}" )
-    
+    echo_string( f"No installation index; use the `reindex` action to create one" )
+
+##
+## Description: installations matching the `--args` filters, from the installation index
+##
+def query_installations( filters,**kwargs ):
+    if ( entries := installindex.query_installations( filters,**kwargs ) ) is None:
+        echo_string( f"No installation index; use the `reindex` action to create one" )
+        return
+    print_installations( entries,**kwargs )
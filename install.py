@@ -11,20 +11,35 @@ import shutil
 #
 # my own modules
 #
+import backends
+import checkcache
+import cleanup
+import compilercache
+import fingerprint
+import jobserver
+import metrics
 import modules
 import names
+import parallel
 import process
+import spidercache
 from process import process_execute, process_initiate, process_terminate
 from process import echo_string, error_abort, abort_on_zero_env
 from process import nonnull, nonzero_keyword, zero_keyword, abort_on_zero_keyword
 
-def export_compilers( **kwargs ):
+def export_compilers( wrap=False,**kwargs ):
+    # with `wrap` the compilers go through the compiler cache
     compilers = names.compilers_names( **kwargs )
     cmdline = ""; cont = ""
-    for key,val in compilers.items():
+    # all `which` probes at the same time
+    probes = process.process_concurrent\
+        ( [ ( f"which {val}",{ **kwargs,"terminal":None } ) for val in compilers.values() ] )
+    for ( key,val ),probe in zip( compilers.items(),probes ):
         echo_string( f"Setting compiler: {key}={val}",**kwargs )
-        which = process_execute( f"which {val}",**kwargs,terminal=None )
+        which = probe.tail[-1] if probe.returncode==0 and probe.tail else "not found"
         echo_string( f" .. where {val}={which}",**kwargs )
+        if wrap:
+            val = compilercache.wrapped_compiler( key,val,**kwargs )
         cmdline += f"{cont}export {key}={val}"
         cont = " && "
     return cmdline
@@ -48,22 +63,34 @@ def export_flags( **kwargs ):
             cont = " && "
     return cmdline
 
-def open_logfile( logstage,kwargs ):
+# phase being timed, per open logfile
+open_phases = {}
+
+def open_logfile( logstage,kwargs,phase=None ):
     logfile = names.logfile_name( logstage,**kwargs )
-    loghandle = open( logfile,"w" )
+    loghandle = process.LogWriter( logfile,kwargs.get( "logcompression","" ) )
+    logfile = loghandle.name
     kwargs["logfiles"][logfile] = loghandle
+    open_phases[logfile] = metrics.phase_start( phase or logstage )
     echo_string( f"Open logfile {logfile}",**kwargs )
     loghandle.write( f"""================
 Logstage {logstage} started {datetime.date.today()}
 ================\n""" )
     return logfile,loghandle
 
+def next_phase( logname,phase,kwargs ):
+    record = metrics.phase_end( open_phases.pop(logname),**kwargs )
+    open_phases[logname] = metrics.phase_start( phase )
+    return record
+
 def close_logfile( logname,loghandle,kwargs ):
     kwargs["logfiles"].pop(logname)
     loghandle.close()
+    metrics.phase_end( open_phases.pop(logname),**kwargs )
     
 def configure_prep( **kwargs ):
     modules.test_modules( **kwargs )
+    compilercache.compiler_cache( **kwargs )
     #
     # setup directories
     #
@@ -71,16 +98,28 @@ def configure_prep( **kwargs ):
     builddir  = names.builddir_name( **kwargs )
     prefixdir = names.prefixdir_name( **kwargs )
     #print(srcdir,builddir,prefixdir)
-    try:
-        shutil.rmtree(builddir)
-    except FileNotFoundError: pass
+    if nonzero_keyword( "incrementalconfigure",**kwargs ) \
+       and fingerprint.configure_is_current( srcdir,builddir,**kwargs ):
+        return srcdir,builddir,prefixdir,True
+    # the old builddir is removed in the background
+    cleanup.reap_trash( os.path.dirname( os.path.abspath( builddir ) ),**kwargs )
+    cleanup.discard_tree( builddir,**kwargs )
     os.makedirs(builddir,exist_ok=True)
-    return srcdir,builddir,prefixdir
+    return srcdir,builddir,prefixdir,False
+
+def configure_finish( srcdir,builddir,**kwargs ):
+    if nonzero_keyword( "incrementalconfigure",**kwargs ):
+        fingerprint.write_configure_stamp( srcdir,builddir,**kwargs )
 
 def cmake_configure( **kwargs ):
     tracing = kwargs.get( "tracing" )
     logfilename,logfilehandle = open_logfile( "configure",kwargs ) # note dict!
-    srcdir,builddir,prefixdir = configure_prep( **kwargs )
+    srcdir,builddir,prefixdir,current = configure_prep( **kwargs )
+    # the compiler cache settings go to the shells, not into the environment of mpm
+    kwargs["environment"] = compilercache.cache_environment( **kwargs )
+    if current:
+        close_logfile( logfilename,logfilehandle,kwargs )
+        return
     #
     # flags
     #
@@ -89,8 +128,10 @@ def cmake_configure( **kwargs ):
         cmakeflags += f" -D CMAKE_CXX_FLAGS=-std=c++{standard}"
     if flags := nonzero_keyword( "cmakeflags",**kwargs ):
         cmakeflags += f" {flags}"
+    if launchers := compilercache.cmake_launchers( **kwargs ):
+        cmakeflags += f" {launchers}"
     cmake = kwargs.get("cmakename","cmake")
-    if nonzero_keyword("cmakeuseninja"):
+    if nonzero_keyword( "cmakeuseninja",**kwargs ):
         cmake = f"{cmake} -G Ninja"
     if kwargs.get("cmakebuilddebug"):
         defaultbuild = "Debug"
@@ -116,7 +157,8 @@ def cmake_configure( **kwargs ):
     shell = process_initiate( **kwargs )
     compilers_export = export_compilers( **kwargs )
     process_execute( compilers_export,**kwargs,process=shell )
-    cmdline = f"{cmake} -D CMAKE_INSTALL_PREFIX={prefixdir} \
+    initialcache = checkcache.cmake_cache_seed( builddir,**kwargs )
+    cmdline = f"{cmake} {initialcache} -D CMAKE_INSTALL_PREFIX={prefixdir} \
 -D CMAKE_COMPILE_WARNING_AS_ERROR=OFF \
 -D CMAKE_POLICY_VERSION_MINIMUM=3.13 \
 -D CMAKE_VERBOSE_MAKEFILE=ON \
@@ -125,12 +167,20 @@ def cmake_configure( **kwargs ):
 {cmakeflags} {cmakeflagsplatform} \
 {cmakesourcesetting} \
 "
-    process_execute( cmdline,**kwargs,process=shell )
-    process_terminate( shell,**kwargs )
+    process_execute( cmdline,**kwargs,process=shell,check=True )
+    if process_terminate( shell,**kwargs,check=True )==0:
+        checkcache.cmake_cache_store( builddir,**kwargs )
+        configure_finish( srcdir,builddir,**kwargs )
     close_logfile( logfilename,logfilehandle,kwargs )
 
+##
+## Description: peak memory of the build steps alone, without configure and other children
+##
+def build_peak( steps ):
+    return max( [ step.maxrss or 0 for step in steps ] )
+
 def cmake_build( **kwargs ):
-    logfilename,logfilehandle = open_logfile( "install",kwargs ) # note dict!
+    logfilename,logfilehandle = open_logfile( "install",kwargs,phase="build" ) # note dict!
     #
     # setup directories
     #
@@ -143,46 +193,61 @@ def cmake_build( **kwargs ):
     makebuildtarget = kwargs.get("makebuildtarget","")
     jcount          = kwargs.get("jcount","6")
     #
-    # execute make & make install
-    make = f"make --no-print-directory V=1 VERBOSE=1 -j {jcount}"
-    if nonzero_keyword("noinstall"):
+    # build & install with the backend of the configured generator
+    #
+    if nonzero_keyword( "noinstall",**kwargs ):
+        close_logfile( logfilename,logfilehandle,kwargs )
         return
     echo_string( f"Making in builddir: {builddir}",**kwargs )
     if not os.path.isdir(builddir):
         raise Exception( f"Invalid builddir: {builddir}",**kwargs )
     os.chdir( builddir )
-    cmdline = f"{make} {makebuildtarget}"
-    process_execute( cmdline,**kwargs )
-    if extra_targets := nonzero_keyword( "extrabuildtargets" ):
-        cmdline = f"{make} {extra_targets}"
-        process_execute( cmdline )
-    cmdline = f"{make} install"
-    process_execute( cmdline,**kwargs )
-    if extra_targets := nonzero_keyword( "extrainstalltargets" ):
-        cmdline = f"{make} {extra_targets}"
-        process_execute( cmdline )
+    cachestats = compilercache.statistics_start( **kwargs )
+    kwargs["environment"] = compilercache.cache_environment( **kwargs )
+    backend,tool = backends.cmake_backend( builddir,**kwargs )
+    echo_string( f"Build backend: {backend}",**kwargs )
+    cmdline = backends.build_command( backend,makebuildtarget,tool,**kwargs )
+    steps = [ process.process_result( cmdline,**kwargs,check=True,rusage=True ) ]
+    if extra_targets := nonzero_keyword( "extrabuildtargets",**kwargs ):
+        cmdline = backends.build_command( backend,extra_targets,tool,**kwargs )
+        steps.append( process.process_result( cmdline,**kwargs,check=True,rusage=True ) )
+    build = next_phase( logfilename,"install",kwargs )
+    parallel.record_build( jcount,build["wall"],build_peak( steps ),**kwargs )
+    cmdline = backends.build_command( backend,"install",tool,**kwargs )
+    process_execute( cmdline,**kwargs,check=True,rusage=True )
+    if extra_targets := nonzero_keyword( "extrainstalltargets",**kwargs ):
+        cmdline = backends.build_command( backend,extra_targets,tool,**kwargs )
+        process_execute( cmdline,**kwargs,check=True,rusage=True )
+    compilercache.statistics_report( cachestats,**kwargs )
     close_logfile( logfilename,logfilehandle,kwargs )
 
 def autotools_configure( **kwargs ):
     logfilename,logfilehandle = open_logfile( "configure",kwargs ) # note dict!
-    srcdir,builddir,prefixdir = configure_prep( **kwargs )
+    srcdir,builddir,prefixdir,current = configure_prep( **kwargs )
+    # the compiler cache settings go to the shells, not into the environment of mpm
+    kwargs["environment"] = compilercache.cache_environment( **kwargs )
+    if current:
+        close_logfile( logfilename,logfilehandle,kwargs )
+        return
     #installext
     #
     # execute configure
     #
     os.chdir(srcdir)
     shell = process_initiate( **kwargs )
-    compilers_export = export_compilers( **kwargs )
+    compilers_export = export_compilers( wrap=True,**kwargs )
     process_execute( compilers_export,**kwargs,process=shell )
     flags_export = export_flags( **kwargs )
     process_execute( flags_export,**kwargs,process=shell )
     if before := nonzero_keyword( "beforeconfigurecmds",**kwargs ):
-        process_execute( before,**kwargs,process=shell )
+        process_execute( before,**kwargs,process=shell,check=True )
     if nonzero_keyword( "defunprogfc",**kwargs ):
         process_execute( "sed -i configure.ac -e \'/AC_INIT/aAC_DEFUN([_AC_PROG_FC_V],[])\'",
                          **kwargs,process=shell )
     if not os.path.exists("configure") and os.path.exists("autogen.sh"):
-        process_execute( "./autogen.sh",**kwargs,process=shell )
+        process_execute( "./autogen.sh",**kwargs,process=shell,check=True )
+        # the tests below look at what autogen made
+        process.process_sync( shell,**kwargs,check=True )
     if not os.path.exists("configure") or nonzero_keyword( "forcereconf",**kwargs ):
         if not os.path.exists( "configure.ac" ):
             raise Exception( "Need configure.ac to generate configure script" )
@@ -190,36 +255,56 @@ def autotools_configure( **kwargs ):
             cmdline = f"{reconf} -i"
         else:
             cmdline = f"aclocal && autoconf"
-        process_execute( cmdline,**kwargs,process=shell )
-    if nonzero_keyword( "configinbuilddir",**kwargs ):
-        os.chdir(builddir) # only gcc
+        process_execute( cmdline,**kwargs,process=shell,check=True )
+        process.process_sync( shell,**kwargs,check=True )
+    if option := nonzero_keyword( "prefixoption",**kwargs ):
+        prefixoption = option # pdtoolkit
+    else: prefixoption = "--prefix"
+    options = f"{prefixoption}={prefixdir} --libdir={prefixdir}/lib"
+    if flags := nonzero_keyword( "configureflags",**kwargs ):
+        options += f" {flags}"
+    if cacheoption := checkcache.autoconf_cache_option( builddir,**kwargs ):
+        options += f" {cacheoption}"
+    if outoftree := backends.autotools_out_of_tree( srcdir,**kwargs ):
+        # gcc requires this, automake packages allow it
+        echo_string( f"Configuring out of tree in {builddir}",**kwargs )
+        process_execute( f"cd {builddir}",**kwargs,process=shell )
         cmdline = f"{srcdir}/configure"
     elif subdir := nonzero_keyword( "configuresubdir",**kwargs ):
         os.chdir(subdir)
         cmdline = f"./configure"
     else:
         cmdline = f"./configure"
-    if option := nonzero_keyword( "prefixoption",**kwargs ):
-        prefixoption = option # pdtoolkit
-    else: prefixoption = "--prefix"
-    cmdline += f" {prefixoption}={prefixdir} --libdir={prefixdir}/lib"
-    if flags := nonzero_keyword( "configureflags",**kwargs ):
-        cmdline += f" {flags}"
-    process_execute( cmdline,**kwargs,process=shell )
-    process_terminate( shell,**kwargs )
+    if outoftree and backends.configinbuilddir_setting( **kwargs )=="auto":
+        # a configure that refuses to run out of tree is run in the source tree
+        process_execute( f"{cmdline} {options}",**kwargs,process=shell )
+        if process.process_sync( shell,**kwargs )!=0:
+            echo_string( f"Configure failed out of tree, configuring in the source tree {srcdir}",**kwargs )
+            process_execute( f"rm -f {builddir}/Makefile {builddir}/config.status && cd {srcdir}",
+                             **kwargs,process=shell )
+            process_execute( f"./configure {options}",**kwargs,process=shell,check=True )
+    else:
+        process_execute( f"{cmdline} {options}",**kwargs,process=shell,check=True )
+    if process_terminate( shell,**kwargs,check=True )==0:
+        checkcache.autoconf_cache_store( srcdir,builddir,**kwargs )
+        configure_finish( srcdir,builddir,**kwargs )
     close_logfile( logfilename,logfilehandle,kwargs )
     
 def autotools_build( **kwargs ):
-    logfilename,logfilehandle = open_logfile( "install",kwargs ) # note dict!
+    logfilename,logfilehandle = open_logfile( "install",kwargs,phase="build" ) # note dict!
     #
     # setup directories
     #
     srcdir    = names.srcdir_name( **kwargs )
     builddir  = names.builddir_name( **kwargs )
     prefixdir = names.prefixdir_name( **kwargs )
-    if nonzero_keyword("noinstall"):
+    if nonzero_keyword( "noinstall",**kwargs ):
+        close_logfile( logfilename,logfilehandle,kwargs )
         return
-    if subdir := nonzero_keyword("makesubdir",**kwargs):
+    if os.path.exists( f"{builddir}/Makefile" ):
+        # configured out of tree
+        os.chdir(builddir)
+    elif subdir := nonzero_keyword("makesubdir",**kwargs):
         os.chdir(subdir)
     else:
         os.chdir(srcdir)
@@ -227,53 +312,43 @@ def autotools_build( **kwargs ):
     #
     # Make
     #
+    cachestats = compilercache.statistics_start( **kwargs )
+    kwargs["environment"] = compilercache.cache_environment( **kwargs )
     jval = kwargs.get("jcount",6)
-    makecommand = f"make --no-print-directory -j {jval}"
+    prefix,shared = jobserver.jobserver_prefix( "make",**kwargs )
+    if shared:
+        makecommand = f"{prefix}make --no-print-directory"
+    else: makecommand = f"make --no-print-directory -j {jval}"
     echo_string( f"Making default target with: {makecommand}",**kwargs )
-    process_execute( makecommand,**kwargs )
+    steps = [ process.process_result( makecommand,**kwargs,check=True,rusage=True ) ]
     if extra := nonzero_keyword( "extrabuildtargets",**kwargs ):
         echo_string( f" .. making extra targets: {extra}",**kwargs )
-        process_execute( f"{makecommand} {extra}",**kwargs )
+        steps.append( process.process_result( f"{makecommand} {extra}",**kwargs,check=True,rusage=True ) )
     #
     # install
     #
+    build = next_phase( logfilename,"install",kwargs )
+    parallel.record_build( jval,build["wall"],build_peak( steps ),**kwargs )
     extra = kwargs.get( "extrainstalltarget","" )
     cmdline = f"make --no-print-directory install {extra}"
-    process_execute( cmdline,**kwargs )
+    process_execute( cmdline,**kwargs,check=True,rusage=True )
     if cptoinstall := nonzero_keyword( "cptoinstalldir",**kwargs ):
         echo_string( f"Extra installs: {cptoinstall}",**kwargs )
-        process_execute( f"cp -r {cptoinstall} {prefixdir}",**kwargs )
+        process_execute( f"cp -r {cptoinstall} {prefixdir}",**kwargs,check=True )
+    compilercache.statistics_report( cachestats,**kwargs )
     close_logfile( logfilename,logfilehandle,kwargs )
 
-def write_module_file( **kwargs ):
-    tracing = kwargs.get("tracing")
-    logfilename,logfilehandle = open_logfile( "module",kwargs ) # note dict!
-
-    #
-    # paths
-    #
-    #
-    # module contents
-    #
+##
+## Description: the text of the modulefile
+##
+def module_file_contents( **kwargs ):
     help_string   = modules.module_help_string ( **kwargs )
     pkg_info      = modules.package_info       ( **kwargs )
     path_settings = modules.path_settings      ( **kwargs )
     system_paths  = modules.system_paths       ( **kwargs )
     if nonnull( depends := modules.dependencies       ( **kwargs ) ):
         depends = f"\n{depends}"
-
-    #
-    # write
-    #
-    modulefilepath,luaversion = names.modulefile_path_and_name( **kwargs )
-    if not os.path.isdir(modulefilepath):
-        echo_string( f"First create module dir: {modulefilepath}",**kwargs )
-        # create directories recursively
-        os.makedirs( modulefilepath,exist_ok=True )
-        # too limited os.mkdir( modulefilepath )
-    echo_string( f"Writing modulefile: {modulefilepath}/{luaversion}" )
-    with open( f"{modulefilepath}/{luaversion}","w" ) as modulefile:
-        modulecontents = f"""\
+    return f"""\
 {help_string}
 
 {pkg_info}
@@ -282,7 +357,51 @@ def write_module_file( **kwargs ):
 
 {system_paths}{depends}
 """
-        if tracing:
-            echo_string( f"Module contents:\n{modulecontents}",**kwargs )
-        modulefile.write( modulecontents )
+
+##
+## Description: write a modulefile, unless only its generation date would change;
+## the file is replaced atomically so that Lmod never sees half a file.
+## Result: True if written
+##
+generation_date = re.compile( r'\(modulefile generated [^)]*\)' )
+
+def write_if_changed( filename,contents ):
+    try:
+        with open( filename,"r" ) as current:
+            if generation_date.sub( "",current.read() )==generation_date.sub( "",contents ):
+                return False
+    except FileNotFoundError: pass
+    directory,base = os.path.split( filename )
+    os.makedirs( directory,exist_ok=True )
+    # hidden, so that Lmod does not take it for a version
+    temporary = f"{directory}/.{base}.{os.getpid()}"
+    with open( temporary,"w" ) as modulefile:
+        modulefile.write( contents )
+    os.replace( temporary,filename )
+    return True
+
+def write_module_file( **kwargs ):
+    tracing = kwargs.get("tracing")
+    logfilename,logfilehandle = open_logfile( "module",kwargs ) # note dict!
+
+    #
+    # module contents
+    #
+    modulecontents = module_file_contents( **kwargs )
+    if tracing:
+        echo_string( f"Module contents:\n{modulecontents}",**kwargs )
+
+    #
+    # write
+    #
+    modulefilepath,luaversion = names.modulefile_path_and_name( **kwargs )
+    if not os.path.isdir(modulefilepath):
+        echo_string( f"First create module dir: {modulefilepath}",**kwargs )
+    if written := write_if_changed( f"{modulefilepath}/{luaversion}",modulecontents ):
+        echo_string( f"Writing modulefile: {modulefilepath}/{luaversion}" )
+    else:
+        echo_string( f"Modulefile unchanged: {modulefilepath}/{luaversion}" )
+    moduledir = spidercache.module_directory( **kwargs )
+    if written or not spidercache.has_cache( moduledir,**kwargs ):
+        spidercache.update_spider_cache( [ moduledir ],**kwargs )
     close_logfile( logfilename,logfilehandle,kwargs )
@@ -0,0 +1,206 @@
+#!/usr/bin/env/python3
+
+##
+## Installation index
+## every install and module action records its installation
+## in an SQLite database in the installroot;
+## the installroot is typically on NFS or Lustre, where the locking of SQLite itself
+## can not be trusted, so every access goes through a flock on a file next to the database:
+## exclusive for writing, shared for reading.
+## the size of an installation is taken from its fingerprint stamp;
+## listing and querying read only the database.
+##
+
+#
+# standard python modules
+#
+import datetime
+import fcntl
+import json
+import os
+import re
+import sqlite3
+
+#
+# my own modules
+#
+import fingerprint
+import names
+from process import echo_string,nonnull
+
+index_name = ".mrpackmod_index.sqlite"
+
+columns = [ "prefix", "package", "version", "envcode", "modulefile",
+            "fingerprint", "size", "installed", "updated", "configuration", ]
+
+schema = """
+create table if not exists installations (
+  prefix        text primary key,
+  package       text,
+  version       text,
+  envcode       text,
+  modulefile    text,
+  fingerprint   text,
+  size          integer,
+  installed     text,
+  updated       text,
+  configuration text
+);
+create index if not exists installations_package on installations ( package,version );
+"""
+
+def index_file( **kwargs ):
+    if nonnull( index := kwargs.get( "installindex","" ) ):
+        return index
+    installroot = kwargs.get( "installroot","" )
+    if not nonnull( installroot ) or not os.path.isdir( installroot ):
+        return None
+    return f"{installroot}/{index_name}"
+
+def index_lock( filename,exclusive=True ):
+    lock = open( f"{filename}.lock","a" )
+    fcntl.flock( lock,fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH )
+    return lock
+
+def index_open( filename ):
+    # only with the lock held exclusively
+    db = sqlite3.connect( filename,timeout=30 )
+    db.executescript( schema )
+    return db
+
+def now():
+    return datetime.datetime.now().isoformat( timespec="seconds" )
+
+def upsert( db,entry ):
+    db.execute( f"insert or replace into installations ( {','.join(columns)} ) "
+                f"values ( {','.join( ['?']*len(columns) )} )",
+                [ entry.get( c ) for c in columns ] )
+
+##
+## Description: record the installation of the current configuration
+##
+def record_installation( **kwargs ):
+    if ( filename := index_file( **kwargs ) ) is None:
+        return
+    with index_lock( filename ):
+        try:
+            db = index_open( filename )
+        except sqlite3.Error as e:
+            echo_string( f"WARNING can not open installation index: {e}",**kwargs )
+            return
+        record_in_index( db,**kwargs )
+
+def record_in_index( db,**kwargs ):
+    prefixdir = names.prefixdir_name( **kwargs )
+    package,version = names.package_names( **kwargs )
+    modulepath,moduleversion = names.modulefile_path_and_name( **kwargs )
+    stamp = fingerprint.read_stamp( **kwargs )
+    previous = db.execute( "select installed,size from installations where prefix=?",[ prefixdir ] ).fetchone()
+    # the size is measured when the stamp is written; only an unstamped prefix is walked, once
+    if "size" in stamp:
+        size = stamp["size"]
+    elif previous and previous[1] is not None:
+        size = previous[1]
+    else: size = fingerprint.tree_size( prefixdir )
+    entry = { "prefix":prefixdir, "package":package, "version":version,
+              "envcode":names.environment_code( **kwargs ),
+              "modulefile":f"{modulepath}/{moduleversion}",
+              "fingerprint":stamp.get( "fingerprint","" ),
+              "size":size,
+              "installed":stamp.get( "date",previous[0] if previous else now() ),
+              "updated":now(),
+              "configuration":json.dumps( fingerprint.stored_configuration( **kwargs ) ), }
+    try:
+        with db:
+            upsert( db,entry )
+    except sqlite3.Error as e:
+        echo_string( f"WARNING can not update installation index: {e}",**kwargs )
+    finally:
+        db.close()
+
+##
+## Description: rebuild the index from the installations in the installroot;
+## installations with a fingerprint stamp are recorded completely,
+## others as far as their directory name tells.
+##
+def entry_from_directory( prefix ):
+    try:
+        with open( f"{prefix}/{fingerprint.stamp_name}","r" ) as s:
+            stamp = json.load( s )
+    except ( OSError,json.JSONDecodeError ):
+        stamp = None
+    st = os.stat( prefix )
+    size = stamp["size"] if stamp is not None and "size" in stamp else fingerprint.tree_size( prefix )
+    entry = { "prefix":prefix, "size":size, "updated":now(), }
+    if stamp is not None:
+        configuration = stamp.get( "configuration",{} )
+        entry.update( { "package":stamp.get("package"), "version":stamp.get("version"),
+                        "envcode":stamp.get("envcode"), "fingerprint":stamp.get("fingerprint"),
+                        "installed":stamp.get("date"),
+                        "configuration":json.dumps( configuration ) if configuration else None, } )
+        if configuration:
+            try:
+                modulepath,moduleversion = names.modulefile_path_and_name( **configuration )
+                entry["modulefile"] = f"{modulepath}/{moduleversion}"
+            except Exception: pass
+        return entry
+    name = os.path.basename( prefix )
+    if not ( parts := re.match( r'^installation-(.+?)-([0-9][^-]*)-(.*)$',name ) ):
+        return None
+    entry.update( { "package":parts.group(1), "version":parts.group(2), "envcode":parts.group(3),
+                    "installed":datetime.datetime.fromtimestamp( st.st_mtime ).isoformat( timespec="seconds" ), } )
+    return entry
+
+def reindex( **kwargs ):
+    installroot = kwargs.get( "installroot","" )
+    if ( filename := index_file( **kwargs ) ) is None:
+        echo_string( f"No installroot for an index: {installroot}",**kwargs )
+        return
+    found = []
+    for d in sorted( os.listdir( installroot ) ):
+        prefix = f"{installroot}/{d}"
+        if not d.startswith( "installation-" ) or not os.path.isdir( prefix ):
+            continue
+        # install variants are one level down
+        prefixes = [ prefix ] + [ f"{prefix}/{v}" for v in os.listdir( prefix )
+                                  if os.path.isfile( f"{prefix}/{v}/{fingerprint.stamp_name}" ) ]
+        for p in prefixes:
+            if ( entry := entry_from_directory( p ) ) is not None:
+                found.append( entry )
+    # the installroot is scanned without the lock, only the update holds it
+    with index_lock( filename ):
+        db = index_open( filename )
+        with db:
+            known = [ p for (p,) in db.execute( "select prefix from installations" ) ]
+            for entry in found:
+                upsert( db,entry )
+            removed = [ p for p in known if not os.path.isdir( p ) ]
+            db.executemany( "delete from installations where prefix=?",[ [p] for p in removed ] )
+        db.close()
+    echo_string( f"Indexed {len(found)} installations in {installroot}, removed {len(removed)} stale entries",
+                 **kwargs )
+
+##
+## Description: installations matching `column=pattern` shell-style patterns;
+## a bare pattern matches the package
+## Result: list of dicts
+##
+def query_installations( filters="",**kwargs ):
+    if ( filename := index_file( **kwargs ) ) is None or not os.path.exists( filename ):
+        return None
+    conditions = []; values = []
+    for f in filters.split():
+        column,pattern = f.split( "=",1 ) if "=" in f else ( "package",f )
+        if column not in columns or column=="configuration":
+            raise Exception( f"Can not query on {column}; use one of {columns[:-1]}" )
+        conditions.append( f"{column} glob ?" ); values.append( pattern )
+    where = f"where {' and '.join(conditions)}" if conditions else ""
+    with index_lock( filename,exclusive=False ):
+        db = sqlite3.connect( filename,timeout=30 )
+        db.row_factory = sqlite3.Row
+        try:
+            rows = db.execute( f"select * from installations {where} order by package,version,envcode",
+                               values ).fetchall()
+        finally:
+            db.close()
+    return [ dict(r) for r in rows ]
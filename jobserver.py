@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+##
+## Node-wide GNU make jobserver
+## a named pipe holds one token per job slot; a small server process
+## keeps it open, so the tokens survive between builds.
+## A make or ninja runs one job without a token; the shell that starts it
+## takes a token for that job from the fifo, and puts it back when it is done,
+## so that all builds together run no more jobs than there are slots.
+## Every mpm that builds holds a shared lock on `{fifo}.lock`;
+## the server quits once nobody has held that lock for a while.
+## Tokens of a make that is killed are lost; whoever holds that lock alone
+## knows that no tokens are out, and puts them all back.
+##
+
+#
+# standard python modules
+#
+import fcntl
+import os
+import re
+import subprocess
+import sys
+import time
+
+#
+# my own modules
+#
+import parallel
+import process
+
+# seconds between checks of the server, and idle time before it quits
+poll_interval = 5
+linger = 60
+
+def default_fifo():
+    return f"/tmp/mrpackmod-jobserver-{os.getuid()}"
+
+def server_info( fifo ):
+    # Result: pair pid,slots from the pid file
+    with open( f"{fifo}.pid","r" ) as pidfile:
+        pid,slots = pidfile.read().split()
+    return int(pid),int(slots)
+
+def server_alive( fifo ):
+    try:
+        os.kill( server_info( fifo )[0],0 )
+        return os.path.exists( fifo )
+    except ( OSError,ValueError ):
+        return False
+
+##
+## Description: empty the fifo and put all tokens back;
+## only with the lock held exclusively, when no build holds a token
+##
+def refill( holder,slots ):
+    try:
+        while os.read( holder,4096 ): pass
+    except BlockingIOError: pass
+    os.write( holder,b"+"*slots )
+
+##
+## Description: the server: fill the fifo with tokens and keep it open
+##
+def serve( fifo,slots ):
+    if os.path.exists( fifo ):
+        os.unlink( fifo )
+    os.mkfifo( fifo,0o600 )
+    holder = os.open( fifo,os.O_RDWR|os.O_NONBLOCK )
+    os.write( holder,b"+"*slots )
+    with open( f"{fifo}.pid.{os.getpid()}","w" ) as pidfile:
+        pidfile.write( f"{os.getpid()} {slots}\n" )
+    os.replace( f"{fifo}.pid.{os.getpid()}",f"{fifo}.pid" )
+    lock = os.open( f"{fifo}.lock",os.O_RDWR|os.O_CREAT,0o600 )
+    idle = 0
+    while True:
+        time.sleep( poll_interval )
+        try:
+            fcntl.flock( lock,fcntl.LOCK_EX|fcntl.LOCK_NB )
+        except BlockingIOError:
+            idle = 0; continue
+        idle += poll_interval
+        refill( holder,slots )
+        if idle>=linger:
+            # nobody can join while we hold the lock
+            for f in [ fifo,f"{fifo}.pid", ]:
+                try:
+                    os.unlink( f )
+                except FileNotFoundError: pass
+            return
+        fcntl.flock( lock,fcntl.LOCK_UN )
+
+##
+## Description: join the jobserver, starting it if needed.
+## The shared lock is kept for the lifetime of this process.
+## Result: path of the fifo
+##
+joined = {}
+
+def jobserver_join( **kwargs ):
+    setting = kwargs.get( "jobserver","" )
+    fifo = setting if setting.startswith("/") else default_fifo()
+    if fifo in joined:
+        return fifo
+    lock = os.open( f"{fifo}.lock",os.O_RDWR|os.O_CREAT,0o600 )
+    fcntl.flock( lock,fcntl.LOCK_SH )
+    joined[fifo] = lock
+    if recover_tokens not in process.timeout_hooks:
+        process.timeout_hooks.append( recover_tokens )
+    start = os.open( f"{fifo}.start",os.O_RDWR|os.O_CREAT,0o600 )
+    try:
+        fcntl.flock( start,fcntl.LOCK_EX )
+        if not server_alive( fifo ):
+            slots = kwargs.get( "jobserverslots","" )
+            if not re.match( r'^[0-9]+$',slots ):
+                slots = parallel.available_cpus()
+            subprocess.Popen\
+                ( [ sys.executable,os.path.realpath(__file__),"serve",fifo,str(slots) ],
+                  stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL,
+                  start_new_session=True )
+            for _ in range(100):
+                if server_alive( fifo ): break
+                time.sleep( .1 )
+            else: raise Exception( f"Jobserver did not start on {fifo}" )
+    finally:
+        os.close( start )
+    return fifo
+
+##
+## Description: after a build step was killed, put back the tokens it held,
+## if no other build is running; otherwise the server does so when they are done.
+##
+def recover_tokens():
+    for fifo,lock in joined.items():
+        try:
+            # converting the lock can briefly drop it
+            fcntl.flock( lock,fcntl.LOCK_EX|fcntl.LOCK_NB )
+        except BlockingIOError:
+            fcntl.flock( lock,fcntl.LOCK_SH ); continue
+        try:
+            holder = os.open( fifo,os.O_RDWR|os.O_NONBLOCK )
+            try:
+                refill( holder,server_info( fifo )[1] )
+            finally:
+                os.close( holder )
+        except ( OSError,ValueError ): pass
+        finally:
+            fcntl.flock( lock,fcntl.LOCK_SH )
+
+##
+## Description: version of GNU make or ninja; (0,0) for anything else
+##
+def tool_version( tool="make" ):
+    try:
+        version = subprocess.run( [ tool,"--version" ],capture_output=True,text=True ).stdout
+    except OSError:
+        return (0,0)
+    if tool=="ninja":
+        found = re.match( r'([0-9]+)\.([0-9]+)',version )
+    else: found = re.search( r'GNU Make ([0-9]+)\.([0-9]+)',version )
+    if found:
+        return tuple( int(v) for v in found.groups() )
+    return (0,0)
+
+##
+## Description: shell prefix that makes make or ninja a client of the jobserver:
+## make 4.4 and ninja 1.13 open the fifo by name; older makes get a file descriptor,
+## with the option that was renamed in make 4.2; older ninjas can not be clients.
+## The prefix first takes the token of the job that the tool runs by itself.
+## Result: pair prefix,active; no jobserver gives an empty prefix
+##
+def jobserver_prefix( tool="make",**kwargs ):
+    if not kwargs.get( "jobserver","" ) or kwargs.get( "jobserver" ).lower() in [ "no","off","0", ]:
+        return "",False
+    version = tool_version( tool )
+    if version==(0,0) or ( tool=="ninja" and version<(1,13) ):
+        return "",False
+    fifo = jobserver_join( **kwargs )
+    own_token = f"exec 3<>{fifo} && read -r -n 1 -u 3 && trap 'printf + >&3' EXIT && "
+    if tool=="ninja" or version>=(4,4):
+        return f"{own_token}MAKEFLAGS='--jobserver-auth=fifo:{fifo}' ",True
+    elif version>=(4,2):
+        return f"{own_token}MAKEFLAGS='--jobserver-auth=3,3' ",True
+    return f"{own_token}MAKEFLAGS='--jobserver-fds=3,3 -j' ",True
+
+if __name__=="__main__":
+    if len(sys.argv)==4 and sys.argv[1]=="serve":
+        serve( sys.argv[2],int( sys.argv[3] ) )
+    else:
+        print( f"Usage: {sys.argv[0]} serve fifo slots" ); sys.exit(1)
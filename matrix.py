@@ -0,0 +1,133 @@
+#!/usr/bin/env/python3
+
+#
+# standard python modules
+#
+import concurrent.futures
+import os
+import re
+import shlex
+import sys
+
+#
+# my own modules
+#
+import process
+from process import echo_string,nonnull,nonzero_keyword,error_abort
+
+##
+## Description: parse a list of families
+## each family is `compiler/compilerversion[/mpi/mpiversion][:mode]`
+## Result: list of dicts with the family keywords
+##
+def matrix_families( spec,**kwargs ):
+    families = []
+    for entry in spec.split():
+        if not nonnull( entry ): continue
+        if ":" in entry:
+            entry,mode = entry.split(":",1)
+        else: mode = kwargs.get("mode","")
+        parts = entry.strip("/").split("/")
+        if len(parts) not in [ 2,4, ]:
+            raise Exception( f"Matrix family needs compiler/version[/mpi/version][:mode], not: {entry}" )
+        family = { "compiler":parts[0], "compilerversion":parts[1],
+                   "mpi":"", "mpiversion":"", "mode":mode, }
+        if len(parts)==4:
+            family["mpi"] = parts[2]; family["mpiversion"] = parts[3]
+        families.append( family )
+    return families
+
+def family_label( family ):
+    label = f"{family['compiler']}-{family['compilerversion']}"
+    if nonnull( family["mpi"] ):
+        label += f"_{family['mpi']}-{family['mpiversion']}"
+    return label
+
+##
+## Description: module to load for a prerequisite: `name/version` as given,
+## only the name for a version condition such as `>=3.20`, which `module load` does not know
+##
+def prerequisite_load( prereq ):
+    name,_,version = prereq.partition( "/" )
+    if not nonnull( version ) or re.match( r'^[<>=]',version ):
+        return name
+    return f"{name}/{version}"
+
+##
+## Description: shell commands to load the family and the prerequisites
+##
+def family_loads( family,**kwargs ):
+    loads = []
+    if nonnull( preamble := kwargs.get("matrixpreamble","module reset") ):
+        loads.append( preamble )
+    loads.append( f"module load {family['compiler']}/{family['compilerversion']}" )
+    if nonnull( family["mpi"] ):
+        loads.append( f"module load {family['mpi']}/{family['mpiversion']}" )
+    prereqs = [ prerequisite_load( m ) for m in kwargs.get("modules","").split()
+                if m.split("/")[0].lower() not in [ "mkl","nvpl","blaslapack","mpi", ] ]
+    if len(prereqs)>0:
+        loads.append( f"module load {' '.join(prereqs)}" )
+    return loads
+
+##
+## Description: settings for the child mpm that the module loads do not give;
+## the compiler and mpi loads set TACC_FAMILY_* themselves
+##
+def family_environment( family ):
+    environment = {}
+    if nonnull( family["mode"] ):
+        environment["MODE"] = family["mode"]
+    return environment
+
+def build_family( family,slots,**kwargs ):
+    scriptdir  = kwargs.get( "scriptdir",os.getcwd() )
+    configfile = kwargs.get( "configfile","Configuration" )
+    mpmscript  = kwargs.get( "mpmscript" )
+    actions    = kwargs.get( "matrixactions","configure build module" )
+    mpm = f"{shlex.quote(sys.executable)} {shlex.quote(mpmscript)} -c {shlex.quote(configfile)} -j {slots}"
+    if kwargs.get("tracing"):
+        mpm += " -t"
+    cmdline = " && ".join( family_loads( family,**kwargs ) + [ f"{mpm} {actions}" ] )
+    logname = f"{scriptdir}/matrix_{family_label(family)}.log"
+    status,duration = process.process_child\
+        ( cmdline,logname,cwd=scriptdir,environment=family_environment(family),terminal=None )
+    return { "family":family_label(family), "status":status,
+             "duration":duration, "logfile":logname, }
+
+##
+## Description: build one configuration for many families concurrently
+## the total number of job slots is `jcount`;
+## `matrixjobs` limits the number of families that build at the same time
+##
+def matrix_build( **kwargs ):
+    spec = kwargs.get( "matrixfamilies","" )
+    if not nonnull( spec ):
+        spec = nonzero_keyword( "matrix",**kwargs )
+    if not nonnull( spec ):
+        error_abort( "matrix action needs MATRIX setting or --args with families",**kwargs )
+    families = matrix_families( spec,**kwargs )
+    budget   = max( 1,int( kwargs.get("jcount",6) ) )
+    workers  = min( len(families),budget )
+    if nonnull( jobs := kwargs.get("matrixjobs","") ):
+        workers = max( 1,min( workers,int(jobs) ) )
+    jcount   = max( 1,budget//workers )
+    echo_string( f"Matrix build of {len(families)} families, {workers} at a time with -j {jcount}",
+                 **kwargs )
+    results = []
+    with concurrent.futures.ThreadPoolExecutor( max_workers=workers ) as pool:
+        futures = [ pool.submit( build_family,family,jcount,**kwargs ) for family in families ]
+        for future in concurrent.futures.as_completed( futures ):
+            result = future.result()
+            echo_string( f" .. finished {result['family']} status={result['status']}",**kwargs )
+            results.append( result )
+    results.sort( key=lambda r:r["family"] )
+    echo_string( matrix_summary( results ),**kwargs )
+    return results
+
+def matrix_summary( results ):
+    width = max( [ len("family") ] + [ len(r["family"]) for r in results ] )
+    summary = f"{'family':<{width}}  {'status':<6}  {'time':>8}  log\n"
+    for r in results:
+        status = "ok" if r["status"]==0 else f"fail {r['status']}"
+        summary += f"{r['family']:<{width}}  {status:<6}  {r['duration']:>7.0f}s  {r['logfile']}\n"
+    return summary.rstrip()
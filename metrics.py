@@ -0,0 +1,184 @@
+#!/usr/bin/env/python3
+
+#
+# standard python modules
+#
+import datetime
+import glob
+import json
+import os
+import resource
+import time
+
+#
+# my own modules
+#
+import names
+import process
+from process import echo_string,nonnull
+
+metrics_name = "mrpackmod_metrics.jsonl"
+# all phases of one mpm invocation share a run identifier
+run_id = f"{datetime.datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+# a phase that takes this much, and at least this many seconds, longer
+# than in the previous run is a regression
+regression_factor = 1.2
+regression_minimum = 10
+
+def resource_snapshot():
+    mine     = resource.getrusage( resource.RUSAGE_SELF )
+    children = resource.getrusage( resource.RUSAGE_CHILDREN )
+    return { "wall":time.monotonic(),
+             "user":mine.ru_utime+children.ru_utime,
+             "sys":mine.ru_stime+children.ru_stime,
+             "written":( mine.ru_oublock+children.ru_oublock )*512, }
+
+##
+## Description: the peak memory of a phase is the largest of the commands that ran in it;
+## the runner measures each command, and tells the phases that are open
+##
+open_phases = []
+
+def step_peak( maxrss ):
+    for started in open_phases:
+        started["peakrss"] = max( started["peakrss"],maxrss )
+
+process.step_observers.append( step_peak )
+
+##
+## Description: start timing a phase
+## Result: dict with the phase name and the resources used so far
+##
+def phase_start( phase ):
+    started = { "phase":phase, "start":resource_snapshot(), "peakrss":0, }
+    open_phases.append( started )
+    return started
+
+##
+## Description: environment code, or empty for phases without a mode, such as download and unpack
+##
+def environment_code( **kwargs ):
+    if not nonnull( kwargs.get( "mode","" ) ):
+        return ""
+    return names.environment_code( **kwargs )
+
+##
+## Description: record a phase in the metrics file next to the logs.
+## Times and bytes written are for this process and all its children;
+## peak RSS is that of the largest command in the phase, zero if it ran none.
+##
+def phase_end( started,**kwargs ):
+    start = started["start"]; end = resource_snapshot()
+    open_phases[:] = [ p for p in open_phases if p is not started ]
+    package,version = names.package_names( **kwargs )
+    record = { "run":run_id, "phase":started["phase"],
+               "package":package, "version":version,
+               "envcode":environment_code( **kwargs ),
+               "date":datetime.datetime.now().isoformat( timespec="seconds" ),
+               "wall":round( end["wall"]-start["wall"],3 ),
+               "user":round( end["user"]-start["user"],3 ),
+               "sys":round( end["sys"]-start["sys"],3 ),
+               "peakrss":started["peakrss"],
+               "written":end["written"]-start["written"], }
+    line = json.dumps( record )+"\n"
+    # one append write per record, so concurrent matrix builds do not interleave
+    fd = os.open( f"{kwargs.get('scriptdir',os.getcwd())}/{metrics_name}",
+                  os.O_WRONLY|os.O_APPEND|os.O_CREAT,0o644 )
+    try:
+        os.write( fd,line.encode() )
+    finally:
+        os.close( fd )
+    return record
+
+##
+## Description: find metrics files: given files, or in given directories and their subdirectories
+##
+def metrics_files( paths ):
+    files = []
+    for path in paths:
+        if os.path.isfile( path ):
+            candidates = [ path ]
+        else: candidates = glob.glob( f"{path}/{metrics_name}" )+sorted( glob.glob( f"{path}/*/{metrics_name}" ) )
+        for f in candidates:
+            if os.path.realpath(f) not in [ os.path.realpath(g) for g in files ]:
+                files.append( f )
+    return files
+
+def read_metrics( files ):
+    records = []
+    for file in files:
+        with open( file,"r" ) as metrics:
+            for line in metrics:
+                try:
+                    records.append( json.loads( line ) )
+                except json.JSONDecodeError: continue
+    return records
+
+##
+## Description: per package and family, the phases of the last run of each phase
+## compared to the run before
+## Result: list of dicts, slowest first
+##
+def compare_runs( records ):
+    history = {}
+    for r in sorted( records,key=lambda r:r["date"] ):
+        key = ( f"{r['package']}/{r['version']}",r["envcode"],r["phase"] )
+        runs = history.setdefault( key,[] )
+        # a phase can occur several times in one run: add up
+        if runs and runs[-1]["run"]==r["run"]:
+            for m in [ "wall","user","sys","written", ]:
+                runs[-1][m] += r[m]
+            runs[-1]["peakrss"] = max( runs[-1]["peakrss"],r["peakrss"] )
+        else: runs.append( dict(r) )
+    rows = []
+    for ( package,envcode,phase ),runs in history.items():
+        last = runs[-1]
+        previous = runs[-2]["wall"] if len(runs)>1 else None
+        rows.append( { "package":package, "envcode":envcode, "phase":phase,
+                       "runs":len(runs), "last":last, "previous":previous,
+                       "regression":previous is not None and previous>0
+                       and last["wall"]>regression_factor*previous
+                       and last["wall"]-previous>regression_minimum, } )
+    return sorted( rows,key=lambda r:-r["last"]["wall"] )
+
+def human_size( size ):
+    for unit in [ "B","K","M","G", ]:
+        if size<1024: break
+        size /= 1024
+    else: unit = "T"
+    return f"{size:.0f}{unit}"
+
+def stats_summary( rows ):
+    wp = max( [ len("package") ] + [ len(r["package"]) for r in rows ] )
+    we = max( [ len("family") ] + [ len(r["envcode"]) for r in rows ] )
+    summary = f"{'package':<{wp}}  {'family':<{we}}  {'phase':<9}  {'wall':>8}  {'cpu':>8}  {'rss':>6}  {'written':>7}  {'previous':>8}\n"
+    for r in rows:
+        last = r["last"]
+        previous = f"{r['previous']:.0f}s" if r["previous"] is not None else "-"
+        summary += f"{r['package']:<{wp}}  {r['envcode']:<{we}}  {r['phase']:<9}  {last['wall']:>7.0f}s  {last['user']+last['sys']:>7.0f}s  {human_size(last['peakrss']):>6}  {human_size(last['written']):>7}  {previous:>8}"
+        if r["regression"]:
+            summary += "  SLOWER"
+        summary += "\n"
+    return summary.rstrip()
+
+##
+## Description: summarize metrics of this package, and of sibling package directories,
+## or of the files and directories given as arguments
+##
+def stats( paths="",**kwargs ):
+    scriptdir = kwargs.get( "scriptdir",os.getcwd() )
+    if nonnull( paths ):
+        paths = paths.split()
+    else: paths = [ scriptdir,f"{scriptdir}/..", ]
+    records = read_metrics( metrics_files( paths ) )
+    if len(records)==0:
+        echo_string( f"No metrics found in: {' '.join(paths)}",**kwargs )
+        return []
+    rows = compare_runs( records )
+    echo_string( stats_summary( rows ),**kwargs )
+    totals = {}
+    for r in rows:
+        totals[ r["package"] ] = totals.get( r["package"],0 )+r["last"]["wall"]
+    slowest = sorted( totals.items(),key=lambda t:-t[1] )[:5]
+    echo_string( "Slowest packages: "+", ".join( f"{p} ({t:.0f}s)" for p,t in slowest ),**kwargs )
+    return rows
@@ -16,12 +16,56 @@ import process
 from process import isnull,nonnull,echo_string,error_abort
 from process import abort_on_zero_keyword,zero_keyword,nonzero_keyword,nonzero_keyword_or_default
 from process import abort_on_zero_env
-from process import process_execute
+
+##
+## Lmod queries
+## Lmod keeps the loaded modules and their files in the environment;
+## anything else is asked in one shell invocation.
+## Results are cached on the module environment.
+##
+module_cache = {}
+
+def module_environment_key():
+    return tuple( os.getenv( var,"" ) for var in [ "LOADEDMODULES","MODULEPATH","_LMFILES_", ] )
+
+def module_snapshot( shows=[],**kwargs ):
+    # Result: dict with "list": list of name/version, "show": dict of name to modulefile
+    snapshot = module_cache.setdefault\
+        ( module_environment_key(),{ "list":None, "show":{}, } )
+    if snapshot["list"] is None and nonnull( loaded := os.getenv( "LOADEDMODULES","" ) ):
+        snapshot["list"] = [ mv for mv in loaded.split(":") if nonnull(mv) ]
+        lmfiles = os.getenv( "_LMFILES_","" ).split(":")
+        if len(lmfiles)==len(snapshot["list"]):
+            for mv,lmfile in zip( snapshot["list"],lmfiles ):
+                snapshot["show"].setdefault( mv.split("/")[0].lower(),lmfile )
+    query = [ m for m in shows if m not in snapshot["show"] ]
+    if snapshot["list"] is None or len(query)>0:
+        separator = "__mrpackmod_module__"
+        cmdline = f"echo {separator} list ; module -t list 2>&1"
+        for m in query:
+            cmdline += f" ; echo {separator} {m} ; module -t show {m} 2>&1"
+        _,output = process.session_execute( cmdline,**{ **kwargs,"terminal":None } )
+        section = None; sections = {}
+        for line in output:
+            if line.startswith( separator ):
+                section = line.split()[1]; sections[section] = []
+            elif section is not None:
+                sections[section].append( line )
+        if snapshot["list"] is None:
+            snapshot["list"] = [ mv for line in sections.get("list",[]) for mv in line.split() ]
+        for m in query:
+            location = ""
+            for line in sections.get(m,[]):
+                if path := re.search( r'(/\S+):$',line ):
+                    location = path.groups()[0]; break
+            snapshot["show"][m] = location
+    return snapshot
 
 def loaded_modules( **kwargs ):
-    name_version_list = process_execute\
-        ( "module -t list 2>&1 | tr '\n' ' '",**kwargs ).split()
-    return [ f"{mv}/".split('/',1) for mv in name_version_list ]
+    return [ f"{mv}/".split('/',1) for mv in module_snapshot( **kwargs )["list"] ]
+
+def module_location( module,**kwargs ):
+    return module_snapshot( [module],**kwargs )["show"][module]
 
 non_packages = [ "mkl","nvpl","blaslapack", "mpi", ]
 def test_modules( **kwargs ):
@@ -33,9 +77,10 @@ def test_modules( **kwargs ):
     if tracing:
         modulepath = re.sub( ":","\n",os.getenv( "MODULEPATH" ) )
         echo_string( f"\nUsing modulepath {modulepath}\n",**kwargs )
-    for m in modules.split(" "):
-        if not nonnull(m):continue
-        mod,ver = f"{m}/".split('/',maxsplit=1)
+    prereqs = [ f"{m}/".split('/',maxsplit=1) for m in modules.split(" ") if nonnull(m) ]
+    module_snapshot( [ mod.lower() for mod,_ in prereqs if mod.lower() not in non_packages ],
+                     **kwargs )
+    for mod,ver in prereqs:
         mod = mod.lower(); ver=ver.strip("/")
         if mod in non_packages:
             echo_string( f"Skip test for non-package: {mod}",**kwargs )
@@ -46,7 +91,7 @@ def test_modules( **kwargs ):
             echo_string( f"Please load module: {mod}",**kwargs )
             continue
         echo_string( f" .. module {mod} is at: {packdir}" )
-        loc = process_execute( f"module -t show {mod}",**kwargs,terminal=None )
+        loc = module_location( mod,**kwargs )
         echo_string( f" .. module {mod} loaded from: {loc}",**kwargs )
         if not os.path.isdir(packdir):
             error = True
@@ -8,13 +8,15 @@ parser = argparse.ArgumentParser\
     ( prog="MrPackMod",
       description="Package installer with LMod support",
       add_help=True )
-parser.add_argument( '-j','--jcount',default='6' )
+parser.add_argument( '-j','--jcount',default='6',help="number of make jobs, or `auto`" )
 parser.add_argument( '-t','--trace',action='store_true',default=False )
 parser.add_argument( '-c','--configuration',default="Configuration")
 parser.add_argument( '-d','--dependencies',action='store_true',default=False )
 parser.add_argument( '-f','--find_string',action='store_true',default=False )
-parser.add_argument( '-A','--args',default="" )
-parser.add_argument( 'actions', nargs='*', help="test version configure build module dependencies findstring, install=configure+build+module" )
+parser.add_argument( '-A','--args',default="",
+                     help="arguments of the action; for find_string: options -i -w -F -E -l and a grep pattern" )
+parser.add_argument( '--force',action='store_true',default=False )
+parser.add_argument( 'actions', nargs='*', help="test version configure build module dependencies findstring matrix stack stats list query reindex regenerate, install=configure+build+module" )
 
 arguments = parser.parse_args()
 configfile   = arguments.configuration
@@ -22,6 +24,7 @@ dependencies = arguments.dependencies
 find_string  = arguments.find_string
 jcount       = arguments.jcount
 tracing      = arguments.trace
+force        = arguments.force
 command_arguments = arguments.args
 
 actions = arguments.actions
@@ -30,19 +33,40 @@ if tracing:
 
 from MrPackMod import config 
 from MrPackMod import download
+from MrPackMod import fingerprint
 from MrPackMod import info 
+from MrPackMod import installindex
 from MrPackMod import install
+from MrPackMod import matrix
+from MrPackMod import metrics
 from MrPackMod import modules
 from MrPackMod import names 
+from MrPackMod import parallel
 from MrPackMod import process
+from MrPackMod import regenerate
+from MrPackMod import search
+from MrPackMod import stack
 
 def mpm( args,**kwargs ):
+    if args==[ "stack", ]:
+        kwargs["jcount"] = parallel.resolve_jcount( kwargs.get("jcount","6"),**kwargs )
+        # stack level: no configuration in the current directory
+        stackroot = os.path.abspath( process.nonnull(command_arguments) and command_arguments or os.getcwd() )
+        stack.stack_build( stackroot=stackroot,
+                           configfile=configfile,mpmscript=os.path.realpath(__file__),
+                           logfiles={},**config.read_stack_settings( stackroot ),**kwargs )
+        return
     configuration = config.read_config(configfile,tracing)
     # take care of jcount, dependencies, tracing
     for arg,val in kwargs.items():
         configuration[arg] = val
     configuration["logfiles"] = {} # name,handle pairs
     configuration["scriptdir"] = os.getcwd()
+    configuration["configfile"] = configfile
+    configuration["mpmscript"] = os.path.realpath(__file__)
+    configuration["jcount"] = parallel.resolve_jcount( configuration["jcount"],**configuration )
+    # all names are computed once, on first use, from the final settings
+    configuration["context"] = names.build_context( **configuration )
     #print(configuration)
     for action in args:
         if tracing:
@@ -53,27 +77,45 @@ def mpm( args,**kwargs ):
         elif action=="dependencies":
             print( configuration['modules'] )
         elif action=="find_string":
-            if args := process.nonnull( command_arguments ):
-                srcdir = names.srcdir_name( **configuration )
-                process.process_execute\
-                    ( f"find {srcdir} -type f -exec grep "+command_arguments+" {} \\; -print",
-                      **configuration )
+            if process.nonnull( command_arguments ):
+                search.find_string( command_arguments,**configuration )
             else:
-                echo_string( f"WARNING: find_string command needs --args",**configuration )
+                process.echo_string( f"WARNING: find_string command needs --args",**configuration )
+        elif action=="matrix":
+            matrix.matrix_build( matrixfamilies=command_arguments,**configuration )
+        elif action=="stats":
+            metrics.stats( command_arguments,**configuration )
         elif action=="list":
             info.list_installations( **configuration )
+        elif action=="query":
+            info.query_installations( command_arguments,**configuration )
+        elif action=="reindex":
+            installindex.reindex( **configuration )
+        elif action=="regenerate":
+            regenerate.regenerate_modules( command_arguments,**configuration )
         elif action=="test":
             modules.test_modules( **configuration )
         elif action=="version":
             print( configuration["packageversion"] )
         # download stuff
         elif action=="download":
+            phase = metrics.phase_start( "download" )
             download.download_from_url( **configuration )
+            metrics.phase_end( phase,**configuration )
         elif action in [ "unpack", "untar", ]:
+            phase = metrics.phase_start( "unpack" )
             srcdir_local = names.srcdir_local_name( **configuration )
             download.unpack_from_url( srcdir=srcdir_local,**configuration )
+            metrics.phase_end( phase,**configuration )
         # build stuff
         elif action in [ "install", "configure", "build", "module", ]:
+            if action in [ "install", "build", ]:
+                buildprint = fingerprint.build_fingerprint( **configuration )
+            if action=="install" and not force \
+               and fingerprint.install_is_current( buildprint,**configuration ):
+                install.write_module_file( **configuration )
+                installindex.record_installation( **configuration )
+                continue
             if action in [ "install", "configure", ]:
                 if ( system := configuration["buildsystem"].lower() ) == "cmake":
                     install.cmake_configure( **configuration )
@@ -86,8 +128,10 @@ def mpm( args,**kwargs ):
                 elif system == "autotools":
                     install.autotools_build( **configuration )
                 else: raise Exception( f"Can only build for cmake and autotools, not: {system}" )
+                fingerprint.write_stamp( buildprint,**configuration )
             if action in [ "install", "module", ]:
                 install.write_module_file( **configuration )
+                installindex.record_installation( **configuration )
         else: process.error_abort( f"Unknown action: {action}" )
                 
-mpm( actions,tracing=tracing,jcount=jcount,dependencies=dependencies )
+mpm( actions,tracing=tracing,jcount=jcount,dependencies=dependencies,force=force )
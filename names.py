@@ -7,6 +7,7 @@ import datetime
 import os
 import re
 import sys
+import types
 
 #
 # my own modules
@@ -29,6 +30,8 @@ from process import error_abort,requirenonzero,nonnull
 # Result: pair package,version
 #
 def package_names( **kwargs ):
+    if ( cached := from_context( "packagenames",**kwargs ) ) is not None:
+        return cached
     package = kwargs.get("package").lower()
     version = kwargs.get("packageversion").lower()
     terminal = kwargs.get("terminal")
@@ -44,6 +47,8 @@ def package_names( **kwargs ):
 # name of a logfile
 # 
 def logfile_name( logstage,**kwargs ):
+    if ( context := kwargs.get("context") ) is not None and "logfile" not in context.computing:
+        return context.logfile( logstage )
     scriptdir       = abort_on_zero_keyword( "scriptdir",**kwargs )
     packagename,_   = package_names( **kwargs )
     _,moduleversion = module_names( **kwargs )
@@ -58,6 +63,8 @@ def logfile_name( logstage,**kwargs ):
 # Create a directory for either building or install
 #
 def create_homedir( **kwargs ):
+    if ( cached := from_context( "homedir",**kwargs ) ) is not None:
+        return cached
     root     = kwargs.get( "packageroot",None )
     package  = kwargs.get( "package","nullpackage" )
     homedir  = kwargs.get( "homedir",None )
@@ -79,6 +86,17 @@ def create_homedir( **kwargs ):
             sys.exit(1)
     return homedir
 
+#
+# Directory for mpm's own caches
+#
+def cache_root( **kwargs ):
+    if nonnull( root := os.getenv( "MRPACKMODCACHE","" ) ):
+        return root
+    xdg = os.getenv( "XDG_CACHE_HOME","" )
+    if not nonnull( xdg ):
+        xdg = f"{os.path.expanduser('~')}/.cache"
+    return f"{xdg}/mrpackmod"
+
 ##
 ## Description: compute compiler & mpi name & version
 ## Result: quintuple system,cname,cversion,mname,mversion
@@ -115,6 +133,8 @@ def compilers_names( **kwargs ):
 ## Description: compute single system/compiler/mpi identifier
 ##
 def environment_code( **kwargs ):
+    if ( cached := from_context( "envcode",**kwargs ) ) is not None:
+        return cached
     mode = abort_on_zero_keyword( "mode",**kwargs )
     systemcode,compilercode,compilerversion,compilershortversion,mpicode,mpiversion = \
         family_names( **kwargs )
@@ -132,6 +152,8 @@ def systemnames():
     return mpicode,mpiversion
 
 def install_extension( **kwargs ):
+    if ( cached := from_context( "installext",**kwargs ) ) is not None:
+        return cached
     package,packageversion = package_names( **kwargs )
     envcode = abort_on_null( environment_code( **kwargs ),"environment code for install ext" )
     installext = f"{packageversion}-{envcode}"
@@ -146,6 +168,8 @@ def srcdir_local_name( **kwargs ):
     return f"{packagebasename}-{packageversion}"
 
 def srcdir_name( **kwargs ):
+    if ( cached := from_context( "srcdir",**kwargs ) ) is not None:
+        return cached
     homedir = create_homedir( **kwargs )
     srcdir_local = srcdir_local_name( **kwargs )
     if srcdir := nonzero_keyword( "srcpath",**kwargs ):
@@ -153,6 +177,8 @@ def srcdir_name( **kwargs ):
     else: return  f"{homedir}/{srcdir_local}"
 
 def builddir_name( **kwargs ):
+    if ( cached := from_context( "builddir",**kwargs ) ) is not None:
+        return cached
     if bdir := nonzero_keyword( "builddirroot",**kwargs ):
         builddir = bdir
     elif bdir := nonzero_keyword( "packageroot",**kwargs ):
@@ -166,6 +192,8 @@ def builddir_name( **kwargs ):
     return builddir
 
 def prefixdir_name( **kwargs ):
+    if ( cached := from_context( "prefixdir",**kwargs ) ) is not None:
+        return cached
     package,packageversion = package_names( **kwargs )
     if nonnull( pdir:=kwargs.get("installpath","") ):
         echo_string( f"Using external prefixdir: {pdir}" )
@@ -198,7 +226,9 @@ def prefixdir_name( **kwargs ):
     return prefixdir
 
 def package_dir_names( **kwargs ):
-    prefixdir = names.prefixdir_name( **kwargs )
+    if ( cached := from_context( "packagedirs",**kwargs ) ) is not None:
+        return cached
+    prefixdir = prefixdir_name( **kwargs )
     # lib
     if zero_keyword( "nolib",**kwargs ):
         libdir = f"{prefixdir}/lib64"
@@ -222,6 +252,8 @@ def package_dir_names( **kwargs ):
     return prefixdir,libdir,incdir,bindir
 
 def modulefile_path_and_name( **kwargs ):
+    if ( cached := from_context( "modulefile",**kwargs ) ) is not None:
+        return cached
     abort_on_nonzero_env( "MODULEDIRSET" )
     package,packageversion = package_names( **kwargs )
     modulename,moduleversion = module_names( **kwargs )
@@ -248,6 +280,8 @@ def modulefile_path_and_name( **kwargs ):
         return f"{modulepath}/{modulename}",f"{moduleversion}.lua"
 
 def module_names( **kwargs):
+    if ( cached := from_context( "modulenames",**kwargs ) ) is not None:
+        return cached
     package,packageversion = package_names( **kwargs )
     modulename = kwargs.get( "modulename",package )
     if alt := nonzero_keyword( "modulenamealt" ):
@@ -256,3 +290,78 @@ def module_names( **kwargs):
     if nonnull( mx := kwargs.get("moduleversionextra") ):
         moduleversion += f"-{mx}"
     return modulename,moduleversion
+
+##
+## Build context
+## all names for one action are computed at most once,
+## on first use, and then kept; filesystem probes are done only then.
+## The context travels in the configuration as `context`,
+## and every function above answers from it when it is present, without looking at the other keywords:
+## the context stands for the settings it was built from, which are a read-only snapshot.
+## A call for other settings leaves out the context, or carries a context built from those settings;
+## the context is built once the settings of the run are final.
+##
+context_derivations = {
+    "packagenames" : package_names,
+    "modulenames"  : module_names,
+    "envcode"      : environment_code,
+    "installext"   : install_extension,
+    "homedir"      : create_homedir,
+    "srcdir"       : srcdir_name,
+    "builddir"     : builddir_name,
+    "prefixdir"    : prefixdir_name,
+    "packagedirs"  : package_dir_names,
+    "modulefile"   : modulefile_path_and_name,
+}
+
+class BuildContext:
+    __slots__ = ( "settings", "computing", "logfiles", ) + tuple( context_derivations.keys() )
+
+    def __init__( self,settings ):
+        object.__setattr__( self,"settings",types.MappingProxyType( settings ) )
+        object.__setattr__( self,"computing",set() )
+        object.__setattr__( self,"logfiles",{} )
+
+    def __setattr__( self,name,value ):
+        raise AttributeError( f"BuildContext names are computed, can not set {name}" )
+
+    def __getattr__( self,name ):
+        # only called for slots that have not been computed yet
+        if name not in context_derivations:
+            raise AttributeError( name )
+        self.computing.add( name )
+        try:
+            value = context_derivations[name]( **self.settings,context=self )
+        finally:
+            self.computing.discard( name )
+        object.__setattr__( self,name,value )
+        return value
+
+    @property
+    def libdir( self ):
+        return self.packagedirs[1]
+    @property
+    def incdir( self ):
+        return self.packagedirs[2]
+    @property
+    def bindir( self ):
+        return self.packagedirs[3]
+
+    def logfile( self,logstage ):
+        if logstage not in self.logfiles:
+            self.computing.add( "logfile" )
+            try:
+                self.logfiles[logstage] = logfile_name( logstage,**self.settings,context=self )
+            finally:
+                self.computing.discard( "logfile" )
+        return self.logfiles[logstage]
+
+def from_context( attribute,**kwargs ):
+    if ( context := kwargs.get("context") ) is None or attribute in context.computing:
+        return None
+    return getattr( context,attribute )
+
+def build_context( **kwargs ):
+    settings = { key:val for key,val in kwargs.items()
+                 if key not in [ "context", "logfiles", "process", ] }
+    return BuildContext( settings )
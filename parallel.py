@@ -0,0 +1,181 @@
+#!/usr/bin/env/python3
+
+#
+# standard python modules
+#
+import datetime
+import json
+import math
+import os
+
+#
+# my own modules
+#
+import names
+from process import echo_string,trace_string
+
+# memory per compile job when a package has no history
+default_job_memory = 1<<30
+# head room on top of the measured memory per job
+memory_margin = 1.25
+# number of measurements kept per package
+history_length = 5
+
+def read_first_line( filename ):
+    try:
+        with open( filename,"r" ) as f:
+            return f.readline().strip()
+    except OSError:
+        return ""
+
+##
+## Description: directories of our own cgroup and its ancestors, for one controller;
+## under Slurm or systemd the limits are set there, not at the root.
+## Result: list of pairs version,directory, innermost first
+##
+cgroup_root = "/sys/fs/cgroup"
+proc_cgroup = "/proc/self/cgroup"
+
+def cgroup_directories( controller ):
+    try:
+        with open( proc_cgroup,"r" ) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    mounts = []
+    for line in lines:
+        fields = line.split( ":",2 )
+        if len(fields)!=3:
+            continue
+        hierarchy,controllers,path = fields
+        if hierarchy=="0" and controllers=="":
+            # v2 is mounted at the root, or next to the v1 controllers
+            for top in [ cgroup_root,f"{cgroup_root}/unified", ]:
+                if os.path.exists( f"{top}/cgroup.controllers" ):
+                    mounts.append( ( 2,top,path ) ); break
+        elif controller in controllers.split( "," ):
+            for top in [ f"{cgroup_root}/{controllers}",f"{cgroup_root}/{controller}", ]:
+                if os.path.isdir( top ):
+                    mounts.append( ( 1,top,path ) ); break
+    directories = []
+    for version,top,path in mounts:
+        path = path.strip( "/" )
+        while True:
+            if os.path.isdir( directory := f"{top}/{path}" if path else top ):
+                directories.append( ( version,directory ) )
+            if not path:
+                break
+            path = os.path.dirname( path )
+    return directories
+
+def read_number( filename ):
+    try:
+        return int( read_first_line( filename ) )
+    except ValueError:
+        return None
+
+##
+## Description: cores we may use: affinity mask, limited by the tightest cgroup cpu quota
+##
+def available_cpus():
+    try:
+        cpus = len( os.sched_getaffinity(0) )
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    for version,directory in cgroup_directories( "cpu" ):
+        if version==2:
+            quota,period = ( read_first_line( f"{directory}/cpu.max" )+" " ).split(" ")[:2]
+            quota,period = ( int(quota),int(period) ) if quota.isdigit() and period.isdigit() else ( None,None )
+        else:
+            quota  = read_number( f"{directory}/cpu.cfs_quota_us" )
+            period = read_number( f"{directory}/cpu.cfs_period_us" )
+        # no quota is `max` in v2, -1 in v1
+        if quota is not None and period is not None and quota>0 and period>0:
+            cpus = min( cpus,math.ceil( quota/period ) )
+    return max( 1,cpus )
+
+##
+## Description: memory available to us in bytes: MemAvailable, limited by the tightest cgroup limit
+##
+def available_memory():
+    memory = None
+    try:
+        with open( "/proc/meminfo","r" ) as meminfo:
+            for line in meminfo:
+                if line.startswith( "MemAvailable:" ):
+                    memory = int( line.split()[1] )*1024
+    except OSError: pass
+    for version,directory in cgroup_directories( "memory" ):
+        if version==2:
+            limit,usage = f"{directory}/memory.max",f"{directory}/memory.current"
+        else: limit,usage = f"{directory}/memory.limit_in_bytes",f"{directory}/memory.usage_in_bytes"
+        # no limit is `max` in v2, and a huge number in v1
+        if ( total := read_number( limit ) ) is None or ( used := read_number( usage ) ) is None:
+            continue
+        memory = total-used if memory is None else min( memory,total-used )
+    return memory
+
+def history_file( package ):
+    return f"{names.cache_root()}/parallel/{package}.json"
+
+def read_history( package ):
+    try:
+        with open( history_file( package ),"r" ) as history:
+            return json.load( history )
+    except ( OSError,json.JSONDecodeError ):
+        return []
+
+##
+## Description: memory per compile job for this package:
+## the largest recent peak, or a default
+##
+def job_memory( package ):
+    peaks = [ h["peakrss"] for h in read_history( package ) if h.get("peakrss",0)>0 ]
+    return max( peaks ) if peaks else default_job_memory
+
+##
+## Description: number of make jobs from cores, load and memory
+## Result: int; without a package only cores and load count
+##
+def auto_jcount( packagename=None,**kwargs ):
+    cpus = available_cpus()
+    load = os.getloadavg()[0]
+    jobs = max( 1,min( cpus,round( cpus-load )+1 ) )
+    reason = f"{cpus} cores, load {load:.1f}"
+    if packagename is not None and ( memory := available_memory() ) is not None:
+        perjob = job_memory( packagename )
+        jobs = max( 1,min( jobs,int( memory/( perjob*memory_margin ) ) ) )
+        reason += f", {memory>>20}M available at {perjob>>20}M per job"
+    echo_string( f"Parallel make with -j {jobs}: {reason}",**kwargs )
+    return jobs
+
+##
+## Description: resolve a jcount setting; `auto` is computed, anything else is kept
+##
+def resolve_jcount( jcount,**kwargs ):
+    if str(jcount).lower()!="auto":
+        return jcount
+    if "package" in kwargs:
+        package,_ = names.package_names( **kwargs )
+        return str( auto_jcount( package,**kwargs ) )
+    return str( auto_jcount( **kwargs ) )
+
+##
+## Description: remember the peak memory of the compile jobs after a build;
+## `peakrss` is the largest process of the build steps, i.e., the largest compile job
+##
+def record_build( jobs,wall,peakrss,**kwargs ):
+    package,version = names.package_names( **kwargs )
+    history = read_history( package )
+    history.append( { "version":version, "envcode":names.environment_code( **kwargs ),
+                      "jobs":int(jobs), "wall":round( wall,1 ), "peakrss":peakrss,
+                      "date":datetime.datetime.now().isoformat( timespec="seconds" ), } )
+    history = history[-history_length:]
+    filename = history_file( package )
+    try:
+        os.makedirs( os.path.dirname( filename ),exist_ok=True )
+        with open( f"{filename}.{os.getpid()}","w" ) as f:
+            json.dump( history,f,indent=1 )
+        os.replace( f"{filename}.{os.getpid()}",filename )
+    except OSError: return
+    trace_string( f"Recorded build of {package} with -j {jobs}: peak {peakrss>>20}M per job",**kwargs )
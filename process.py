@@ -3,10 +3,22 @@
 ##
 ## python modules
 ##
+import asyncio
+import atexit
+import codecs
+import collections
+import gzip
 import os
+import queue
 import re
+import shlex
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import uuid
 
 def echo_string( string,**kwargs ):
     if  terminal:= kwargs.get( "terminal",sys.stdout ):
@@ -15,6 +27,157 @@ def echo_string( string,**kwargs ):
         #print( f"log to {logname}: {string}" )
         print( string,file=loghandle )
 
+##
+## Bulk output
+## command output is handled in batches of lines:
+## one write per logfile, and with a `terminalrate` setting
+## the terminal gets at most that many lines per second.
+## Output can come from several threads, so the throttle is locked.
+##
+terminal_throttle = { "window":0., "printed":0, "skipped":0, }
+terminal_lock = threading.Lock()
+
+def echo_lines( lines,**kwargs ):
+    if len(lines)==0: return
+    if terminal := kwargs.get( "terminal",sys.stdout ):
+        if not nonnull( rate := kwargs.get( "terminalrate","" ) ):
+            print( "\n".join( lines ),file=terminal )
+        else:
+            with terminal_lock:
+                if time.monotonic()-terminal_throttle["window"]>=1.:
+                    report_throttled( terminal )
+                    terminal_throttle.update( window=time.monotonic(),printed=0 )
+                room = max( 0,int(rate)-terminal_throttle["printed"] )
+                if room>0:
+                    print( "\n".join( lines[:room] ),file=terminal )
+                terminal_throttle["printed"] += min( room,len(lines) )
+                terminal_throttle["skipped"] += max( 0,len(lines)-room )
+    text = "\n".join( lines )+"\n"
+    for logname,loghandle in kwargs.get("logfiles",{}).items():
+        loghandle.write( text )
+
+def report_throttled( terminal ):
+    # call with the lock held
+    if terminal and terminal_throttle["skipped"]>0:
+        print( f" .. {terminal_throttle['skipped']} more lines only in the logfiles",file=terminal )
+        terminal_throttle["skipped"] = 0
+
+def echo_throttled( terminal ):
+    with terminal_lock:
+        report_throttled( terminal )
+
+##
+## Description: read output in large chunks and hand it on in batches of lines,
+## stripped, without empty lines.
+## With a sentinel, reading stops at the line that starts with it.
+## Result: the sentinel line, or None at end of file
+##
+read_size = 1<<16
+
+class LineBuffer:
+    def __init__( self ):
+        self.decoder = codecs.getincrementaldecoder( "utf-8" )( "replace" )
+        self.partial = ""
+    def feed( self,chunk,final=False ):
+        lines = ( self.partial+self.decoder.decode( chunk,final=final ) ).split( "\n" )
+        self.partial = "" if final else lines.pop()
+        return lines
+    @staticmethod
+    def clean( lines ):
+        return [ l for l in ( l.strip( " \t\r" ) for l in lines ) if l!="" ]
+
+def read_lines( stream,handle_lines,sentinel=None ):
+    fd = stream.fileno()
+    buffer = LineBuffer()
+    while True:
+        chunk = os.read( fd,read_size )
+        if not chunk:
+            handle_lines( buffer.clean( buffer.feed( b"",final=True ) ) )
+            return None
+        lines = buffer.feed( chunk )
+        found = None
+        if sentinel is not None:
+            for i,line in enumerate( lines ):
+                if line.startswith( sentinel ):
+                    found = line; lines = lines[:i]; break
+        handle_lines( buffer.clean( lines ) )
+        if found is not None:
+            return found
+
+##
+## Logfile with a background writer thread
+## writes are queued and written in large blocks, optionally compressed
+## with gzip, or zstd if the zstandard module or the zstd program is available.
+##
+class LogWriter:
+    def __init__( self,filename,compression="" ):
+        self.child = None
+        if compression in [ "gz","gzip", ]:
+            self.name = f"{filename}.gz"
+            self.file = gzip.open( self.name,"wb",compresslevel=3 )
+        elif compression in [ "zst","zstd", ]:
+            self.name = f"{filename}.zst"
+            try:
+                import zstandard
+                self.file = zstandard.ZstdCompressor( level=3 ).stream_writer( open( self.name,"wb" ) )
+            except ImportError:
+                self.child = subprocess.Popen\
+                    ( [ "zstd","-q","-f","-o",self.name ],stdin=subprocess.PIPE )
+                self.file = self.child.stdin
+        elif compression in [ "", "none", ]:
+            self.name = filename
+            self.file = open( self.name,"wb",buffering=1<<20 )
+        else: raise Exception( f"Unknown log compression: {compression}" )
+        self.queue  = queue.SimpleQueue()
+        self.error  = None
+        self.thread = threading.Thread( target=self.writer,daemon=True )
+        self.thread.start()
+
+    def writer( self ):
+        # after an error the queue is still drained, so that flush and close do not hang;
+        # the error is raised again in the writing thread
+        while True:
+            items = [ self.queue.get() ]
+            while not self.queue.empty():
+                items.append( self.queue.get_nowait() )
+            text = "".join( item for item in items if isinstance( item,str ) )
+            try:
+                if text!="" and self.error is None:
+                    self.file.write( text.encode() )
+                if self.error is None and any( isinstance( item,threading.Event ) for item in items ):
+                    self.file.flush()
+            except Exception as e:
+                self.error = e
+            for item in items:
+                if isinstance( item,threading.Event ):
+                    item.set()
+            if None in items:
+                return
+
+    def check( self ):
+        if ( error := self.error ) is not None:
+            self.error = None
+            raise Exception( f"Writing logfile {self.name} failed: {error}" ) from error
+
+    def write( self,text ):
+        self.check()
+        self.queue.put( text )
+
+    def flush( self ):
+        done = threading.Event()
+        self.queue.put( done ); done.wait()
+        self.check()
+
+    def close( self ):
+        self.queue.put( None ); self.thread.join()
+        try:
+            self.file.close()
+        except Exception as e:
+            if self.error is None: self.error = e
+        if self.child is not None and self.child.wait()!=0 and self.error is None:
+            self.error = Exception( f"zstd exited with status {self.child.returncode}" )
+        self.check()
+
 def trace_string( string,**kwargs ):
     if kwargs.get( "tracing" ):
         echo_string( string,**kwargs )
@@ -89,52 +252,349 @@ def unimplemented( var ):
     except:
         pass
 
+##
+## Description: start a login shell;
+## the keyword `environment` holds extra environment variables for it
+##
 def process_initiate( **kwargs ):
     return subprocess.Popen\
         (['/bin/bash', '-l'], 
          stdin=subprocess.PIPE, 
          stdout=subprocess.PIPE, 
          stderr=subprocess.STDOUT,
+         env={ **os.environ,**kwargs.get( "environment",{} ) },
          text=True,
          bufsize=1)
 
-def process_terminate( process,**kwargs ):
+##
+## Description: wait until an explicitly started shell has run everything written to it,
+## and read the output so far; a sentinel carries the exit status of the last command.
+## With `close` the shell is closed and waited for.
+## Result: pair status,last line of output; the status is None if the shell ended early
+##
+def shell_sync( process,close=False,**kwargs ):
+    sentinel = f"__mrpackmod_done_{uuid.uuid4().hex}__"
     process_input = process.stdin
-    process_input.flush()
-    process_input.close()
-    #echo_string( "Output:",**kwargs )
-    lastline = ""
-    while True:
-        line = process.stdout.readline()
-        if not line:
-            break
-        line = re.sub( r'^[ \t]*','', re.sub( r'[ \t\n]*$','', line ) )
-        if line != "":
-            echo_string( line,**kwargs )
-            lastline = line
-    #echo_string( " .. end of output",**kwargs )
+    try:
+        process_input.write( f"printf '\\n%s %d\\n' {sentinel} $?\n" )
+        process_input.flush()
+        if close:
+            process_input.close()
+    except BrokenPipeError:
+        # the shell has exited already: a checked command failed
+        pass
+    lastline = [""]
+    def handle_lines( lines ):
+        echo_lines( lines,**kwargs )
+        if lines: lastline[0] = lines[-1]
+    line = read_lines( process.stdout,handle_lines,sentinel )
+    if line is not None and close:
+        # whatever the logout prints
+        read_lines( process.stdout,handle_lines )
+    echo_throttled( kwargs.get( "terminal",sys.stdout ) )
+    return ( int( line.split()[1] ) if line is not None else None ),lastline[0]
+
+def shell_finish( process,**kwargs ):
+    # Result: pair status,last line of output
+    status,lastline = shell_sync( process,close=True,**kwargs )
+    try:
+        # reaping the shell ourselves gives the peak memory of it and its commands
+        _,waitstatus,usage = os.wait4( process.pid,0 )
+        process.returncode = os.waitstatus_to_exitcode( waitstatus )
+        step_measured( usage.ru_maxrss*1024 )
+    except ChildProcessError: pass
     process.wait()
-    return lastline
+    return ( status if status is not None else process.returncode ),lastline
+
+##
+## Description: let an explicitly started shell catch up;
+## with `check` a failure so far aborts
+## Result: exit status of the last command
+##
+def process_sync( process,**kwargs ):
+    status,_ = shell_sync( process,**kwargs )
+    if status is None:
+        status = process.wait()
+    if status!=0 and kwargs.get("check"):
+        error_abort( f"Shell commands ended with status {status}",**kwargs )
+    return status
+
+##
+## Description: close an explicitly started shell;
+## with `check` a nonzero status of the last command aborts
+## Result: exit status of the last command
+##
+def process_terminate( process,**kwargs ):
+    status,_ = shell_finish( process,**kwargs )
+    if status!=0:
+        if kwargs.get("check"):
+            error_abort( f"Shell commands ended with status {status}",**kwargs )
+        trace_string( f"Shell commands ended with status {status}",**kwargs )
+    return status
+
+##
+## Persistent shell session
+## one login shell is started on first use and reused for all commands
+## that do not need their own shell.
+## Each command runs in a subshell, so `cd` and `export` do not leak,
+## and is followed by a sentinel line carrying its exit status.
+##
+shell_session = None
+session_started = {}
+
+def session_initiate( **kwargs ):
+    global shell_session,session_started
+    if shell_session is None or shell_session.poll() is not None:
+        session_started = dict( os.environ )
+        shell_session = process_initiate()
+        # swallow whatever the login profile prints
+        sentinel = f"__mrpackmod_ready_{uuid.uuid4().hex}__"
+        shell_session.stdin.write( f"printf '\\n%s\\n' {sentinel}\n" )
+        shell_session.stdin.flush()
+        read_lines( shell_session.stdout,lambda lines:None,sentinel )
+    return shell_session
+
+def session_terminate( **kwargs ):
+    global shell_session
+    if shell_session is not None:
+        if shell_session.poll() is None:
+            try:
+                shell_session.stdin.close()
+                shell_session.wait( timeout=5 )
+            except Exception:
+                shell_session.kill()
+        shell_session = None
+
+atexit.register( session_terminate )
+
+def session_execute( cmdline,**kwargs ):
+    # Result: pair status,output lines
+    session  = session_initiate( **kwargs )
+    sentinel = f"__mrpackmod_done_{uuid.uuid4().hex}__"
+    session.stdin.write\
+        ( f"( cd {shlex.quote(os.getcwd())} && {cmdline}\n ) < /dev/null 2>&1\n"
+          +f"printf '\\n%s %d\\n' {sentinel} $?\n" )
+    session.stdin.flush()
+    output = []
+    def handle_lines( lines ):
+        echo_lines( lines,**kwargs )
+        output.extend( lines )
+    line = read_lines( session.stdout,handle_lines,sentinel )
+    echo_throttled( kwargs.get( "terminal",sys.stdout ) )
+    if line is None:
+        session_terminate()
+        raise Exception( f"Shell session died while running: {cmdline}" )
+    status = int( line.split()[1] )
+    return status,output
+
+##
+## Description: the environment of a login shell, without starting one:
+## what the login profile changed is read once from the session,
+## and applied to the current environment.
+##
+shell_private = [ "PWD", "OLDPWD", "SHLVL", "_", ]
+login_changes = None
+
+def login_environment( **kwargs ):
+    global login_changes
+    if login_changes is None:
+        session_initiate( **kwargs )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            status,_ = session_execute( f"env -0 > {tmpdir}/environment",
+                                        **{ **kwargs,"terminal":None,"logfiles":{} } )
+            with open( f"{tmpdir}/environment","rb" ) as environment:
+                entries = environment.read().decode( errors="replace" ).split( "\0" )
+        login = dict( e.split( "=",1 ) for e in entries if "=" in e )
+        login_changes = \
+            ( { k:v for k,v in login.items() if session_started.get( k )!=v and k not in shell_private },
+              [ k for k in session_started if k not in login and k not in shell_private ] )
+    changed,removed = login_changes
+    environment = { **os.environ,**changed }
+    for k in removed:
+        environment.pop( k,None )
+    return environment
+
+##
+## Asynchronous runner
+## every command gets its own non-login `bash -c` in a new process group,
+## in the environment of the login session, so the profile is not sourced again;
+## its output is streamed into the logfiles of its own keywords,
+## and only a tail of it is kept.
+## The keyword `steptimeout` limits each command to that many seconds,
+## and `environment` holds extra environment variables.
+##
+ProcessResult = collections.namedtuple\
+    ( "ProcessResult",[ "cmdline","returncode","duration","tail","maxrss", ],defaults=[ None, ] )
+tail_length = 40
+timeout_status = 124
+# called after a command is killed on a timeout, for instance to recover jobserver tokens
+timeout_hooks = []
+# called with the peak memory in bytes of every command that measured it
+step_observers = []
 
+def step_measured( maxrss ):
+    for observer in step_observers:
+        observer( maxrss )
+
+def step_timeout( **kwargs ):
+    if nonnull( timeout := str( kwargs.get( "steptimeout","" ) ) ):
+        return float( timeout )
+    return None
+
+def kill_group( child ):
+    try:
+        os.killpg( child.pid,signal.SIGKILL )
+    except ProcessLookupError: pass
+
+##
+## With the keyword `rusage` the shell is started by a small python parent
+## that reports the peak memory of its descendants, that is, of this command only.
+##
+rusage_parent = """\
+import os,resource,subprocess,sys
+status = subprocess.call( [ "/bin/bash","-c",sys.argv[1] ] )
+os.write( int(sys.argv[2]),str( resource.getrusage( resource.RUSAGE_CHILDREN ).ru_maxrss ).encode() )
+sys.exit( status if status>=0 else 128-status )
+"""
+
+async def process_run( cmdline,**kwargs ):
+    echo_string( f"Command line={cmdline}",**kwargs )
+    start = time.monotonic()
+    command = [ "/bin/bash","-c",cmdline ]; report = None
+    if kwargs.get( "rusage" ):
+        report,reportwrite = os.pipe()
+        command = [ sys.executable,"-c",rusage_parent,cmdline,str(reportwrite) ]
+    try:
+        child = await asyncio.create_subprocess_exec\
+            ( *command,
+              stdin=asyncio.subprocess.DEVNULL,
+              stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.STDOUT,
+              cwd=kwargs.get( "cwd",None ),
+              env={ **login_environment( **kwargs ),**kwargs.get( "environment",{} ) },
+              start_new_session=True,pass_fds=() if report is None else ( reportwrite, ) )
+    finally:
+        if report is not None:
+            os.close( reportwrite )
+    tail = collections.deque( maxlen=tail_length )
+    async def stream_output():
+        buffer = LineBuffer()
+        while chunk := await child.stdout.read( read_size ):
+            lines = buffer.clean( buffer.feed( chunk ) )
+            echo_lines( lines,**kwargs ); tail.extend( lines )
+        lines = buffer.clean( buffer.feed( b"",final=True ) )
+        echo_lines( lines,**kwargs ); tail.extend( lines )
+        return await child.wait()
+    timeout = step_timeout( **kwargs ); timedout = False
+    try:
+        returncode = await asyncio.wait_for( stream_output(),timeout )
+    except asyncio.TimeoutError:
+        echo_string( f"Command timed out after {timeout:.0f}s: {cmdline}",**kwargs )
+        returncode = timeout_status; timedout = True
+    finally:
+        if child.returncode is None:
+            kill_group( child )
+            await child.wait()
+    # only our own timeout: a command can exit with that status by itself
+    if timedout:
+        for hook in timeout_hooks:
+            hook()
+    echo_throttled( kwargs.get( "terminal",sys.stdout ) )
+    maxrss = None
+    if report is not None:
+        with os.fdopen( report,"rb" ) as reported:
+            # kilobytes on Linux; nothing if the command was killed
+            if ( kilobytes := reported.read() ).isdigit():
+                maxrss = int( kilobytes )*1024
+                step_measured( maxrss )
+    return ProcessResult( cmdline,returncode,time.monotonic()-start,list(tail),maxrss )
+
+async def process_gather( runs ):
+    return await asyncio.gather( *[ process_run( cmdline,**kw ) for cmdline,kw in runs ] )
+
+##
+## Description: run independent commands at the same time
+## `runs` is a list of pairs command line, keywords
+## Result: list of ProcessResult in the order of the runs
+##
+def process_concurrent( runs ):
+    return asyncio.run( process_gather( runs ) )
+
+def process_result( cmdline,**kwargs ):
+    result = asyncio.run( process_run( cmdline,**kwargs ) )
+    if result.returncode!=0:
+        message = f"Command exited with status {result.returncode} after {result.duration:.0f}s: {cmdline}"
+        if kwargs.get("check"):
+            echo_string( "\n".join( [ "Last output:" ]+result.tail ),**{ **kwargs,"logfiles":{} } )
+            error_abort( message,**kwargs )
+        trace_string( message,**kwargs )
+    return result
+
+##
+## Description: run a command
+## default: asynchronous runner in a fresh shell, with the environment of the login session;
+## `login` : the persistent login shell session itself, for module commands;
+## `process` : write to an explicitly started shell,
+##     where `check` makes a failure end the shell;
+## `isolated` : a fresh login shell that is closed afterwards.
+## With `check` a nonzero exit status aborts.
+## Result: last line of output
+##
 def process_execute( cmdline,**kwargs ):
     outside_process = kwargs.get("process",None)
     immediate       = kwargs.get("immediate",None)
+    isolated        = kwargs.get("isolated",None)
     logfile         = kwargs.get("logfile",None)
     if logfile is None:
         logfile = sys.stdout
+    if outside_process is None and not isolated and not kwargs.get("login"):
+        result = process_result( cmdline,**kwargs )
+        return result.tail[-1] if result.tail else ""
+    if outside_process is None and not isolated:
+        echo_string( f"Command line={cmdline}",**kwargs )
+        status,output = session_execute( cmdline,**kwargs )
+        if status!=0:
+            if kwargs.get("check"):
+                error_abort( f"Command exited with status {status}: {cmdline}",**kwargs )
+            trace_string( f"Command exited with status {status}: {cmdline}",**kwargs )
+        return output[-1] if output else ""
     if outside_process is None:
-        process = process_initiate()
+        process = process_initiate( **kwargs )
     else: process = outside_process
     echo_string( f"Command line={cmdline}",**kwargs )
     process_input = process.stdin
     process_output = process.stdout
-    process_input.write( cmdline+"\n" )
-    if immediate:
-        process_input.flush()
+    if outside_process and kwargs.get("check"):
+        # a failing command closes the shell, whose exit status process_terminate reports
+        cmdline = f"{{ {cmdline}\n}} || exit $?"
+    try:
+        process_input.write( cmdline+"\n" )
+        if immediate:
+            process_input.flush()
+    except BrokenPipeError:
+        # an earlier checked command ended the shell
+        return ""
     if outside_process:
         return ""
     else:
-        return process_terminate( process,**kwargs )
+        _,lastline = shell_finish( process,**kwargs )
+        return lastline
+
+##
+## Run a command in its own login shell, output going to a logfile.
+## This is used for driving complete mpm runs from a driver.
+## Result: pair status,duration in seconds
+##
+def process_child( cmdline,logname,**kwargs ):
+    env = dict( os.environ )
+    env.update( kwargs.get("environment",{}) )
+    echo_string( f"Child command line={cmdline} log={logname}",**kwargs )
+    start = time.time()
+    with open( logname,"w" ) as log:
+        child = subprocess.run\
+            ( ['/bin/bash','-l','-c',cmdline],
+              stdin=subprocess.DEVNULL,stdout=log,stderr=subprocess.STDOUT,
+              cwd=kwargs.get("cwd",None),env=env )
+    return child.returncode,time.time()-start
 
 def number_satisfies( l,w,**kwargs ):
     if False:
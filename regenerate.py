@@ -0,0 +1,87 @@
+#!/usr/bin/env/python3
+
+##
+## Bulk regeneration of modulefiles
+## the settings of each installation are taken from the installation index,
+## so there is no configuration to read and no Lmod to ask;
+## the modulefiles are rendered in a process pool,
+## and written only when their content changes.
+##
+
+#
+# standard python modules
+#
+import concurrent.futures
+import json
+import os
+import re
+
+#
+# my own modules
+#
+import install
+import installindex
+import names
+import spidercache
+from process import echo_string,nonnull
+
+##
+## Description: version of a `DEPENDSONCURRENT` package in the existing modulefile;
+## that package is not necessarily loaded now
+##
+def current_dependency( curreq,filename ):
+    try:
+        with open( filename,"r" ) as modulefile:
+            if version := re.search( rf'depends_on\( "{re.escape(curreq)}/([^"]*)" \)',modulefile.read() ):
+                return version.group(1)
+    except FileNotFoundError: pass
+    return None
+
+##
+## Description: render and write the modulefile of one installation; runs in a pool worker
+## Result: pair modulefile,written
+##
+def regenerate_one( stored ):
+    configuration = json.loads( stored )
+    configuration["context"] = names.build_context( **configuration )
+    modulefilepath,luaversion = names.modulefile_path_and_name( **configuration )
+    filename = f"{modulefilepath}/{luaversion}"
+    restore = None
+    if nonnull( curreq := configuration.get( "dependsoncurrent","" ) ):
+        variable = f"TACC_{curreq.upper()}_VERSION"
+        if variable not in os.environ and ( version := current_dependency( curreq,filename ) ):
+            os.environ[variable] = version
+            restore = variable
+    try:
+        return filename,install.write_if_changed( filename,install.module_file_contents( **configuration ) )
+    finally:
+        if restore is not None:
+            del os.environ[restore]
+
+def regenerate_modules( filters="",**kwargs ):
+    if ( entries := installindex.query_installations( filters,**kwargs ) ) is None:
+        echo_string( f"No installation index; use the `reindex` action to create one",**kwargs )
+        return
+    stored = [ e for e in entries if e["configuration"] ]
+    if len(stored)<len(entries):
+        echo_string( f"Skipping {len(entries)-len(stored)} installations without recorded settings",**kwargs )
+    written = 0; failed = 0; moduledirs = []
+    workers = max( 1,min( int( kwargs.get( "jcount","6" ) ),len(stored) ) )
+    with concurrent.futures.ProcessPoolExecutor( max_workers=workers ) as pool:
+        futures = { pool.submit( regenerate_one,e["configuration"] ):e for e in stored }
+        for future in concurrent.futures.as_completed( futures ):
+            prefix = futures[future]["prefix"]
+            try:
+                filename,changed = future.result()
+            except BaseException as e:
+                failed += 1
+                echo_string( f"Failed to regenerate modulefile for {prefix}: {e}",**kwargs )
+                continue
+            if changed:
+                written += 1
+                # the modulefile is {moduledir}/{modulename}/{version}.lua
+                moduledirs.append( os.path.dirname( os.path.dirname( filename ) ) )
+                echo_string( f"Regenerated modulefile: {filename}",**kwargs )
+    echo_string( f"Regenerated {written} of {len(stored)} modulefiles, "
+                 f"{len(stored)-written-failed} unchanged, {failed} failed",**kwargs )
+    spidercache.update_spider_cache( moduledirs,**kwargs )
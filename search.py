@@ -0,0 +1,263 @@
+#!/usr/bin/env/python3
+
+##
+## Searching the source tree
+## a grep over all files, in one process, with the reading done by a thread pool.
+## Optionally a trigram index, built at unpack time, narrows the files to search:
+## the identifiers of all files are listed with the files they occur in,
+## and the trigrams of these identifiers point to the identifiers.
+## Files that are new or changed since the index was built are always searched.
+##
+
+#
+# standard python modules
+#
+import array
+import concurrent.futures
+import hashlib
+import os
+import pickle
+import re
+import shlex
+import time
+
+#
+# my own modules
+#
+import names
+from process import echo_string,trace_string
+
+search_workers = 16
+# grep also looks for a null byte at the start of a file
+binary_probe = 8192
+identifier = re.compile( rb'[A-Za-z0-9_]{3,}' )
+index_version = 2
+
+def read_text( filename ):
+    # Result: contents as bytes, None for binary or unreadable files
+    try:
+        with open( filename,"rb" ) as f:
+            data = f.read()
+    except OSError:
+        return None
+    if b"\0" in data[:binary_probe]:
+        return None
+    return data
+
+def source_files( srcdir ):
+    # Result: list of paths relative to srcdir, and dict of their mtimes and sizes
+    files = []; stats = {}
+    for root,dirs,filenames in os.walk( srcdir ):
+        dirs[:] = sorted( d for d in dirs if d!=".git" )
+        relroot = os.path.relpath( root,srcdir )
+        for f in sorted( filenames ):
+            filename = os.path.normpath( f"{relroot}/{f}" )
+            files.append( filename )
+            try:
+                st = os.stat( f"{root}/{f}" )
+                stats[filename] = ( st.st_mtime_ns,st.st_size )
+            except OSError: pass
+    return files,stats
+
+##
+## Trigram index
+##
+def index_file( srcdir ):
+    tree = os.path.realpath( srcdir )
+    return f"{names.cache_root()}/search/{hashlib.sha256( tree.encode() ).hexdigest()[:16]}.pickle"
+
+def trigrams( word ):
+    return { word[i:i+3] for i in range( len(word)-2 ) }
+
+##
+## Description: build and store the index of a source tree;
+## the tree is not called `srcdir`, which is a setting
+##
+def build_search_index( tree,**kwargs ):
+    starttime = time.time()
+    files,stats = source_files( tree )
+    def words( filename ):
+        if ( data := read_text( f"{tree}/{filename}" ) ) is None:
+            return ()
+        return set( identifier.findall( data.lower() ) )
+    postings = {}
+    with concurrent.futures.ThreadPoolExecutor( max_workers=search_workers ) as pool:
+        for fileid,filewords in enumerate( pool.map( words,files ) ):
+            for w in filewords:
+                postings.setdefault( w,array.array( "I" ) ).append( fileid )
+    tokens = sorted( postings )
+    offsets = array.array( "Q",[0] ); fileids = array.array( "I" )
+    grams = {}
+    for tokenid,token in enumerate( tokens ):
+        fileids.extend( postings[token] ); offsets.append( len(fileids) )
+        for g in trigrams( token ):
+            grams.setdefault( g,array.array( "I" ) ).append( tokenid )
+    index = { "version":index_version, "srcdir":os.path.realpath( tree ),
+              "files":"\n".join( files ), "stats":stats,
+              "tokens":b"\n".join( tokens ), "offsets":offsets, "fileids":fileids, "trigrams":grams, }
+    filename = index_file( tree )
+    os.makedirs( os.path.dirname( filename ),exist_ok=True )
+    with open( f"{filename}.{os.getpid()}","wb" ) as f:
+        pickle.dump( index,f,protocol=pickle.HIGHEST_PROTOCOL )
+    os.replace( f"{filename}.{os.getpid()}",filename )
+    echo_string( f"Search index of {len(files)} files, {len(tokens)} identifiers, "
+                 f"in {time.time()-starttime:.1f} seconds: {filename}",**kwargs )
+
+def read_search_index( srcdir ):
+    try:
+        with open( index_file( srcdir ),"rb" ) as f:
+            index = pickle.load( f )
+    except ( OSError,pickle.UnpicklingError,EOFError ):
+        return None
+    if index.get( "version" )!=index_version or index.get( "srcdir" )!=os.path.realpath( srcdir ):
+        return None
+    return index
+
+##
+## Description: identifier fragments that every match of the pattern has to contain;
+## empty if the pattern is too complicated to tell
+##
+def required_fragments( pattern,fixed ):
+    if not fixed:
+        # an escaped punctuation character is a literal: any one character, as far as fragments go
+        pattern = re.sub( r'\\[^A-Za-z0-9_]',".",pattern )
+        if re.search( r'[|()\\]',pattern ):
+            return []
+        # a `]` right after the opening bracket belongs to the class
+        if re.search( r'\[\^?\]',pattern ):
+            return []
+        # drop character classes, and characters that can be repeated zero times
+        pattern = re.sub( r'\[[^]]*\]',".",pattern )
+        pattern = re.sub( r'.[*?]|.\{[^}]*\}',".",pattern )
+        pattern = re.sub( r'[.^$+]',".",pattern )
+    return [ f.lower().encode() for f in re.findall( r'[A-Za-z0-9_]{3,}',pattern ) ]
+
+def candidate_files( index,fragments ):
+    # Result: set of file ids, None if the index can not narrow the search
+    if not fragments:
+        return None
+    tokens = index["tokens"].split( b"\n" )
+    offsets,fileids = index["offsets"],index["fileids"]
+    candidates = None
+    for fragment in fragments:
+        tokenids = None
+        for g in trigrams( fragment ):
+            ids = set( index["trigrams"].get( g,() ) )
+            tokenids = ids if tokenids is None else tokenids & ids
+        files = set()
+        for t in tokenids:
+            if fragment in tokens[t]:
+                files.update( fileids[ offsets[t]:offsets[t+1] ] )
+        candidates = files if candidates is None else candidates & files
+    return candidates
+
+def changed_files( index,srcdir ):
+    # files that are new, or whose mtime or size changed since the index was built
+    files,stats = source_files( srcdir )
+    return [ f for f in files if index["stats"].get( f )!=stats.get( f ) ]
+
+##
+## Search
+## `arguments` are as for grep: options -i -w -F -E -l, then the pattern;
+## a pattern that starts with a dash comes after `--`.
+## The pattern is a basic regular expression as in grep, or extended with -E,
+## and is translated to a Python regular expression.
+##
+grep_options = "iwFlE"
+
+def parse_arguments( arguments ):
+    options = set(); words = []
+    for a in shlex.split( arguments ):
+        if words:
+            words.append( a )
+        elif a=="--" and "--" not in options:
+            options.add( "--" )
+        elif a.startswith( "-" ) and len(a)>1 and "--" not in options:
+            if not re.match( f'^-[{grep_options}]+$',a ):
+                raise Exception( f"Unknown search option {a}; use -i -w -F -E -l" )
+            options.update( a[1:] )
+        else: words.append( a )
+    options.discard( "--" )
+    if not words:
+        raise Exception( f"No search pattern in: {arguments}" )
+    return options," ".join( words )
+
+posix_classes = { "alpha":"a-zA-Z", "digit":"0-9", "alnum":"a-zA-Z0-9", "upper":"A-Z", "lower":"a-z",
+                  "space":" \\t\\n\\r\\f\\v", "blank":" \\t", "punct":"!-/:-@\\[-`{-~",
+                  "xdigit":"0-9A-Fa-f", }
+
+##
+## Description: translate a grep regular expression to a Python one:
+## in a basic expression ( ) | { } + ? are literal and their escaped forms are operators,
+## in an extended one the other way around; in both a backslash in brackets is literal,
+## and \< \> are word boundaries
+##
+def python_regex( pattern,extended=False ):
+    result = ""; i = 0
+    while i<len(pattern):
+        c = pattern[i]
+        if c=="[":
+            # a bracket expression, where a ] right at the start is a member
+            j = i+1; head = ""; members = ""
+            if pattern[j:j+1]=="^":
+                head = "^"; j += 1
+            if pattern[j:j+1]=="]":
+                members = "\\]"; j += 1
+            while j<len(pattern) and pattern[j]!="]":
+                if posix := re.match( r'\[:([a-z]+):\]',pattern[j:] ):
+                    if posix.group(1) not in posix_classes:
+                        raise Exception( f"Unknown character class {posix.group(0)} in: {pattern}" )
+                    members += posix_classes[ posix.group(1) ]; j += len( posix.group(0) ); continue
+                members += "\\"+pattern[j] if pattern[j] in "\\[" else pattern[j]
+                j += 1
+            if j>=len(pattern):
+                raise Exception( f"Unmatched [ in: {pattern}" )
+            result += f"[{head}{members}]"; i = j+1; continue
+        if c=="\\" and i+1<len(pattern):
+            n = pattern[i+1]
+            if n in "<>":
+                result += r"\b"
+            elif n in "(){}|+?":
+                result += n if not extended else "\\"+n
+            else: result += c+n
+            i += 2; continue
+        if ( c in "(){}|+?" or ( c=="*" and i==0 ) ) and not extended:
+            # a leading star is literal too
+            result += "\\"+c
+        else: result += c
+        i += 1
+    return result
+
+def find_string( arguments,**kwargs ):
+    srcdir = names.srcdir_name( **kwargs )
+    options,pattern = parse_arguments( arguments )
+    fixed = "F" in options
+    translated = pattern if fixed else python_regex( pattern,"E" in options )
+    expression = re.escape( translated ) if fixed else translated
+    if "w" in options:
+        expression = rf'(?<![A-Za-z0-9_])(?:{expression})(?![A-Za-z0-9_])'
+    regex = re.compile( expression.encode(),re.IGNORECASE if "i" in options else 0 )
+    starttime = time.time()
+    files = None
+    if ( index := read_search_index( srcdir ) ) is not None:
+        if ( candidates := candidate_files( index,required_fragments( translated,fixed ) ) ) is not None:
+            indexed = index["files"].split( "\n" )
+            files = sorted( set( indexed[i] for i in candidates ) | set( changed_files( index,srcdir ) ) )
+            trace_string( f"Search index narrows the search to {len(files)} of {len(indexed)} files",**kwargs )
+    if files is None:
+        files,_ = source_files( srcdir )
+    def search( filename ):
+        if ( data := read_text( f"{srcdir}/{filename}" ) ) is None or not regex.search( data ):
+            return []
+        if "l" in options:
+            return [ filename ]
+        return [ f"{filename}:{n}:{line.decode( errors='replace' )}"
+                 for n,line in enumerate( data.split( b"\n" ),start=1 ) if regex.search( line ) ]
+    matches = 0
+    with concurrent.futures.ThreadPoolExecutor( max_workers=search_workers ) as pool:
+        for lines in pool.map( search,files ):
+            for line in lines:
+                echo_string( line,**kwargs )
+            matches += len(lines)
+    echo_string( f"Found {matches} {'files' if 'l' in options else 'lines'} in {len(files)} files "
+                 f"in {time.time()-starttime:.2f} seconds",**kwargs )
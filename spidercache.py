@@ -0,0 +1,92 @@
+#!/usr/bin/env/python3
+
+##
+## Spider cache
+## Lmod's spider cache in the format of `update_lmod_system_cache_files`,
+## but with one cache directory per module directory that mpm writes in,
+## so that a new modulefile only costs a spider run over its own module directory.
+## All cache directories are listed in an `lmodrc.lua` with an `scDescriptT` table,
+## which Lmod reads through `LMOD_RC`.
+##
+
+#
+# standard python modules
+#
+import fcntl
+import hashlib
+import os
+import subprocess
+import time
+
+#
+# my own modules
+#
+import names
+from process import echo_string,trace_string,nonnull
+
+def cache_lock( filename ):
+    lock = open( filename,"a" )
+    fcntl.flock( lock,fcntl.LOCK_EX )
+    return lock
+
+##
+## Description: the module directory, that is, the directory on the MODULEPATH,
+## of the current modulefile
+##
+def module_directory( **kwargs ):
+    modulefilepath,_ = names.modulefile_path_and_name( **kwargs )
+    return os.path.dirname( modulefilepath )
+
+def cache_entry( root,moduledir ):
+    return f"{root}/{hashlib.sha256( moduledir.encode() ).hexdigest()[:16]}"
+
+def has_cache( moduledir,**kwargs ):
+    if not nonnull( root := kwargs.get( "spidercache","" ) ):
+        return True
+    return os.path.exists( f"{cache_entry( root,moduledir )}/spiderT.lua" )
+
+def write_atomic( filename,contents ):
+    with open( f"{filename}.{os.getpid()}","w" ) as f:
+        f.write( contents )
+    os.replace( f"{filename}.{os.getpid()}",filename )
+
+##
+## Description: the `scDescriptT` of all cache directories
+##
+def write_lmodrc( root ):
+    entries = []
+    for d in sorted( os.listdir( root ) ):
+        if os.path.exists( f"{root}/{d}/spiderT.lua" ):
+            entries.append( f"  {{ dir = \"{root}/{d}\", timestamp = \"{root}/{d}/timestamp\" }},\n" )
+    write_atomic( f"{root}/lmodrc.lua",f"scDescriptT = {{\n{''.join(entries)}}}\n" )
+
+##
+## Description: rebuild the spider cache of these module directories
+##
+def update_spider_cache( moduledirs,**kwargs ):
+    if not nonnull( root := kwargs.get( "spidercache","" ) ) or not moduledirs:
+        return
+    if not nonnull( lmoddir := os.getenv( "LMOD_DIR","" ) ) \
+       or not os.path.exists( spider := f"{lmoddir}/spider" ):
+        echo_string( f"WARNING no Lmod spider program: not updating the spider cache",**kwargs )
+        return
+    os.makedirs( root,exist_ok=True )
+    for moduledir in sorted( set( moduledirs ) ):
+        entry = cache_entry( root,moduledir )
+        os.makedirs( entry,exist_ok=True )
+        # concurrent installs in the same module directory take turns;
+        # the last one sees all modulefiles
+        with cache_lock( f"{entry}/.lock" ):
+            starttime = time.time()
+            spiderrun = subprocess.run( [ spider,"-o","spiderT",moduledir ],
+                                        capture_output=True,text=True )
+            if spiderrun.returncode!=0 or not nonnull( spiderrun.stdout ):
+                echo_string( f"WARNING spider failed for {moduledir}: {spiderrun.stderr.strip()}",**kwargs )
+                continue
+            write_atomic( f"{entry}/spiderT.lua",spiderrun.stdout )
+            write_atomic( f"{entry}/moduledir",f"{moduledir}\n" )
+            write_atomic( f"{entry}/timestamp",f"{time.time()}\n" )
+        trace_string( f"Spider cache for {moduledir} in {time.time()-starttime:.1f} seconds",**kwargs )
+    with cache_lock( f"{root}/.lock" ):
+        write_lmodrc( root )
+    echo_string( f"Updated spider cache {root} for: {' '.join( sorted( set( moduledirs ) ) )}",**kwargs )
@@ -0,0 +1,178 @@
+#!/usr/bin/env/python3
+
+#
+# standard python modules
+#
+import concurrent.futures
+import os
+import shlex
+import sys
+
+#
+# my own modules
+#
+import config
+import modules
+import process
+from process import echo_string,nonnull,error_abort
+
+##
+## Description: read the Configuration of every package directory under the stack root
+## Result: dict of package name -> dict with dir, dependencies, modulename
+##
+def stack_packages( stackdir,configname,**kwargs ):
+    packages = {}
+    cwd = os.getcwd()
+    for d in sorted( os.listdir(stackdir) ):
+        pkgdir = f"{stackdir}/{d}"
+        if not os.path.isfile( f"{pkgdir}/{configname}" ): continue
+        try:
+            os.chdir( pkgdir )
+            configuration = config.read_config( configname )
+        except Exception as e:
+            echo_string( f"WARNING skipping {pkgdir}: {e}",**kwargs )
+            continue
+        except SystemExit:
+            # the config reader reports through error_abort, which has printed the reason
+            echo_string( f"WARNING skipping {pkgdir}: invalid {configname}",**kwargs )
+            continue
+        finally:
+            os.chdir( cwd )
+        package = configuration.get( "modulename",configuration.get("package",d) ).lower()
+        if package in packages:
+            echo_string( f"WARNING package {package} found in {packages[package]['dir']} and {pkgdir}",
+                         **kwargs )
+            continue
+        packages[package] = { "dir":pkgdir, "dependencies":package_dependencies( configuration ), }
+    return packages
+
+def package_dependencies( configuration ):
+    dependencies = set()
+    for key in [ "modules","dependson", ]:
+        for m in configuration.get( key,"" ).split():
+            dep = m.split("/")[0].lower()
+            if nonnull( dep ) and dep not in modules.non_packages:
+                dependencies.add( dep )
+    return dependencies
+
+##
+## Description: dependency graph restricted to packages in the stack
+## Result: dependencies and dependents per package; aborts on a cycle
+##
+def stack_graph( packages,**kwargs ):
+    depends = { p:sorted( d for d in info["dependencies"] if d in packages and d!=p )
+                for p,info in packages.items() }
+    dependents = { p:[] for p in packages }
+    for p,deps in depends.items():
+        for d in deps:
+            dependents[d].append( p )
+    # Kahn's algorithm to detect cycles
+    indegree = { p:len(deps) for p,deps in depends.items() }
+    ready = [ p for p,n in indegree.items() if n==0 ]; ordered = []
+    while ready:
+        p = ready.pop(); ordered.append( p )
+        for q in dependents[p]:
+            indegree[q] -= 1
+            if indegree[q]==0: ready.append( q )
+    if len(ordered)<len(packages):
+        error_abort( f"Dependency cycle among: {sorted( p for p,n in indegree.items() if n>0 )}",
+                     **kwargs )
+    return depends,dependents,ordered
+
+##
+## Description: longest path through the graph, with a weight per package
+## Result: pair length,list of packages
+##
+def critical_path( depends,ordered,weight ):
+    length = {}; previous = {}
+    for p in ordered:
+        longest,before = 0,None
+        for d in depends[p]:
+            if length[d]>longest:
+                longest,before = length[d],d
+        length[p] = longest+weight(p); previous[p] = before
+    if not length:
+        return 0,[]
+    p = max( length,key=length.get ); total = length[p]; path = []
+    while p is not None:
+        path.append( p ); p = previous[p]
+    return total,path[::-1]
+
+def build_package( name,info,loads,slots,**kwargs ):
+    configfile = kwargs.get( "configfile","Configuration" )
+    mpmscript  = kwargs.get( "mpmscript" )
+    actions    = kwargs.get( "stackactions","install" )
+    mpm = f"{shlex.quote(sys.executable)} {shlex.quote(mpmscript)} -c {shlex.quote(configfile)} -j {slots}"
+    cmdline = f"{mpm} {actions}"
+    if len(loads)>0:
+        cmdline = f"module load {' '.join(loads)} && {cmdline}"
+    return process.process_child\
+        ( cmdline,f"{info['dir']}/stack.log",cwd=info["dir"],terminal=None )
+
+##
+## Description: build all packages under a root directory in dependency order
+## independent packages build concurrently within a budget of `jcount` cores;
+## each package gets `stackjcount` of them.
+## Dependents of a failed package are skipped, other branches continue.
+##
+def stack_build( **kwargs ):
+    stackroot  = os.path.abspath( kwargs.get( "stackroot",os.getcwd() ) )
+    configfile = kwargs.get( "configfile","Configuration" )
+    budget     = max( 1,int( kwargs.get("jcount",6) ) )
+    if nonnull( per := kwargs.get("stackjcount","") ):
+        jcount = max( 1,min( budget,int(per) ) )
+    else: jcount = max( 1,budget//4 )
+    packages = stack_packages( stackroot,configfile,**kwargs )
+    depends,dependents,ordered = stack_graph( packages,**kwargs )
+    echo_string( f"Stack of {len(packages)} packages in {stackroot}, budget {budget} cores, -j {jcount} per package",
+                 **kwargs )
+    # packages with the longest chain of dependents go first
+    height = {}
+    for p in reversed( ordered ):
+        height[p] = 1+max( [ height[q] for q in dependents[p] ],default=0 )
+    waiting = { p:set( depends[p] ) for p in packages }
+    status = {}; duration = {}; running = {}
+    free = budget
+    with concurrent.futures.ThreadPoolExecutor( max_workers=budget ) as pool:
+        while waiting or running:
+            ready = sorted( [ p for p,deps in waiting.items() if not deps ],
+                            key=lambda p:(-height[p],p) )
+            for p in ready:
+                if free<jcount and running: break
+                del waiting[p]
+                free -= jcount
+                echo_string( f"Start building {p}",**kwargs )
+                running[ pool.submit( build_package,p,packages[p],depends[p],jcount,**kwargs ) ] = p
+            if not running:
+                break
+            done,_ = concurrent.futures.wait\
+                ( running,return_when=concurrent.futures.FIRST_COMPLETED )
+            for future in done:
+                p = running.pop( future ); free += jcount
+                status[p],duration[p] = future.result()
+                echo_string( f" .. finished {p} status={status[p]} in {duration[p]:.0f}s",**kwargs )
+                if status[p]==0:
+                    for q in dependents[p]:
+                        if q in waiting: waiting[q].discard( p )
+                else:
+                    skip = list( dependents[p] )
+                    while skip:
+                        q = skip.pop()
+                        if q in waiting:
+                            del waiting[q]; status[q] = "skipped"; duration[q] = 0
+                            echo_string( f" .. skipping {q} because {p} failed",**kwargs )
+                            skip.extend( dependents[q] )
+    total,path = critical_path( depends,ordered,lambda p:duration.get(p,0) )
+    echo_string( stack_summary( ordered,status,duration ),**kwargs )
+    echo_string( f"Critical path ({total:.0f}s): {' -> '.join(path)}",**kwargs )
+    return status
+
+def stack_summary( ordered,status,duration ):
+    width = max( [ len("package") ] + [ len(p) for p in ordered ] )
+    summary = f"{'package':<{width}}  {'status':<8}  {'time':>8}\n"
+    for p in ordered:
+        s = status.get( p,"not run" )
+        if s==0: s = "ok"
+        elif isinstance( s,int ): s = f"fail {s}"
+        summary += f"{p:<{width}}  {s:<8}  {duration.get(p,0):>7.0f}s\n"
+    return summary.rstrip()
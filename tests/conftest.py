@@ -0,0 +1,7 @@
+##
+## the modules import each other by their plain names
+##
+import os
+import sys
+
+sys.path.insert( 0,os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
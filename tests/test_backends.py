@@ -0,0 +1,23 @@
+import backends
+
+def automake_tree( tmp_path ):
+    ( tmp_path/"Makefile.in" ).write_text( "VPATH = @srcdir@\nall:\n" )
+    return str(tmp_path)
+
+def test_out_of_tree_by_default( tmp_path ):
+    srcdir = automake_tree( tmp_path )
+    assert backends.configinbuilddir_setting()=="auto"
+    assert backends.autotools_out_of_tree( srcdir )
+    assert not backends.autotools_out_of_tree( srcdir,configinbuilddir="no" )
+    assert not backends.autotools_out_of_tree( srcdir,makesubdir="src" )
+
+def test_in_tree_when_configured( tmp_path ):
+    srcdir = automake_tree( tmp_path )
+    # for instance by autogen.sh
+    ( tmp_path/"config.status" ).write_text( "" )
+    assert not backends.autotools_out_of_tree( srcdir )
+    assert backends.autotools_out_of_tree( srcdir,configinbuilddir="yes" )
+
+def test_in_tree_without_vpath( tmp_path ):
+    ( tmp_path/"Makefile.in" ).write_text( "all:\n" )
+    assert not backends.autotools_out_of_tree( str(tmp_path) )
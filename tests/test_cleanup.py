@@ -0,0 +1,25 @@
+import os
+import threading
+
+import cleanup
+
+def make_tree( top ):
+    for d in [ "a/b","a/c","d" ]:
+        os.makedirs( f"{top}/{d}" )
+        with open( f"{top}/{d}/file","w" ) as f:
+            f.write( d )
+
+def test_discard_tree( tmp_path ):
+    make_tree( tmp_path/"build" )
+    cleanup.discard_tree( str(tmp_path/"build"),terminal=None )
+    cleanup.wait_for_removals()
+    assert os.listdir( tmp_path )==[]
+
+def test_removal_without_threads( tmp_path,monkeypatch ):
+    # as during interpreter shutdown
+    def refuse( thread ):
+        raise RuntimeError( "can't create new thread at interpreter shutdown" )
+    monkeypatch.setattr( threading.Thread,"start",refuse )
+    make_tree( tmp_path/"build" )
+    cleanup.discard_tree( str(tmp_path/"build"),terminal=None )
+    assert os.listdir( tmp_path )==[]
@@ -0,0 +1,25 @@
+import os
+
+import compilercache
+
+def ccache( log ):
+    return { "program":"ccache", "kind":"ccache", "dir":"",
+             "environment":{ "CCACHE_STATSLOG":str(log), }, }
+
+def test_ccache_counts_this_build( tmp_path ):
+    log = tmp_path/"stats.log"
+    log.write_text( "# /build/foo.c\ndirect_cache_hit\n# /build/bar.c\ncache_miss\n"
+                    "# /build/baz.c\npreprocessed_cache_hit\n" )
+    assert compilercache.cache_statistics( ccache( log ) )==( 2,1 )
+
+def test_ccache_without_compilations( tmp_path ):
+    assert compilercache.cache_statistics( ccache( tmp_path/"stats.log" ) )==( 0,0 )
+
+def test_sccache_ports_are_not_shared( tmp_path,monkeypatch ):
+    monkeypatch.setenv( "MRPACKMODCACHE",str(tmp_path) )
+    port,claim = compilercache.claim_port( "/build/foo" )
+    # a concurrent build whose builddir gives the same port
+    other,otherclaim = compilercache.claim_port( "/build/foo" )
+    assert other!=port
+    os.close( claim ); os.close( otherclaim )
+    assert compilercache.claim_port( "/build/foo" )[0]==port
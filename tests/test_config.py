@@ -0,0 +1,38 @@
+import pytest
+
+import config
+
+def test_macro_refers_to_later_macro():
+    macros = { "A":"${B}/a", "B":"/opt", }
+    assert config.resolve_macro( "A",macros,{},() )=="/opt/a"
+
+def test_unknown_macro_left_alone():
+    assert config.expand_macros( "${HOME}/x ${A}",{ "A":"a", },{} )=="${HOME}/x a"
+    assert config.resolve_macro( "NOSUCHMACRO",{},{},() ) is None
+
+def test_circular_macro():
+    macros = { "A":"${B}", "B":"x${A}", }
+    with pytest.raises( Exception,match="Circular macro definition: A -> B -> A" ):
+        config.resolve_macro( "A",macros,{},() )
+
+def test_resolved_is_memoized():
+    resolved = {}
+    config.expand_macros( "${A}",{ "A":"${B}", "B":"b", },resolved )
+    assert resolved=={ "A":"b", "B":"b", }
+
+def test_literals_are_not_expanded():
+    configuration = { "cmakeflags":"-D X=${TACC_X_DIR} ${V}", "modules":"${V}", }
+    config.expand_configuration( configuration,{ "V":"1.0", },
+                                 { "TACC_X_DIR":"/opt/${V}", },{ "cmakeflags", } )
+    assert configuration=={ "cmakeflags":"-D X=/opt/${V} 1.0", "modules":"${V}", }
+
+def test_settings_from_environment( tmp_path,monkeypatch ):
+    configfile = tmp_path/"Configuration"
+    configfile.write_text( "let V = 1.0\nlet W = ${V}\nURL = x-${W}\nPREFIX = ${W}\n" )
+    monkeypatch.setenv( "W","${V}-env" )
+    monkeypatch.setenv( "PREFIX","${W}" )
+    configuration = {}; macros = {}; literals = {}; expandable = set()
+    config.add_settings_from_config( str(configfile),configuration,macros,literals,expandable )
+    config.expand_configuration( configuration,macros,literals,expandable )
+    assert configuration["url"]=="x-${V}-env"
+    assert configuration["prefix"]=="${W}"
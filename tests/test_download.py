@@ -0,0 +1,177 @@
+import hashlib
+import http.server
+import io
+import json
+import os
+import tarfile
+import threading
+
+import download
+
+def write_part( partfile,contents,progress ):
+    with open( partfile,"wb" ) as part:
+        part.write( contents )
+    with open( f"{partfile}.ranges","w" ) as p:
+        json.dump( progress,p )
+
+def test_resume_keeps_done_ranges( tmp_path ):
+    partfile = str( tmp_path/"x.part" )
+    write_part( partfile,b"a"*100,{ "size":100, "ranges":4, "done":[0,2], } )
+    assert download.resumed_ranges( partfile,100,4 )==[0,2]
+    with open( partfile,"rb" ) as part:
+        assert part.read()==b"a"*100
+
+def test_resume_mismatch_resets_part( tmp_path ):
+    partfile = str( tmp_path/"x.part" )
+    write_part( partfile,b"a"*100,{ "size":100, "ranges":4, "done":[0,2], } )
+    assert download.resumed_ranges( partfile,100,5 )==[]
+    with open( partfile,"rb" ) as part:
+        assert part.read()==b"\0"*100
+
+def test_resume_wrong_part_size( tmp_path ):
+    partfile = str( tmp_path/"x.part" )
+    write_part( partfile,b"a"*60,{ "size":100, "ranges":4, "done":[0,1,2], } )
+    assert download.resumed_ranges( partfile,100,4 )==[]
+    assert ( tmp_path/"x.part" ).stat().st_size==100
+
+def test_resume_without_progress( tmp_path ):
+    partfile = str( tmp_path/"x.part" )
+    assert download.resumed_ranges( partfile,10,2 )==[]
+    assert ( tmp_path/"x.part" ).stat().st_size==10
+
+##
+## a server that answers every range request with 416
+##
+contents = b"0123456789"*10
+
+class Unsatisfiable( http.server.BaseHTTPRequestHandler ):
+    def do_GET( self ):
+        if "Range" in self.headers:
+            self.send_response( 416 )
+            self.send_header( "Content-Range",f"bytes */{len(contents)}" )
+            self.send_header( "Content-Length","0" )
+            self.end_headers()
+            return
+        self.send_response( 200 )
+        self.send_header( "Content-Length",str( len(contents) ) )
+        self.end_headers()
+        self.wfile.write( contents )
+    def log_message( self,*args ):
+        pass
+
+def serve():
+    server = http.server.HTTPServer( ( "127.0.0.1",0 ),Unsatisfiable )
+    threading.Thread( target=server.serve_forever,daemon=True ).start()
+    return server,f"http://127.0.0.1:{server.server_port}/x.tgz"
+
+def test_416_complete_part( tmp_path ):
+    server,url = serve()
+    partfile = tmp_path/"x.tgz.part"
+    partfile.write_bytes( contents )
+    try:
+        h = download.stream_download( url,str(partfile),hashlib.sha256(),terminal=None )
+    finally:
+        server.shutdown()
+    assert h.hexdigest()==hashlib.sha256( contents ).hexdigest()
+
+def test_416_oversized_part( tmp_path ):
+    server,url = serve()
+    partfile = tmp_path/"x.tgz.part"
+    partfile.write_bytes( contents+b"garbage" )
+    try:
+        h = download.stream_download( url,str(partfile),hashlib.sha256(),terminal=None )
+    finally:
+        server.shutdown()
+    assert partfile.read_bytes()==contents
+    assert h.hexdigest()==hashlib.sha256( contents ).hexdigest()
+
+##
+## archive member names
+##
+def test_member_under_top():
+    top,name = download.member_target( "pkg-1.0/src/a.c",None,"pkg" )
+    assert ( top,name )==( "pkg-1.0","pkg/src/a.c" )
+    assert download.member_target( "./pkg-1.0/",top,"pkg" )==( "pkg-1.0","pkg" )
+    assert download.member_target( "README",top,"pkg" )==( "pkg-1.0","pkg/README" )
+
+def test_member_without_top():
+    top,name = download.member_target( "a.c",None,"pkg" )
+    assert ( top,name )==( "","pkg/a.c" )
+    assert download.member_target( "src/b.c",top,"pkg" )==( "","pkg/src/b.c" )
+
+def test_member_top_directory_entry():
+    assert download.member_target( "pkg-1.0/",None,"pkg",isdir=True )==( "pkg-1.0","pkg" )
+
+def test_member_outside_rejected():
+    for name in [ "/etc/passwd", "pkg/../../x", "../x", ]:
+        try:
+            download.member_target( name,"pkg","pkg" )
+        except Exception as e:
+            assert "outside" in str(e)
+        else: assert False,name
+
+def test_default_target():
+    assert download.default_target( "./pkg-1.0/a.c",False,"pkg-1.0.tar.gz" )=="pkg-1.0"
+    assert download.default_target( "a.c",False,"/tmp/flat-2.1.tar.gz" )=="flat-2.1"
+
+def test_extract_flat_readonly( tmp_path,monkeypatch ):
+    archive = tmp_path/"flat-1.0.tar"
+    with tarfile.open( archive,"w" ) as tar:
+        for name,data in [ ( "a.c",b"int a;" ), ]:
+            info = tarfile.TarInfo( name ); info.size = len(data)
+            tar.addfile( info,io.BytesIO( data ) )
+        info = tarfile.TarInfo( "ro" ); info.type = tarfile.DIRTYPE; info.mode = 0o555
+        tar.addfile( info )
+        info = tarfile.TarInfo( "ro/b.c" ); info.size = 1
+        tar.addfile( info,io.BytesIO( b"b" ) )
+    monkeypatch.chdir( tmp_path )
+    top,target = download.extract_tar( str(archive),"tar","src" )
+    assert ( top,target )==( "","src" )
+    assert ( tmp_path/"src"/"a.c" ).read_bytes()==b"int a;"
+    assert ( tmp_path/"src"/"ro"/"b.c" ).read_bytes()==b"b"
+    assert ( tmp_path/"src"/"ro" ).stat().st_mode & 0o777==0o555
+    ( tmp_path/"src"/"ro" ).chmod( 0o755 )
+
+##
+## source cache
+##
+def test_source_cache_keeps_download_mode( tmp_path,monkeypatch ):
+    monkeypatch.chdir( tmp_path )
+    data = b"tarball"
+    checksum = hashlib.sha256( data ).hexdigest()
+    settings = { "sourcecache":str( tmp_path/"cache" ), "downloadsha256":checksum, "terminal":None, }
+    tarball = tmp_path/"x.tgz"
+    tarball.write_bytes( data ); tarball.chmod( 0o600 )
+    download.store_in_source_cache( "http://host/x.tgz",str(tarball),**settings )
+    assert tarball.stat().st_mode & 0o777==0o600
+    entry = download.source_cache_entry( "http://host/x.tgz",**settings )
+    assert ( tmp_path/entry ).stat().st_mode & 0o777==0o664
+    tarball.unlink()
+    assert download.fetch_from_source_cache( "http://host/x.tgz",str(tarball),**settings )
+    assert tarball.read_bytes()==data
+
+def test_source_cache_rejects_corrupt_entry( tmp_path ):
+    settings = { "sourcecache":str( tmp_path/"cache" ),
+                 "downloadsha256":hashlib.sha256( b"good" ).hexdigest(), "terminal":None, }
+    entry = download.source_cache_entry( "http://host/x.tgz",**settings )
+    os.makedirs( os.path.dirname( entry ) )
+    with open( entry,"wb" ) as e:
+        e.write( b"bad" )
+    assert not download.fetch_from_source_cache( "http://host/x.tgz",str( tmp_path/"x.tgz" ),**settings )
+    assert not os.path.exists( entry )
+
+def test_eviction_waits_for_readers( tmp_path ):
+    root = str( tmp_path/"cache" )
+    settings = { "sourcecache":root, "terminal":None, }
+    entry = download.source_cache_entry( "http://host/x.tgz",**settings )
+    os.makedirs( os.path.dirname( entry ) )
+    with open( entry,"wb" ) as e:
+        e.write( b"x"*1000 )
+    evicting = threading.Thread( target=download.evict_source_cache,args=( root,0 ),kwargs=settings )
+    with download.source_cache_lock( root,exclusive=False ):
+        evicting.start()
+        evicting.join( timeout=0.5 )
+        # a build that verified the entry can still copy it
+        assert os.path.exists( entry )
+    evicting.join()
+    assert not os.path.exists( entry )
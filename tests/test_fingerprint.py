@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import fingerprint
+import modules
+
+@pytest.fixture
+def tree( tmp_path,monkeypatch ):
+    monkeypatch.setattr( modules,"loaded_modules",lambda **kwargs:[] )
+    srcdir = tmp_path/"src"; builddir = tmp_path/"build"
+    srcdir.mkdir(); builddir.mkdir()
+    ( srcdir/"CMakeLists.txt" ).write_text( "project(foo)\n" )
+    ( srcdir/"foo.c" ).write_text( "int foo;\n" )
+    settings = { "package":"foo", "packageversion":"1.0", "mode":"core",
+                 "system":"ls6", "compiler":"gcc", "compilerversion":"13",
+                 "installroot":str( tmp_path/"install" ), "homedir":str(tmp_path),
+                 "terminal":None, }
+    return str(srcdir),str(builddir),settings
+
+def configure( builddir,generated="Makefile" ):
+    for f in [ "CMakeCache.txt", generated, ]:
+        with open( f"{builddir}/{f}","w" ) as generatedfile:
+            generatedfile.write( "\n" )
+
+def test_no_configure( tree ):
+    srcdir,builddir,settings = tree
+    assert not fingerprint.configure_is_current( srcdir,builddir,**settings )
+
+def test_configure_is_current( tree ):
+    srcdir,builddir,settings = tree
+    configure( builddir )
+    fingerprint.write_configure_stamp( srcdir,builddir,**settings )
+    assert fingerprint.configure_is_current( srcdir,builddir,**settings )
+    # sources that are not configure inputs do not matter
+    with open( f"{srcdir}/foo.c","a" ) as source:
+        source.write( "int bar;\n" )
+    assert fingerprint.configure_is_current( srcdir,builddir,**settings )
+
+def test_changed_configure_input( tree ):
+    srcdir,builddir,settings = tree
+    configure( builddir,"build.ninja" )
+    fingerprint.write_configure_stamp( srcdir,builddir,**settings )
+    with open( f"{srcdir}/CMakeLists.txt","a" ) as cmakelists:
+        cmakelists.write( "add_library(foo foo.c)\n" )
+    assert not fingerprint.configure_is_current( srcdir,builddir,**settings )
+
+def test_changed_settings( tree ):
+    srcdir,builddir,settings = tree
+    configure( builddir )
+    fingerprint.write_configure_stamp( srcdir,builddir,**settings )
+    assert not fingerprint.configure_is_current( srcdir,builddir,**settings,cmakeflags="-D X=1" )
+    # volatile settings do not count
+    assert fingerprint.configure_is_current( srcdir,builddir,**settings,jcount="64" )
+
+def test_interrupted_configure( tree ):
+    srcdir,builddir,settings = tree
+    configure( builddir )
+    fingerprint.write_configure_stamp( srcdir,builddir,**settings )
+    os.remove( f"{builddir}/Makefile" )
+    assert not fingerprint.configure_is_current( srcdir,builddir,**settings )
+    assert not fingerprint.configure_done( srcdir,builddir )
+
+def test_stored_configuration_without_volatile_settings():
+    stored = fingerprint.stored_configuration( package="foo", packageversion="1.0", jcount="12",
+                                               scriptdir="/tmp/run", terminal=None )
+    assert stored=={ "package":"foo", "packageversion":"1.0", }
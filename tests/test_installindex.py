@@ -0,0 +1,18 @@
+import json
+import os
+
+import fingerprint
+import installindex
+
+def test_reindex_and_query( tmp_path ):
+    prefix = tmp_path/"installation-foo-1.0-ls6-gcc13"
+    prefix.mkdir()
+    ( prefix/fingerprint.stamp_name ).write_text( json.dumps(
+        { "package":"foo", "version":"1.0", "envcode":"ls6-gcc13", "fingerprint":"abc",
+          "date":"2026-01-01T00:00:00", "size":4096, } ) )
+    settings = { "installroot":str(tmp_path), "terminal":None, }
+    installindex.reindex( **settings )
+    assert os.path.exists( f"{tmp_path}/{installindex.index_name}.lock" )
+    entries = installindex.query_installations( "envcode=*gcc*",**settings )
+    assert [ ( e["package"],e["version"],e["size"] ) for e in entries ]==[ ( "foo","1.0",4096 ) ]
+    assert installindex.query_installations( "bar",**settings )==[]
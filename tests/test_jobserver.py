@@ -0,0 +1,39 @@
+import pytest
+
+import jobserver
+import process
+
+@pytest.fixture
+def versions( monkeypatch ):
+    found = {}
+    monkeypatch.setattr( jobserver,"tool_version",lambda tool="make":found.get( tool,(0,0) ) )
+    monkeypatch.setattr( jobserver,"jobserver_join",lambda **kwargs:"/tmp/fifo" )
+    return found
+
+def test_no_jobserver( versions ):
+    versions["make"] = (4,4)
+    assert jobserver.jobserver_prefix( "make",jobserver="no" )==( "",False )
+
+def test_make_versions( versions ):
+    for version,option in [ ( (4,4),"--jobserver-auth=fifo:/tmp/fifo" ),
+                            ( (4,3),"--jobserver-auth=3,3" ), ( (4,1),"--jobserver-fds=3,3 -j" ), ]:
+        versions["make"] = version
+        prefix,shared = jobserver.jobserver_prefix( "make",jobserver="yes" )
+        assert shared and f"MAKEFLAGS='{option}'" in prefix
+        # the job that make runs by itself takes a token too
+        assert prefix.startswith( "exec 3<>/tmp/fifo && read -r -n 1 -u 3" )
+
+def test_ninja_versions( versions ):
+    versions["ninja"] = (1,12)
+    assert jobserver.jobserver_prefix( "ninja",jobserver="yes" )==( "",False )
+    versions["ninja"] = (1,13)
+    prefix,shared = jobserver.jobserver_prefix( "ninja",jobserver="yes" )
+    assert shared and "MAKEFLAGS='--jobserver-auth=fifo:/tmp/fifo'" in prefix
+
+def test_timeout_hooks_only_on_timeout( monkeypatch ):
+    called = []
+    monkeypatch.setattr( process,"timeout_hooks",[ lambda:called.append( True ) ] )
+    assert process.process_result( "exit 124",terminal=None ).returncode==124
+    assert called==[]
+    process.process_result( "sleep 5",terminal=None,steptimeout="0.5" )
+    assert called==[ True ]
@@ -0,0 +1,6 @@
+import matrix
+
+def test_family_loads_keep_versions():
+    family = matrix.matrix_families( "gcc/13.2/openmpi/5.0.3:mpi" )[0]
+    loads = matrix.family_loads( family,modules="petsc/3.20 hdf5 mkl slepc/>=3.19",matrixpreamble="" )
+    assert loads==[ "module load gcc/13.2","module load openmpi/5.0.3","module load petsc/3.20 hdf5 slepc" ]
@@ -0,0 +1,32 @@
+import sys
+
+import pytest
+
+import metrics
+import process
+
+allocate = f"{sys.executable} -c 'x = bytearray( 200<<20 )'"
+
+@pytest.fixture
+def settings( tmp_path ):
+    return { "package":"Foo", "packageversion":"1.0", "scriptdir":str(tmp_path), "terminal":None, }
+
+def test_phase_peak_of_its_own_commands( settings ):
+    build = metrics.phase_start( "build" )
+    process.process_result( allocate,rusage=True,**settings )
+    assert metrics.phase_end( build,**settings )["peakrss"]>=200<<20
+    # a later phase does not inherit the peak of the build
+    install = metrics.phase_start( "install" )
+    process.process_result( "true",rusage=True,**settings )
+    assert metrics.phase_end( install,**settings )["peakrss"]<100<<20
+
+def test_phase_peak_of_a_shell( settings ):
+    configure = metrics.phase_start( "configure" )
+    shell = process.process_initiate()
+    process.process_execute( allocate,process=shell,**settings )
+    assert process.process_terminate( shell,**settings )==0
+    assert metrics.phase_end( configure,**settings )["peakrss"]>=200<<20
+
+def test_phase_without_commands( settings ):
+    unpack = metrics.phase_start( "unpack" )
+    assert metrics.phase_end( unpack,**settings )["peakrss"]==0
@@ -0,0 +1,21 @@
+import names
+
+settings = { "package":"Foo", "packageversion":"1.0", "homedir":"/tmp/foo",
+             "srcpath":"", "terminal":None, }
+
+def test_context_answers_for_its_settings():
+    context = names.build_context( **settings )
+    assert names.srcdir_name( **settings,context=context )=="/tmp/foo/foo-1.0"
+    assert context.srcdir=="/tmp/foo/foo-1.0"
+
+def test_context_stands_for_its_settings():
+    context = names.build_context( **settings )
+    assert context.packagenames==( "foo","1.0" )
+    # the context answers, whatever the other keywords say
+    assert names.package_names( **{ **settings,"packageversion":"2.0" },context=context )==( "foo","1.0" )
+
+def test_other_settings_without_context():
+    other = { **settings,"packageversion":"2.0" }
+    assert names.package_names( **other )==( "foo","2.0" )
+    assert names.srcdir_name( **{ **settings,"srcpath":"/src" } )=="/src"
+    assert names.build_context( **other ).packagenames==( "foo","2.0" )
@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+import parallel
+
+@pytest.fixture
+def node( tmp_path,monkeypatch ):
+    # 16 idle cores with 8G available
+    monkeypatch.setenv( "MRPACKMODCACHE",str(tmp_path) )
+    monkeypatch.setattr( parallel,"available_cpus",lambda:16 )
+    monkeypatch.setattr( parallel,"available_memory",lambda:8<<30 )
+    monkeypatch.setattr( os,"getloadavg",lambda:( 0.,0.,0. ) )
+    return { "package":"Foo", "packageversion":"1.0", "terminal":None, }
+
+def test_explicit_jcount_is_kept( node ):
+    assert parallel.resolve_jcount( "12",**node )=="12"
+
+def test_auto_without_history( node ):
+    # 8G at 1G per job with a margin
+    assert parallel.resolve_jcount( "auto",**node )=="6"
+
+def test_auto_with_history( node ):
+    os.makedirs( os.path.dirname( parallel.history_file( "foo" ) ) )
+    with open( parallel.history_file( "foo" ),"w" ) as history:
+        json.dump( [ { "version":"0.9", "jobs":6, "peakrss":256<<20, }, ],history )
+    assert parallel.resolve_jcount( "AUTO",**node )=="16"
+
+def test_auto_under_load( node,monkeypatch ):
+    monkeypatch.setattr( os,"getloadavg",lambda:( 12.,0.,0. ) )
+    assert parallel.resolve_jcount( "auto",**{ k:v for k,v in node.items() if k!="package" } )=="5"
+
+@pytest.fixture
+def cgroups( tmp_path,monkeypatch ):
+    monkeypatch.setattr( parallel,"cgroup_root",str(tmp_path) )
+    monkeypatch.setattr( parallel,"proc_cgroup",str( tmp_path/"self" ) )
+    monkeypatch.setattr( os,"sched_getaffinity",lambda pid:set( range(64) ) )
+    def write( path,contents ):
+        os.makedirs( os.path.dirname( f"{tmp_path}/{path}" ),exist_ok=True )
+        with open( f"{tmp_path}/{path}","w" ) as f:
+            f.write( contents )
+    return write
+
+def test_cgroup_v2_limits_of_our_own_cgroup( cgroups ):
+    # a Slurm job step: the tightest limit is on the job, not on the step or at the root
+    cgroups( "self","0::/slurm/job_1/step_0\n" )
+    cgroups( "cgroup.controllers","cpu memory\n" )
+    cgroups( "cpu.max","max 100000\n" )
+    cgroups( "slurm/job_1/cpu.max","800000 100000\n" )
+    cgroups( "slurm/job_1/step_0/cpu.max","max 100000\n" )
+    cgroups( "slurm/job_1/memory.max",f"{4<<30}\n" )
+    cgroups( "slurm/job_1/memory.current",f"{1<<30}\n" )
+    cgroups( "slurm/job_1/step_0/memory.max","max\n" )
+    cgroups( "slurm/job_1/step_0/memory.current",f"{1<<30}\n" )
+    assert parallel.available_cpus()==8
+    assert parallel.available_memory()<=3<<30
+
+def test_cgroup_v1_limits( cgroups ):
+    cgroups( "self","4:memory:/job\n1:cpu,cpuacct:/job\n0::/\n" )
+    cgroups( "cpu,cpuacct/job/cpu.cfs_quota_us","400000\n" )
+    cgroups( "cpu,cpuacct/job/cpu.cfs_period_us","100000\n" )
+    cgroups( "cpu,cpuacct/cpu.cfs_quota_us","-1\n" )
+    cgroups( "cpu,cpuacct/cpu.cfs_period_us","100000\n" )
+    cgroups( "memory/job/memory.limit_in_bytes",f"{2<<30}\n" )
+    cgroups( "memory/job/memory.usage_in_bytes",f"{1<<30}\n" )
+    assert parallel.available_cpus()==4
+    assert parallel.available_memory()<=1<<30
@@ -0,0 +1,66 @@
+import pytest
+
+import search
+
+@pytest.fixture
+def indexed( tmp_path,monkeypatch ):
+    monkeypatch.setenv( "MRPACKMODCACHE",str( tmp_path/"cache" ) )
+    srcdir = tmp_path/"src"
+    ( srcdir/"lib" ).mkdir( parents=True )
+    ( srcdir/"lib"/"comm.c" ).write_text( "int MPI_Comm_f2c( int comm );\n" )
+    ( srcdir/"lib"/"util.c" ).write_text( "static int helper_value;\n" )
+    ( srcdir/"main.c" ).write_text( "int main() { return helper_value; }\n" )
+    search.build_search_index( str(srcdir),terminal=None )
+    return str(srcdir),search.read_search_index( str(srcdir) )
+
+def candidates( index,pattern,fixed=False ):
+    fileids = search.candidate_files( index,search.required_fragments( pattern,fixed ) )
+    if fileids is None:
+        return None
+    files = index["files"].split( "\n" )
+    return sorted( files[i] for i in fileids )
+
+def test_required_fragments():
+    assert search.required_fragments( "MPI_Comm_f2c",False )==[ b"mpi_comm_f2c" ]
+    assert search.required_fragments( "help.*value",False )==[ b"help",b"value" ]
+    assert search.required_fragments( "a.c",True )==[]
+
+def test_required_fragments_give_up():
+    assert search.required_fragments( "foo|bar",False )==[]
+    assert search.required_fragments( r"foo\w+",False )==[]
+    # the first `]` is in the class
+    assert search.required_fragments( "[]abc]xyz",False )==[]
+    assert search.required_fragments( "[^]abc]xyz",False )==[]
+
+def test_candidate_files( indexed ):
+    srcdir,index = indexed
+    assert candidates( index,"Comm_f2c" )==[ "lib/comm.c" ]
+    assert candidates( index,"helper_val" )==[ "lib/util.c","main.c" ]
+    assert candidates( index,"helper.*comm" )==[]
+    assert candidates( index,"x|y" ) is None
+
+def test_changed_files( indexed ):
+    srcdir,index = indexed
+    assert search.changed_files( index,srcdir )==[]
+    # an edit in place does not change the mtime of the directory
+    with open( f"{srcdir}/lib/util.c","a" ) as f:
+        f.write( "int MPI_Comm_f2c;\n" )
+    open( f"{srcdir}/new.c","w" ).close()
+    assert sorted( search.changed_files( index,srcdir ) )==[ "lib/util.c","new.c" ]
+
+def test_parse_arguments():
+    assert search.parse_arguments( "-w -l MPI_Comm_f2c" )==( { "w","l" },"MPI_Comm_f2c" )
+    assert search.parse_arguments( "-- -n" )==( set(),"-n" )
+    with pytest.raises( Exception ):
+        search.parse_arguments( "-n MPI_Init" )
+
+def test_basic_and_extended_patterns():
+    assert search.python_regex( r"foo\(a\|b\)" )=="foo(a|b)"
+    assert search.python_regex( "MPI_Init(" )==r"MPI_Init\("
+    assert search.python_regex( "a+b" )==r"a\+b"
+    assert search.python_regex( "a+b",extended=True )=="a+b"
+    assert search.python_regex( "[[:digit:]]x",extended=True )=="[0-9]x"
+    assert search.python_regex( r"\<int\>" )==r"\bint\b"
+    # a ] at the start of a class, and a backslash in it, are members
+    assert search.python_regex( r"[]a\]" )==r"[\]a\\]"
+    assert search.required_fragments( search.python_regex( "MPI_Init(" ),False )==[ b"mpi_init" ]
@@ -0,0 +1,16 @@
+import os
+
+import config
+import process
+import stack
+
+def test_bad_package_is_skipped( tmp_path,monkeypatch ):
+    for package in [ "bad","good", ]:
+        ( tmp_path/package ).mkdir()
+        ( tmp_path/package/"Configuration" ).write_text( f"package = {package}\n" )
+    def read_config( configfile,tracing=False ):
+        if os.path.basename( os.getcwd() )=="bad":
+            process.error_abort( "must have non-null keyword: system" )
+        return { "package":"good", "modules":"", }
+    monkeypatch.setattr( config,"read_config",read_config )
+    assert list( stack.stack_packages( str(tmp_path),"Configuration",terminal=None ) )==[ "good" ]